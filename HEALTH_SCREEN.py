@@ -1,228 +1,76 @@
 import pandas as pd
 import numpy as np
 from report_generator import generate_report
+from health_metrics import (BLOOD_PRESSURE, BLOOD_SUGAR, CHOLESTEROL, BMI, AGE_LABELS,
+                            categorize, categorize_age, normalize_urine_results, summarize_categories)
+from screening_data import load_workbook, load_dataset
 
-def analyze_blood_pressure(data_df):
+def _category_results(summary):
     """
-    Analyzes blood pressure data and categorizes it into ranges
+    Converts a category summary from health_metrics.summarize_categories
+    into the plain dictionaries used by the report generator
     """
-    # Define blood pressure categories
-    def categorize_bp(row):
-        systolic = row['SYSTOLIC']
-        diastolic = row['DIASTOLIC']
-        
-        if systolic < 100 or diastolic < 60:
-            return 'LOW'
-        elif systolic > 160 or diastolic > 99:
-            return 'HIGH'
-        elif (141 <= systolic <= 160) or (91 <= diastolic <= 99):
-            return 'MODERATE HIGH'
-        else:
-            return 'NORMAL'
-    
-    # Add BP category column
-    data_df['BP_CATEGORY'] = data_df.apply(categorize_bp, axis=1)
-    
-    # Calculate overall distribution
-    bp_distribution = data_df['BP_CATEGORY'].value_counts()
-    bp_distribution_pct = (bp_distribution / len(data_df) * 100).round(2)
-    
-    # Calculate distribution by gender
-    bp_by_gender = data_df.groupby(['GENDER', 'BP_CATEGORY']).size().unstack(fill_value=0)
-    bp_by_gender_pct = (bp_by_gender.div(bp_by_gender.sum(axis=1), axis=0) * 100).round(2)
-    
-    # Calculate average age by BP category
-    avg_age_by_bp = data_df.groupby('BP_CATEGORY')['AGE'].mean().round(2)
-    
-    print("\nBlood Pressure Analysis:")
-    print("\nOverall Distribution:")
-    for category, count in bp_distribution.items():
-        print(f"{category}: {count} ({bp_distribution_pct[category]}%)")
-    
-    print("\nDistribution by Gender:")
-    print(bp_by_gender_pct)
-    
-    print("\nAverage Age by BP Category:")
-    print(avg_age_by_bp)
-    
     return {
-        'distribution': bp_distribution.to_dict(),
-        'distribution_pct': bp_distribution_pct.to_dict(),
-        'by_gender': bp_by_gender.to_dict(),
-        'by_gender_pct': bp_by_gender_pct.to_dict(),
-        'avg_age': avg_age_by_bp.to_dict()
+        'distribution': summary['distribution'].to_dict(),
+        'distribution_pct': summary['distribution_pct'].to_dict(),
+        'by_gender': summary['by_gender'].to_dict(),
+        'by_gender_pct': summary['by_gender_pct'].to_dict(),
+        'avg_age': summary['avg_age'].to_dict()
     }
 
-def analyze_blood_sugar(data_df):
+def _print_category_analysis(title, category_label, summary):
     """
-    Analyzes blood sugar data and categorizes it into ranges
+    Prints the distribution, gender breakdown and average ages of a category summary
     """
-    # Define blood sugar categories
-    def categorize_glucose(reading):
-        if reading > 125:
-            return 'DIABETIC'
-        elif 100 <= reading <= 125:
-            return 'PRE_DIABETIC'
-        else:
-            return 'NORMAL'
-    
-    # Add glucose category column
-    data_df['GLUCOSE_CATEGORY'] = data_df['BLOOD GLUCOSE'].apply(categorize_glucose)
-    
-    # Calculate overall distribution
-    glucose_distribution = data_df['GLUCOSE_CATEGORY'].value_counts()
-    glucose_distribution_pct = (glucose_distribution / len(data_df) * 100).round(2)
-    
-    # Calculate distribution by gender
-    glucose_by_gender = data_df.groupby(['GENDER', 'GLUCOSE_CATEGORY']).size().unstack(fill_value=0)
-    glucose_by_gender_pct = (glucose_by_gender.div(glucose_by_gender.sum(axis=1), axis=0) * 100).round(2)
-    
-    # Calculate average age by glucose category
-    avg_age_by_glucose = data_df.groupby('GLUCOSE_CATEGORY')['AGE'].mean().round(2)
-    
-    print("\nBlood Sugar Analysis:")
+    print(f"\n{title} Analysis:")
     print("\nOverall Distribution:")
-    for category, count in glucose_distribution.items():
-        print(f"{category}: {count} ({glucose_distribution_pct[category]}%)")
+    for category, count in summary['distribution'].items():
+        print(f"{category}: {count} ({summary['distribution_pct'][category]}%)")
     
     print("\nDistribution by Gender:")
-    print(glucose_by_gender_pct)
-    
-    print("\nAverage Age by Blood Sugar Category:")
-    print(avg_age_by_glucose)
+    print(summary['by_gender_pct'])
     
-    return {
-        'distribution': glucose_distribution.to_dict(),
-        'distribution_pct': glucose_distribution_pct.to_dict(),
-        'by_gender': glucose_by_gender.to_dict(),
-        'by_gender_pct': glucose_by_gender_pct.to_dict(),
-        'avg_age': avg_age_by_glucose.to_dict()
-    }
+    print(f"\nAverage Age by {category_label}:")
+    print(summary['avg_age'])
 
-def analyze_cholesterol(data_df):
+def _urine_categories(data_df):
     """
-    Analyzes cholesterol data and categorizes it into ranges
+    Returns the upper-cased glucose and protein results for rows where both are present
     """
-    # Define cholesterol categories
-    def categorize_cholesterol(reading):
-        if reading > 240:
-            return 'HIGH'
-        elif 200 <= reading <= 239:
-            return 'BORDERLINE HIGH'
-        else:
-            return 'NORMAL'
-    
-    # Add cholesterol category column
-    data_df['CHOLESTEROL_CATEGORY'] = data_df['CHOLESTEROL'].apply(categorize_cholesterol)
-    
-    # Calculate overall distribution
-    chol_distribution = data_df['CHOLESTEROL_CATEGORY'].value_counts()
-    chol_distribution_pct = (chol_distribution / len(data_df) * 100).round(2)
-    
-    # Calculate distribution by gender
-    chol_by_gender = data_df.groupby(['GENDER', 'CHOLESTEROL_CATEGORY']).size().unstack(fill_value=0)
-    chol_by_gender_pct = (chol_by_gender.div(chol_by_gender.sum(axis=1), axis=0) * 100).round(2)
-    
-    # Calculate average age by cholesterol category
-    avg_age_by_chol = data_df.groupby('CHOLESTEROL_CATEGORY')['AGE'].mean().round(2)
-    
-    print("\nCholesterol Analysis:")
-    print("\nOverall Distribution:")
-    for category, count in chol_distribution.items():
-        print(f"{category}: {count} ({chol_distribution_pct[category]}%)")
-    
-    print("\nDistribution by Gender:")
-    print(chol_by_gender_pct)
-    
-    print("\nAverage Age by Cholesterol Category:")
-    print(avg_age_by_chol)
-    
-    return {
-        'distribution': chol_distribution.to_dict(),
-        'distribution_pct': chol_distribution_pct.to_dict(),
-        'by_gender': chol_by_gender.to_dict(),
-        'by_gender_pct': chol_by_gender_pct.to_dict(),
-        'avg_age': avg_age_by_chol.to_dict()
-    }
+    has_result = data_df['GLUCOSE'].notna() & data_df['PROTEIN'].notna()
+    glucose = data_df['GLUCOSE'].where(has_result).str.upper()
+    protein = data_df['PROTEIN'].where(has_result).str.upper()
+    return glucose, protein, int(has_result.sum())
 
-def analyze_bmi(data_df):
+def _summarize_urine(glucose_summary, protein_summary, total, verbose=False):
     """
-    Analyzes BMI data and categorizes it into ranges
+    Returns the urine analysis results dictionary, printing it when verbose
+    Percentages are relative to every row with both results present
     """
-    # Define BMI categories
-    def categorize_bmi(bmi):
-        if bmi > 30:
-            return 'OBESITY'
-        elif 25 <= bmi <= 30:
-            return 'OVERWEIGHT'
-        elif 18.5 <= bmi <= 25:
-            return 'NORMAL'
-        else:
-            return 'BELOW NORMAL'
-    
-    # Add BMI category column
-    data_df['BMI_CATEGORY'] = data_df['BMI'].apply(categorize_bmi)
-    
-    # Calculate overall distribution
-    bmi_distribution = data_df['BMI_CATEGORY'].value_counts()
-    bmi_distribution_pct = (bmi_distribution / len(data_df) * 100).round(2)
-    
-    # Calculate distribution by gender
-    bmi_by_gender = data_df.groupby(['GENDER', 'BMI_CATEGORY']).size().unstack(fill_value=0)
-    bmi_by_gender_pct = (bmi_by_gender.div(bmi_by_gender.sum(axis=1), axis=0) * 100).round(2)
-    
-    # Calculate average age by BMI category
-    avg_age_by_bmi = data_df.groupby('BMI_CATEGORY')['AGE'].mean().round(2)
-    
-    print("\nBMI Analysis:")
-    print("\nOverall Distribution:")
-    for category, count in bmi_distribution.items():
-        print(f"{category}: {count} ({bmi_distribution_pct[category]}%)")
+    glucose_distribution = glucose_summary['distribution']
+    glucose_distribution_pct = (glucose_distribution / total * 100).round(2)
+    protein_distribution = protein_summary['distribution']
+    protein_distribution_pct = (protein_distribution / total * 100).round(2)
     
-    print("\nDistribution by Gender:")
-    print(bmi_by_gender_pct)
+    if verbose:
+        _print_urine_analysis(glucose_summary, protein_summary, glucose_distribution_pct, protein_distribution_pct)
     
-    print("\nAverage Age by BMI Category:")
-    print(avg_age_by_bmi)
+    glucose_results = _category_results(glucose_summary)
+    glucose_results['distribution_pct'] = glucose_distribution_pct.to_dict()
+    protein_results = _category_results(protein_summary)
+    protein_results['distribution_pct'] = protein_distribution_pct.to_dict()
     
     return {
-        'distribution': bmi_distribution.to_dict(),
-        'distribution_pct': bmi_distribution_pct.to_dict(),
-        'by_gender': bmi_by_gender.to_dict(),
-        'by_gender_pct': bmi_by_gender_pct.to_dict(),
-        'avg_age': avg_age_by_bmi.to_dict()
+        'glucose': glucose_results,
+        'protein': protein_results
     }
 
-def analyze_urine(data_df):
+def _print_urine_analysis(glucose_summary, protein_summary, glucose_distribution_pct, protein_distribution_pct):
     """
-    Analyzes urine data for glucose and protein presence
-    Results are binary: POSITIVE or NEGATIVE
+    Prints the urine result distributions, gender breakdowns and average ages
     """
-    # Convert results to uppercase and standardize
-    data_df['GLUCOSE'] = data_df['GLUCOSE'].str.upper()
-    data_df['PROTEIN'] = data_df['PROTEIN'].str.upper()
-    
-    # Calculate glucose distribution
-    glucose_distribution = data_df['GLUCOSE'].value_counts()
-    glucose_distribution_pct = (glucose_distribution / len(data_df) * 100).round(2)
-    
-    # Calculate protein distribution
-    protein_distribution = data_df['PROTEIN'].value_counts()
-    protein_distribution_pct = (protein_distribution / len(data_df) * 100).round(2)
-    
-    # Calculate distribution by gender for glucose
-    glucose_by_gender = data_df.groupby(['GENDER', 'GLUCOSE']).size().unstack(fill_value=0)
-    glucose_by_gender_pct = (glucose_by_gender.div(glucose_by_gender.sum(axis=1), axis=0) * 100).round(2)
-    
-    # Calculate distribution by gender for protein
-    protein_by_gender = data_df.groupby(['GENDER', 'PROTEIN']).size().unstack(fill_value=0)
-    protein_by_gender_pct = (protein_by_gender.div(protein_by_gender.sum(axis=1), axis=0) * 100).round(2)
-    
-    # Calculate average age by glucose result
-    avg_age_by_glucose = data_df.groupby('GLUCOSE')['AGE'].mean().round(2)
-    
-    # Calculate average age by protein result
-    avg_age_by_protein = data_df.groupby('PROTEIN')['AGE'].mean().round(2)
+    glucose_distribution = glucose_summary['distribution']
+    protein_distribution = protein_summary['distribution']
     
     print("\nUrine Analysis:")
     print("\nGlucose Distribution:")
@@ -238,35 +86,97 @@ def analyze_urine(data_df):
         print(f"Protein {result}: {count} ({pct}%)")
     
     print("\nGlucose Distribution by Gender:")
-    print(glucose_by_gender_pct)
+    print(glucose_summary['by_gender_pct'])
     
     print("\nProtein Distribution by Gender:")
-    print(protein_by_gender_pct)
+    print(protein_summary['by_gender_pct'])
     
     print("\nAverage Age by Glucose Result:")
-    print(avg_age_by_glucose)
+    print(glucose_summary['avg_age'])
     
     print("\nAverage Age by Protein Result:")
-    print(avg_age_by_protein)
+    print(protein_summary['avg_age'])
+
+def analyze_blood_pressure(data_df, verbose=False):
+    """
+    Analyzes blood pressure data and categorizes it into ranges
+    Tables are only printed when verbose is True
+    """
+    # Add BP category column
+    data_df['BP_CATEGORY'] = categorize(data_df, BLOOD_PRESSURE)
     
-    return {
-        'glucose': {
-            'distribution': glucose_distribution.to_dict(),
-            'distribution_pct': glucose_distribution_pct.to_dict(),
-            'by_gender': glucose_by_gender.to_dict(),
-            'by_gender_pct': glucose_by_gender_pct.to_dict(),
-            'avg_age': avg_age_by_glucose.to_dict()
-        },
-        'protein': {
-            'distribution': protein_distribution.to_dict(),
-            'distribution_pct': protein_distribution_pct.to_dict(),
-            'by_gender': protein_by_gender.to_dict(),
-            'by_gender_pct': protein_by_gender_pct.to_dict(),
-            'avg_age': avg_age_by_protein.to_dict()
-        }
-    }
+    # Calculate overall distribution, distribution by gender and average age by BP category
+    summary = summarize_categories(data_df, {'BP_CATEGORY': data_df['BP_CATEGORY']})['BP_CATEGORY']
+    
+    if verbose:
+        _print_category_analysis("Blood Pressure", "BP Category", summary)
+    
+    return _category_results(summary)
+
+def analyze_blood_sugar(data_df, verbose=False):
+    """
+    Analyzes blood sugar data and categorizes it into ranges
+    Tables are only printed when verbose is True
+    """
+    # Add glucose category column
+    data_df['GLUCOSE_CATEGORY'] = categorize(data_df, BLOOD_SUGAR)
+    
+    # Calculate overall distribution, distribution by gender and average age by glucose category
+    summary = summarize_categories(data_df, {'GLUCOSE_CATEGORY': data_df['GLUCOSE_CATEGORY']})['GLUCOSE_CATEGORY']
+    
+    if verbose:
+        _print_category_analysis("Blood Sugar", "Blood Sugar Category", summary)
+    
+    return _category_results(summary)
+
+def analyze_cholesterol(data_df, verbose=False):
+    """
+    Analyzes cholesterol data and categorizes it into ranges
+    Tables are only printed when verbose is True
+    """
+    # Add cholesterol category column
+    data_df['CHOLESTEROL_CATEGORY'] = categorize(data_df, CHOLESTEROL)
+    
+    # Calculate overall distribution, distribution by gender and average age by cholesterol category
+    summary = summarize_categories(data_df, {'CHOLESTEROL_CATEGORY': data_df['CHOLESTEROL_CATEGORY']})['CHOLESTEROL_CATEGORY']
+    
+    if verbose:
+        _print_category_analysis("Cholesterol", "Cholesterol Category", summary)
+    
+    return _category_results(summary)
+
+def analyze_bmi(data_df, verbose=False):
+    """
+    Analyzes BMI data and categorizes it into ranges
+    Tables are only printed when verbose is True
+    """
+    # Add BMI category column
+    data_df['BMI_CATEGORY'] = categorize(data_df, BMI)
+    
+    # Calculate overall distribution, distribution by gender and average age by BMI category
+    summary = summarize_categories(data_df, {'BMI_CATEGORY': data_df['BMI_CATEGORY']})['BMI_CATEGORY']
+    
+    if verbose:
+        _print_category_analysis("BMI", "BMI Category", summary)
+    
+    return _category_results(summary)
+
+def analyze_urine(data_df, verbose=False):
+    """
+    Analyzes urine data for glucose and protein presence
+    Results are binary: POSITIVE or NEGATIVE
+    Tables are only printed when verbose is True
+    """
+    # Convert results to uppercase and standardize
+    data_df['GLUCOSE'] = data_df['GLUCOSE'].str.upper()
+    data_df['PROTEIN'] = data_df['PROTEIN'].str.upper()
+    
+    # Calculate distributions, distributions by gender and average ages for both results
+    summaries = summarize_categories(data_df, {'GLUCOSE': data_df['GLUCOSE'], 'PROTEIN': data_df['PROTEIN']})
+    
+    return _summarize_urine(summaries['GLUCOSE'], summaries['PROTEIN'], len(data_df), verbose)
 
-def analyze_staff_data(file_path, company_name):
+def analyze_staff_data(file_path, company_name, verbose=False):
     """
     Analyzes staff data from an Excel workbook to extract:
     1. Total number of staff
@@ -279,15 +189,20 @@ def analyze_staff_data(file_path, company_name):
     8. BMI analysis
     9. Urine analysis
     
+    All category columns are aggregated together in a single pass over the
+    full frame instead of one groupby per metric on a filtered copy.
+    
     Parameters:
     file_path (str): Path to the Excel workbook
     company_name (str): Name of the company for the report
+    verbose (bool): Print every analysis table to the console. Batch and
+        web callers leave this off so no pandas formatting is done at all
     
     Returns:
     dict: Analysis results
     """
-    # Read the Excel file
-    data_df = pd.read_excel(file_path)
+    # Read the Excel file (parsed once per workbook content, then served from the ingest cache)
+    data_df = load_workbook(file_path)
     
     # Convert numeric columns to float, but keep all rows
     numeric_columns = ['AGE', 'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI']
@@ -306,49 +221,68 @@ def analyze_staff_data(file_path, company_name):
     has_urine = False
     if 'GLUCOSE' in data_df.columns and 'PROTEIN' in data_df.columns:
         # Clean whitespace and empty strings to NaN, and standardize casing
-        def _clean_urine_value(val):
-            if isinstance(val, str):
-                stripped = val.strip()
-                if stripped == "":
-                    return pd.NA
-                return stripped.upper()
-            return val
-        data_df['GLUCOSE'] = data_df['GLUCOSE'].apply(_clean_urine_value)
-        data_df['PROTEIN'] = data_df['PROTEIN'].apply(_clean_urine_value)
+        data_df['GLUCOSE'] = normalize_urine_results(data_df['GLUCOSE'])
+        data_df['PROTEIN'] = normalize_urine_results(data_df['PROTEIN'])
         # Determine if there is at least one row with both glucose and protein present
-        urine_non_empty = data_df.dropna(subset=['GLUCOSE', 'PROTEIN'])
-        has_urine = len(urine_non_empty) > 0
+        has_urine = bool((data_df['GLUCOSE'].notna() & data_df['PROTEIN'].notna()).any())
+    
+    # Determine availability flags for all metrics
+    has_bp_reading = data_df['SYSTOLIC'].notna() & data_df['DIASTOLIC'].notna()
+    has_bp = bool(has_bp_reading.any())
+    has_glucose = bool(data_df['BLOOD GLUCOSE'].notna().any())
+    has_bmi = bool(data_df['BMI'].notna().any())
+    
+    # Categorize every metric over the full frame, leaving rows without a
+    # reading as missing so the aggregation skips them
+    data_df['AGE_GROUP'] = categorize_age(data_df['AGE'])
+    categories = {
+        'GENDER': data_df['GENDER'],
+        'AGE_GROUP': data_df['AGE_GROUP']
+    }
+    if has_bp:
+        categories['BP_CATEGORY'] = categorize(data_df, BLOOD_PRESSURE).where(has_bp_reading)
+    if has_glucose:
+        categories['GLUCOSE_CATEGORY'] = categorize(data_df, BLOOD_SUGAR).where(data_df['BLOOD GLUCOSE'].notna())
+    if has_cholesterol:
+        categories['CHOLESTEROL_CATEGORY'] = categorize(data_df, CHOLESTEROL).where(data_df['CHOLESTEROL'].notna())
+    if has_bmi:
+        categories['BMI_CATEGORY'] = categorize(data_df, BMI).where(data_df['BMI'].notna())
+    if has_urine:
+        urine_glucose, urine_protein, urine_total = _urine_categories(data_df)
+        categories['GLUCOSE'] = urine_glucose
+        categories['PROTEIN'] = urine_protein
+    
+    # Single aggregation stage for every distribution, gender cross-tab and average age
+    summaries = summarize_categories(data_df, categories)
     
     # 1. Calculate total number of staff
     total_staff = len(data_df)
-    print(f"Total number of staff: {total_staff}")
+    if verbose:
+        print(f"Total number of staff: {total_staff}")
     
     # 2. Calculate gender distribution
-    gender_counts = data_df['GENDER'].value_counts()
+    gender_counts = summaries['GENDER']['distribution']
     gender_distribution = pd.DataFrame({
         'GENDER': gender_counts.index,
         'NO OF STAFF': gender_counts.values,
         '%OF TOTAL': (gender_counts.values / total_staff * 100).round(2)
     })
-    print("\nGender Distribution:")
-    print(gender_distribution)
+    if verbose:
+        print("\nGender Distribution:")
+        print(gender_distribution)
     
     # Calculate average age by gender
-    avg_age_by_gender = data_df.groupby('GENDER')['AGE'].mean().round(2)
-    print("\nAverage Age by Gender:")
-    print(avg_age_by_gender)
-    
-    # 3. Calculate age distribution with bins
-    age_bins = [0, 20, 30, 40, 50, 60, 70]
-    age_labels = ['0-20', '21-30', '31-40', '41-50', '51-60', '61-70']
-    data_df['AGE_GROUP'] = pd.cut(data_df['AGE'], bins=age_bins, labels=age_labels, right=True)
+    avg_age_by_gender = summaries['GENDER']['avg_age']
+    if verbose:
+        print("\nAverage Age by Gender:")
+        print(avg_age_by_gender)
     
-    # Calculate age distribution by gender
-    age_by_gender = data_df.groupby(['GENDER', 'AGE_GROUP']).size().unstack(fill_value=0)
-    age_by_gender_pct = (age_by_gender.div(age_by_gender.sum(axis=1), axis=0) * 100).round(2)
+    # 3. Calculate age distribution with bins and by gender
+    age_by_gender = summaries['AGE_GROUP']['by_gender']
+    age_by_gender_pct = summaries['AGE_GROUP']['by_gender_pct']
     
     # Calculate overall age distribution
-    age_distribution = data_df['AGE_GROUP'].value_counts().reindex(age_labels, fill_value=0)
+    age_distribution = summaries['AGE_GROUP']['distribution'].reindex(AGE_LABELS, fill_value=0)
     age_distribution_pct = (age_distribution / len(data_df) * 100).round(2)
     
     age_distribution_data = {
@@ -359,48 +293,47 @@ def analyze_staff_data(file_path, company_name):
         'Average Age by Gender': avg_age_by_gender.to_dict()
     }
     
-    print("\nAge Distribution:")
-    print("Overall Distribution:")
-    for age_group, count in age_distribution.items():
-        print(f"{age_group}: {count} ({age_distribution_pct[age_group]}%)")
-    
-    print("\nDistribution by Gender:")
-    print(age_by_gender_pct)
-    
-    # Determine availability flags for all metrics
-    has_bp = data_df[['SYSTOLIC', 'DIASTOLIC']].dropna(how='any').shape[0] > 0
-    has_glucose = data_df['BLOOD GLUCOSE'].dropna().shape[0] > 0
-    has_bmi = data_df['BMI'].dropna().shape[0] > 0
+    if verbose:
+        print("\nAge Distribution:")
+        print("Overall Distribution:")
+        for age_group, count in age_distribution.items():
+            print(f"{age_group}: {count} ({age_distribution_pct[age_group]}%)")
+        
+        print("\nDistribution by Gender:")
+        print(age_by_gender_pct)
 
     # 5. Blood Pressure Analysis - only for rows with valid BP data
     bp_analysis = None
     if has_bp:
-        bp_data = data_df.dropna(subset=['SYSTOLIC', 'DIASTOLIC'])
-        bp_analysis = analyze_blood_pressure(bp_data)
+        if verbose:
+            _print_category_analysis("Blood Pressure", "BP Category", summaries['BP_CATEGORY'])
+        bp_analysis = _category_results(summaries['BP_CATEGORY'])
     
     # 6. Blood Sugar Analysis - only for rows with valid glucose data
     glucose_analysis = None
     if has_glucose:
-        glucose_data = data_df.dropna(subset=['BLOOD GLUCOSE'])
-        glucose_analysis = analyze_blood_sugar(glucose_data)
+        if verbose:
+            _print_category_analysis("Blood Sugar", "Blood Sugar Category", summaries['GLUCOSE_CATEGORY'])
+        glucose_analysis = _category_results(summaries['GLUCOSE_CATEGORY'])
     
     # 7. Cholesterol Analysis - only for rows with valid cholesterol data
     chol_analysis = None
     if has_cholesterol:
-        chol_data = data_df.dropna(subset=['CHOLESTEROL'])
-        chol_analysis = analyze_cholesterol(chol_data)
+        if verbose:
+            _print_category_analysis("Cholesterol", "Cholesterol Category", summaries['CHOLESTEROL_CATEGORY'])
+        chol_analysis = _category_results(summaries['CHOLESTEROL_CATEGORY'])
     
     # 8. BMI Analysis - only for rows with valid BMI data
     bmi_analysis = None
     if has_bmi:
-        bmi_data = data_df.dropna(subset=['BMI'])
-        bmi_analysis = analyze_bmi(bmi_data)
+        if verbose:
+            _print_category_analysis("BMI", "BMI Category", summaries['BMI_CATEGORY'])
+        bmi_analysis = _category_results(summaries['BMI_CATEGORY'])
     
     # 9. Urine Analysis - only for rows with valid urine data
     urine_analysis = None
     if has_urine:
-        urine_data = data_df.dropna(subset=['GLUCOSE', 'PROTEIN'])
-        urine_analysis = analyze_urine(urine_data)
+        urine_analysis = _summarize_urine(summaries['GLUCOSE'], summaries['PROTEIN'], urine_total, verbose)
     
     results = {
         'company_name': company_name,
@@ -424,36 +357,23 @@ def analyze_staff_data(file_path, company_name):
 def get_individual_data(file_path, enrollee_id):
     """
     Gets individual data from Excel file based on enrollee ID
+    Numeric columns are already coerced by the ingest layer; PSA keeps its
+    text (POSITIVE/NEGATIVE) or numeric value as read
     """
-    data_df = pd.read_excel(file_path)
+    individual_data = load_dataset(file_path).get(enrollee_id)
     
-    # Find the row with the matching enrollee ID
-    individual_row = data_df[data_df['ENROLLEE ID'] == enrollee_id]
-    
-    if individual_row.empty:
+    if individual_data is None:
         raise ValueError(f"No individual found with Enrollee ID: {enrollee_id}")
     
-    # Convert to dictionary for easier access
-    individual_data = individual_row.iloc[0].to_dict()
-    
-    # Convert numeric columns (excluding PSA which can be text like POSITIVE/NEGATIVE)
-    numeric_columns = ['AGE', 'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI', 'CHOLESTEROL']
-    for col in numeric_columns:
-        if col in individual_data and pd.notna(individual_data[col]):
-            individual_data[col] = pd.to_numeric(individual_data[col], errors='coerce')
-    
-    # Handle PSA separately - it can be text (POSITIVE/NEGATIVE) or numeric
-    if 'PSA' in individual_data and pd.notna(individual_data['PSA']):
-        psa_value = individual_data['PSA']
-        if isinstance(psa_value, str):
-            # Keep as string if it's POSITIVE/NEGATIVE
-            individual_data['PSA'] = psa_value
-        else:
-            # Convert to numeric if it's a number
-            individual_data['PSA'] = pd.to_numeric(psa_value, errors='coerce')
-    
     return individual_data
 
+def get_individuals_data(file_path, enrollee_ids):
+    """
+    Gets data for several enrollees from Excel file with a single indexed lookup
+    Returns records in the order of enrollee_ids, with None for unknown IDs
+    """
+    return load_dataset(file_path).get_many(enrollee_ids)
+
 def analyze_individual_health(individual_data):
     """
     Analyzes individual health data and provides personalized insights
@@ -611,11 +531,13 @@ def get_individual_info():
     if not file_path:
         file_path = 'VACCIPHARM.xlsx'  # Default file
     
-    enrollee_id = input("Enter the Enrollee ID: ").strip()
-    if not enrollee_id:
+    # Several reports can be generated in one go from a comma-separated list
+    enrollee_ids = [enrollee_id.strip() for enrollee_id in input("Enter the Enrollee ID(s), comma-separated: ").split(',')]
+    enrollee_ids = [enrollee_id for enrollee_id in enrollee_ids if enrollee_id]
+    if not enrollee_ids:
         raise ValueError("Enrollee ID is required")
     
-    return file_path, enrollee_id
+    return file_path, enrollee_ids
 
 if __name__ == "__main__":
     while True:
@@ -628,7 +550,7 @@ if __name__ == "__main__":
                 output_path = f"reports/{company_name.replace(' ', '_')}_Health_Screening_Report.pdf"
                 
                 print(f"\nGenerating company report for {company_name}...")
-                results = analyze_staff_data(file_path, company_name)
+                results = analyze_staff_data(file_path, company_name, verbose=True)
                 print("Data analysis completed successfully!")
                 
                 report_path = generate_report(results, output_path)
@@ -640,19 +562,26 @@ if __name__ == "__main__":
         elif choice == '2':
             # Individual Report
             try:
-                file_path, enrollee_id = get_individual_info()
-                
-                print(f"\nGenerating individual report for Enrollee ID: {enrollee_id}...")
-                individual_data = get_individual_data(file_path, enrollee_id)
-                analysis = analyze_individual_health(individual_data)
+                file_path, enrollee_ids = get_individual_info()
+                individuals_data = get_individuals_data(file_path, enrollee_ids)
                 
-                # Generate individual report using ENROLLEE ID as filename
                 from individual_report_generator import generate_individual_report
-                # Clean enrollee ID for filename by replacing special characters
-                clean_enrollee_id = enrollee_id.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                output_path = f"reports/{clean_enrollee_id}.pdf"
-                report_path = generate_individual_report(individual_data, analysis, output_path)
-                print(f"Individual report generated successfully! Path: {report_path}")
+                for enrollee_id, individual_data in zip(enrollee_ids, individuals_data):
+                    try:
+                        print(f"\nGenerating individual report for Enrollee ID: {enrollee_id}...")
+                        if individual_data is None:
+                            raise ValueError(f"No individual found with Enrollee ID: {enrollee_id}")
+                        analysis = analyze_individual_health(individual_data)
+                        
+                        # Generate individual report using ENROLLEE ID as filename
+                        # Clean enrollee ID for filename by replacing special characters
+                        clean_enrollee_id = enrollee_id.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
+                        output_path = f"reports/{clean_enrollee_id}.pdf"
+                        report_path = generate_individual_report(individual_data, analysis, output_path)
+                        print(f"Individual report generated successfully! Path: {report_path}")
+                    
+                    except Exception as e:
+                        print(f"An error occurred: {e}")
                 
             except Exception as e:
                 print(f"An error occurred: {e}")
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Background Jobs
+A local job queue backed by SQLite so long report and email runs execute
+on a worker thread, independent of the Streamlit script and its reruns
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join('.cache', 'jobs.sqlite3'))
+# Uploaded workbooks are copied here so jobs do not depend on the browser session
+JOB_FILES_DIR = os.environ.get('JOB_FILES_DIR', os.path.join('.cache', 'jobs'))
+# Jobs run one at a time by default; each one already fans out across processes
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+# Each process stamps the jobs it owns this often while it is alive
+JOB_HEARTBEAT_SECONDS = float(os.environ.get('JOB_HEARTBEAT_SECONDS', '10'))
+# A job whose owner has not stamped it for this long is taken to be orphaned
+JOB_STALE_SECONDS = float(os.environ.get('JOB_STALE_SECONDS', '60'))
+
+
+class JobContext:
+    """Handed to a job handler for reporting progress and messages back to the job table"""
+
+    def __init__(self, queue: 'JobQueue', job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    def progress(self, done: int, total: int, message: Optional[str] = None):
+        """Update the job's progress counters and status line"""
+        self.queue._update(self.job_id, progress_done=done, progress_total=total, message=message)
+
+    def notify(self, level: str, message: str):
+        """Record a message (info, success, warning or error) in the job's event log"""
+        self.queue._add_event(self.job_id, level, message)
+
+
+class JobQueue:
+    """
+    SQLite-backed queue of background jobs
+
+    Handlers are registered per job type and called as
+    handler(params, secrets, context) on a worker thread. params are stored
+    with the job; secrets (such as an SMTP password) are only held in memory
+    by the submitting process, so only that process can run the job and it
+    fails if that process goes away first. Whatever the handler returns is
+    stored as the job's JSON result.
+
+    Several app processes may share the database. Each job a process submits
+    with secrets or claims is stamped with the process as owner, and the
+    owner refreshes a heartbeat on it; only jobs whose owner has died or
+    stopped heartbeating are recovered by other processes.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.workers = max(workers, 1)
+        self._handlers: Dict[str, Callable] = {}
+        self._secrets: Dict[str, Dict[str, Any]] = {}
+        self._wakeup = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        # Host and PID let another process on this machine see at once that the owner is gone;
+        # the random part keeps a reused PID from passing for the old owner
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._create_tables()
+        self._recover_orphaned()
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection that commits on success and is always closed"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _create_tables(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    job_type TEXT NOT NULL,
+                    description TEXT,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress_done INTEGER DEFAULT 0,
+                    progress_total INTEGER DEFAULT 0,
+                    message TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    owner TEXT,
+                    heartbeat_at REAL,
+                    needs_secrets INTEGER DEFAULT 0
+                )
+            """)
+            # Job tables created before jobs had owners
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, column_type in [('owner', 'TEXT'), ('heartbeat_at', 'REAL'),
+                                        ('needs_secrets', 'INTEGER DEFAULT 0')]:
+                if column not in columns:
+                    try:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+                    except sqlite3.OperationalError as e:
+                        # Another process starting at the same time may have added it first
+                        if 'duplicate column' not in str(e):
+                            raise
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    level TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id)")
+
+    def _owner_is_dead(self, owner: Optional[str], heartbeat_at: Optional[float]) -> bool:
+        """Whether the process that owns a job has exited or stopped heartbeating"""
+        if owner is None or heartbeat_at is None:
+            # Left by a version of the queue that did not track owners
+            return True
+        if heartbeat_at < time.time() - JOB_STALE_SECONDS:
+            return True
+
+        host, pid, _ = owner.split(':', 2)
+        if host != socket.gethostname():
+            return False
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, ValueError):
+            pass
+        return False
+
+    def _recover_orphaned(self):
+        """
+        Recover jobs whose owning process is gone
+
+        Running jobs are put back in the queue, unless they need secrets: those
+        were only held by the dead process, so the job is failed instead. The
+        same goes for jobs with secrets still waiting in the queue.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT id, status, owner, heartbeat_at, needs_secrets FROM jobs
+                WHERE (status = 'running' OR (status = 'queued' AND owner IS NOT NULL))
+                AND (owner IS NULL OR owner != ?)
+            """, [self.owner]).fetchall()
+
+            requeued = failed = 0
+            for row in rows:
+                if not self._owner_is_dead(row['owner'], row['heartbeat_at']):
+                    continue
+                # Guarded on the heartbeat so a job whose owner just stamped it is left alone
+                guard = "WHERE id = ? AND status = ? AND owner IS ? AND heartbeat_at IS ?"
+                guard_args = [row['id'], row['status'], row['owner'], row['heartbeat_at']]
+                if row['needs_secrets']:
+                    failed += conn.execute(f"""
+                        UPDATE jobs SET status = 'failed', finished_at = ?, message = 'Failed', error = ?
+                        {guard}
+                    """, [_now(), "The app process holding this job's secrets stopped; please submit the job again"]
+                        + guard_args).rowcount
+                else:
+                    requeued += conn.execute(f"""
+                        UPDATE jobs SET status = 'queued', owner = NULL, heartbeat_at = NULL,
+                            message = 'Requeued after its worker stopped'
+                        {guard}
+                    """, guard_args).rowcount
+
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted jobs")
+            self._wakeup.set()
+        if failed:
+            logger.warning(f"Failed {failed} interrupted jobs whose secrets were lost")
+
+    def _heartbeat(self):
+        """Keep this process's jobs marked as alive and recover other processes' orphans"""
+        while True:
+            try:
+                with self._connect() as conn:
+                    conn.execute("""
+                        UPDATE jobs SET heartbeat_at = ?
+                        WHERE owner = ? AND status IN ('queued', 'running')
+                    """, [time.time(), self.owner])
+                self._recover_orphaned()
+            except sqlite3.Error as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+
+    def register(self, job_type: str, handler: Callable[[Dict[str, Any], Dict[str, Any], JobContext], Any]):
+        """Register (or replace) the handler for a job type"""
+        self._handlers[job_type] = handler
+        self._wakeup.set()
+
+    def start(self):
+        """Start the worker and heartbeat threads if they are not already running"""
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'job-worker-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, job_type: str, params: Dict[str, Any], secrets: Optional[Dict[str, Any]] = None,
+               description: Optional[str] = None) -> str:
+        """
+        Queue a job
+
+        Args:
+            job_type: Registered job type
+            params: JSON-serializable job parameters
+            secrets: Values the handler needs that must not be written to disk;
+                the job then only runs in this process
+            description: Human-readable label for the status page
+
+        Returns:
+            The new job's ID
+        """
+        job_id = uuid.uuid4().hex[:12]
+        if secrets:
+            self._secrets[job_id] = secrets
+
+        # Jobs with secrets belong to this process from the start, since no other can run them
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO jobs (id, job_type, description, params, status, created_at,
+                                  owner, heartbeat_at, needs_secrets)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?)
+            """, [job_id, job_type, description or job_type, json.dumps(params), _now(),
+                  self.owner if secrets else None, time.time() if secrets else None, int(bool(secrets))])
+
+        logger.info(f"Queued {job_type} job {job_id}")
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job by ID, with params and result decoded"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", [job_id]).fetchone()
+        return _job_from_row(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent jobs first"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY created_at DESC, rowid DESC LIMIT ?", [limit]).fetchall()
+        return [_job_from_row(row) for row in rows]
+
+    def get_events(self, job_id: str, limit: int = 200) -> List[Dict[str, Any]]:
+        """The latest event log entries of a job, oldest first"""
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT level, message, created_at FROM job_events
+                WHERE job_id = ? ORDER BY id DESC LIMIT ?
+            """, [job_id, limit]).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def _work(self):
+        while True:
+            job = self._claim_next()
+            if job is None:
+                self._wakeup.wait(timeout=5)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _claim_next(self) -> Optional[Dict[str, Any]]:
+        """
+        Mark the oldest queued job this process can run as running and return it
+
+        That is a job with a registered handler which either needs no secrets
+        or was submitted here, where its secrets are held.
+        """
+        if not self._handlers:
+            return None
+
+        placeholders = ', '.join('?' for _ in self._handlers)
+        with self._claim_lock, self._connect() as conn:
+            row = conn.execute(f"""
+                SELECT * FROM jobs
+                WHERE status = 'queued' AND job_type IN ({placeholders})
+                AND (COALESCE(needs_secrets, 0) = 0 OR owner = ?)
+                ORDER BY created_at, rowid LIMIT 1
+            """, list(self._handlers) + [self.owner]).fetchone()
+            if row is None:
+                return None
+            # Another app process may have claimed it between the select and the update
+            claimed = conn.execute("""
+                UPDATE jobs SET status = 'running', started_at = ?, error = NULL, owner = ?, heartbeat_at = ?
+                WHERE id = ? AND status = 'queued'
+            """, [_now(), self.owner, time.time(), row['id']]).rowcount
+        return _job_from_row(row) if claimed else None
+
+    def _run(self, job: Dict[str, Any]):
+        job_id = job['id']
+        context = JobContext(self, job_id)
+        handler = self._handlers[job['job_type']]
+        try:
+            result = handler(job['params'], self._secrets.get(job_id, {}), context)
+            self._update(job_id, status='completed', result=json.dumps(result, default=str),
+                         finished_at=_now(), message='Completed')
+            logger.info(f"Job {job_id} completed")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            context.notify('error', str(e))
+            self._update(job_id, status='failed', error=str(e), finished_at=_now(), message='Failed')
+        finally:
+            self._secrets.pop(job_id, None)
+
+    def _update(self, job_id: str, **fields):
+        fields = {name: value for name, value in fields.items() if value is not None}
+        if not fields:
+            return
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+    def _add_event(self, job_id: str, level: str, message: str):
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO job_events (job_id, level, message, created_at) VALUES (?, ?, ?, ?)
+            """, [job_id, level, message, _now()])
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def _job_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+def save_job_file(data: bytes, suffix: str) -> str:
+    """
+    Keep a copy of an uploaded file for a job to read later
+
+    Files are named by content hash, so submitting the same workbook twice
+    reuses one copy.
+
+    Returns:
+        Path of the saved file
+    """
+    os.makedirs(JOB_FILES_DIR, exist_ok=True)
+    path = os.path.join(JOB_FILES_DIR, f"{hashlib.sha256(data).hexdigest()}{suffix}")
+    if not os.path.exists(path):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    return path
+
+
+# Global job queue instance
+job_queue = None
+_job_queue_lock = threading.Lock()
+
+def get_job_queue() -> JobQueue:
+    """Get the job queue instance (singleton pattern), shared across Streamlit reruns"""
+    global job_queue
+    if job_queue is None:
+        with _job_queue_lock:
+            if job_queue is None:
+                job_queue = JobQueue()
+    return job_queue
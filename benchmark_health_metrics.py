@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the health metric categorization engine
+Compares the original row-by-row apply() categorization against the
+vectorized health_metrics tables on synthetic screening data
+
+Usage:
+    python benchmark_health_metrics.py [--sizes 10000 100000 1000000]
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from health_metrics import BLOOD_PRESSURE, BLOOD_SUGAR, CHOLESTEROL, BMI, categorize, normalize_urine_results
+
+
+# Original per-row implementations, kept here as the reference for timing
+# and for checking that the tables reproduce the same categories
+def legacy_categorize_bp(row):
+    systolic = row['SYSTOLIC']
+    diastolic = row['DIASTOLIC']
+
+    if systolic < 100 or diastolic < 60:
+        return 'LOW'
+    elif systolic > 160 or diastolic > 99:
+        return 'HIGH'
+    elif (141 <= systolic <= 160) or (91 <= diastolic <= 99):
+        return 'MODERATE HIGH'
+    else:
+        return 'NORMAL'
+
+
+def legacy_categorize_glucose(reading):
+    if reading > 125:
+        return 'DIABETIC'
+    elif 100 <= reading <= 125:
+        return 'PRE_DIABETIC'
+    else:
+        return 'NORMAL'
+
+
+def legacy_categorize_cholesterol(reading):
+    if reading > 240:
+        return 'HIGH'
+    elif 200 <= reading <= 239:
+        return 'BORDERLINE HIGH'
+    else:
+        return 'NORMAL'
+
+
+def legacy_categorize_bmi(bmi):
+    if bmi > 30:
+        return 'OBESITY'
+    elif 25 <= bmi <= 30:
+        return 'OVERWEIGHT'
+    elif 18.5 <= bmi <= 25:
+        return 'NORMAL'
+    else:
+        return 'BELOW NORMAL'
+
+
+def legacy_clean_urine_value(val):
+    if isinstance(val, str):
+        stripped = val.strip()
+        if stripped == "":
+            return pd.NA
+        return stripped.upper()
+    return val
+
+
+def make_screening_data(rows, seed=42):
+    """Build a synthetic screening DataFrame with realistic value ranges"""
+    rng = np.random.default_rng(seed)
+    data_df = pd.DataFrame({
+        'GENDER': rng.choice(['MALE', 'FEMALE'], size=rows),
+        'AGE': rng.integers(18, 70, size=rows).astype(float),
+        # Whole and half readings so the inclusive boundaries get exercised
+        'SYSTOLIC': rng.integers(80, 200, size=rows) + rng.choice([0.0, 0.5], size=rows),
+        'DIASTOLIC': rng.integers(50, 120, size=rows) + rng.choice([0.0, 0.5], size=rows),
+        'BLOOD GLUCOSE': rng.integers(60, 200, size=rows) + rng.choice([0.0, 0.5], size=rows),
+        'CHOLESTEROL': rng.integers(120, 300, size=rows) + rng.choice([0.0, 0.5], size=rows),
+        'BMI': rng.uniform(15, 40, size=rows).round(1),
+        'GLUCOSE': rng.choice([' negative', 'Positive ', 'NEGATIVE', '', None], size=rows),
+    })
+    return data_df
+
+
+def time_call(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def run_benchmark(rows):
+    data_df = make_screening_data(rows)
+    cases = [
+        ('Blood pressure',
+         lambda: data_df.apply(legacy_categorize_bp, axis=1),
+         lambda: categorize(data_df, BLOOD_PRESSURE)),
+        ('Blood sugar',
+         lambda: data_df['BLOOD GLUCOSE'].apply(legacy_categorize_glucose),
+         lambda: categorize(data_df, BLOOD_SUGAR)),
+        ('Cholesterol',
+         lambda: data_df['CHOLESTEROL'].apply(legacy_categorize_cholesterol),
+         lambda: categorize(data_df, CHOLESTEROL)),
+        ('BMI',
+         lambda: data_df['BMI'].apply(legacy_categorize_bmi),
+         lambda: categorize(data_df, BMI)),
+        ('Urine',
+         lambda: data_df['GLUCOSE'].apply(legacy_clean_urine_value),
+         lambda: normalize_urine_results(data_df['GLUCOSE'])),
+    ]
+
+    print(f"\n{rows:,} rows")
+    print(f"{'Metric':<16}{'Old (s)':>12}{'New (s)':>12}{'Speedup':>10}")
+    for name, old_path, new_path in cases:
+        old_time, old_result = time_call(old_path)
+        new_time, new_result = time_call(new_path)
+
+        if not old_result.fillna('NA').equals(new_result.fillna('NA')):
+            raise AssertionError(f"{name} categories differ between old and new paths")
+
+        speedup = old_time / new_time if new_time else float('inf')
+        print(f"{name:<16}{old_time:>12.4f}{new_time:>12.4f}{speedup:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark health metric categorization")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help="Synthetic row counts to benchmark")
+    args = parser.parse_args()
+
+    for rows in args.sizes:
+        run_benchmark(rows)
+
+
+if __name__ == "__main__":
+    main()
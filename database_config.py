@@ -5,13 +5,31 @@ Handles customer data and PDF report storage in the cloud
 """
 
 import os
+import hmac
+import time
+import weakref
+import threading
 import duckdb
 import pandas as pd
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Iterable, Set, Tuple
 import logging
+from screening_data import load_workbook
+from local_cache import MemoryCache, is_missing
 
 logger = logging.getLogger(__name__)
 
+# A thread's connection idle for longer than this is pinged before it is reused
+DB_HEALTH_CHECK_SECONDS = float(os.environ.get('DB_HEALTH_CHECK_SECONDS', '60'))
+
+def normalize_email(email) -> str:
+    """Email as stored for verification: trimmed and lower-cased"""
+    return str(email).strip().lower()
+
+def normalize_phone(phone) -> str:
+    """Phone number as stored for verification: trimmed, without a leading 0"""
+    phone = str(phone).strip()
+    return phone[1:] if phone.startswith('0') else phone
+
 class MotherDuckDB:
     def __init__(self, token: Optional[str] = None):
         """
@@ -24,19 +42,139 @@ class MotherDuckDB:
         if not self.token:
             raise ValueError("MotherDuck token is required. Set MOTHERDUCK_TOKEN environment variable.")
         
-        # Connect to MotherDuck (create database if it doesn't exist)
+        # One shared connection; each thread works through its own cursor on it
+        self._connection = self._connect()
+        self._generation = 0
+        self._connect_lock = threading.Lock()
+        self._local = threading.local()
+        # Cursors opened on the current connection
+        self._cursors = weakref.WeakSet()
+        # Connections replaced by reconnect(), by generation, with the cursors still open
+        # on them; each is closed once its last cursor is released
+        self._retired = {}
+        
+        # Customer lookups served locally; cleared whenever customers are written
+        self.customer_cache = MemoryCache()
+        
+        self._create_tables()
+    
+    def _connect(self):
+        """Open the MotherDuck connection, creating the database if it doesn't exist"""
         try:
-            self.conn = duckdb.connect(f"md:health_screening?motherduck_token={self.token}")
+            return duckdb.connect(f"md:health_screening?motherduck_token={self.token}")
         except Exception as e:
             # If database doesn't exist, create it first
             print(f"Creating database 'health_screening' in MotherDuck...")
-            self.conn = duckdb.connect(f"md:?motherduck_token={self.token}")
-            self.conn.execute("CREATE DATABASE health_screening")
-            self.conn.close()
+            conn = duckdb.connect(f"md:?motherduck_token={self.token}")
+            conn.execute("CREATE DATABASE health_screening")
+            conn.close()
             # Now connect to the created database
-            self.conn = duckdb.connect(f"md:health_screening?motherduck_token={self.token}")
+            return duckdb.connect(f"md:health_screening?motherduck_token={self.token}")
+    
+    @property
+    def conn(self):
+        """
+        The calling thread's DuckDB connection
         
-        self._create_tables()
+        DuckDB connections must not be used from several threads at once,
+        so every thread gets its own cursor on the shared database and
+        threads can read and write in parallel. A cursor that has been idle
+        for DB_HEALTH_CHECK_SECONDS is pinged first and replaced, reconnecting
+        if necessary, when the ping fails.
+        """
+        local = self._local
+        cursor = getattr(local, 'cursor', None)
+        now = time.monotonic()
+        
+        if cursor is not None and local.generation != self._generation:
+            # Another thread reconnected; this cursor belongs to the old connection
+            self._release(cursor, local.generation)
+            cursor = None
+        elif cursor is not None and now - local.last_used > DB_HEALTH_CHECK_SECONDS and not self._is_healthy(cursor):
+            logger.warning("Database connection failed its health check, reconnecting")
+            self._release(cursor, local.generation)
+            cursor = None
+        
+        if cursor is None:
+            cursor, local.generation = self._new_cursor()
+            local.cursor = cursor
+        
+        local.last_used = now
+        return cursor
+    
+    def _new_cursor(self):
+        """Open a cursor on the shared connection, reconnecting if that connection is dead"""
+        generation = self._generation
+        try:
+            cursor, generation = self._open_cursor()
+            if not self._is_healthy(cursor):
+                self._release(cursor, generation)
+                raise ConnectionError("new cursor failed its health check")
+        except Exception as e:
+            logger.warning(f"Database connection lost ({e}), reconnecting")
+            self.reconnect(generation)
+            cursor, generation = self._open_cursor()
+        return cursor, generation
+    
+    def _open_cursor(self):
+        with self._connect_lock:
+            cursor = self._connection.cursor()
+            self._cursors.add(cursor)
+            return cursor, self._generation
+    
+    def _release(self, cursor, generation: int):
+        """Close a thread's cursor, and its connection if reconnect() retired it and no cursor is left"""
+        self._discard(cursor)
+        with self._connect_lock:
+            if generation in self._retired:
+                self._retired[generation][1].discard(cursor)
+            else:
+                self._cursors.discard(cursor)
+            released = [generation for generation, (_, cursors) in self._retired.items() if not cursors]
+            connections = [self._retired.pop(generation)[0] for generation in released]
+        for connection in connections:
+            self._discard(connection)
+    
+    @staticmethod
+    def _is_healthy(cursor) -> bool:
+        try:
+            cursor.execute("SELECT 1").fetchone()
+            return True
+        except Exception:
+            return False
+    
+    @staticmethod
+    def _discard(cursor):
+        try:
+            cursor.close()
+        except Exception:
+            pass
+    
+    def reconnect(self, generation: Optional[int] = None):
+        """
+        Replace the shared connection
+        
+        The old connection stays open for queries other threads still have
+        in flight on it. Each thread moves to the new connection the next
+        time it asks for conn, and the old one is closed once the last of
+        its cursors is released.
+        
+        Args:
+            generation: The connection generation the caller saw fail. If
+                another thread has reconnected since, nothing is done.
+        """
+        with self._connect_lock:
+            if generation is not None and generation != self._generation:
+                return
+            connection = self._connect()
+            if self._cursors:
+                self._retired[self._generation] = (self._connection, self._cursors)
+            else:
+                self._discard(self._connection)
+            self._connection = connection
+            self._cursors = weakref.WeakSet()
+            self._generation += 1
+            logger.info("Reconnected to MotherDuck")
     
     def _create_tables(self):
         """Create necessary tables if they don't exist"""
@@ -48,6 +186,8 @@ class MotherDuckDB:
                     name VARCHAR NOT NULL,
                     email VARCHAR NOT NULL,
                     phone VARCHAR NOT NULL,
+                    email_normalized VARCHAR,
+                    phone_normalized VARCHAR,
                     report_file_name VARCHAR NOT NULL,
                     company_name VARCHAR,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -79,13 +219,23 @@ class MotherDuckDB:
                 )
             """)
             
-            # Create PDF reports table for storing actual PDF data
+            # Create PDF contents table holding each distinct PDF once, keyed by SHA-256
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS pdf_contents (
+                    content_hash VARCHAR PRIMARY KEY,
+                    file_data BLOB NOT NULL,
+                    file_size INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            # Create PDF reports table pointing each customer's report at its content
             self.conn.execute("""
                 CREATE TABLE IF NOT EXISTS pdf_reports (
                     id VARCHAR PRIMARY KEY,
                     customer_id VARCHAR NOT NULL,
                     file_name VARCHAR NOT NULL,
-                    file_data TEXT NOT NULL,
+                    content_hash VARCHAR NOT NULL,
                     file_size INTEGER NOT NULL,
                     company_name VARCHAR,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -93,26 +243,93 @@ class MotherDuckDB:
                 )
             """)
             
+            # Create email deliveries ledger so interrupted bulk runs can resume
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS email_deliveries (
+                    customer_id VARCHAR NOT NULL,
+                    report_hash VARCHAR NOT NULL,
+                    email VARCHAR NOT NULL,
+                    delivery_method VARCHAR,
+                    status VARCHAR NOT NULL,
+                    error VARCHAR,
+                    attempts INTEGER DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (customer_id, report_hash)
+                )
+            """)
+            
+            self._migrate_customers()
+            self._migrate_pdf_reports()
+            
             logger.info("Database tables created successfully")
             
         except Exception as e:
             logger.error(f"Error creating tables: {e}")
             raise
     
+    def _migrate_customers(self):
+        """Add and backfill the normalized credential columns in customers tables created before them"""
+        self.conn.execute("ALTER TABLE customers ADD COLUMN IF NOT EXISTS email_normalized VARCHAR")
+        self.conn.execute("ALTER TABLE customers ADD COLUMN IF NOT EXISTS phone_normalized VARCHAR")
+        # Same rules as normalize_email and normalize_phone
+        self.conn.execute("""
+            UPDATE customers SET
+                email_normalized = lower(trim(email)),
+                phone_normalized = regexp_replace(trim(phone), '^0', '')
+            WHERE email_normalized IS NULL OR phone_normalized IS NULL
+        """)
+    
+    def _migrate_pdf_reports(self):
+        """
+        Bring pdf_reports created by older versions up to the content-addressed layout
+        
+        Older tables hold the PDF itself in pdf_reports.file_data, first as
+        base64 TEXT and later as a BLOB. The bytes are moved into
+        pdf_contents (once per distinct PDF) and the column is replaced by
+        content_hash.
+        """
+        result = self.conn.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'pdf_reports' AND column_name = 'file_data'
+        """).fetchone()
+        
+        if not result:
+            return
+        
+        # DuckDB cannot alter a table twice in one transaction, so each step
+        # runs on its own and is safe to repeat if a previous run stopped midway
+        logger.info("Migrating pdf_reports to content-addressed storage")
+        if result[0].upper() != 'BLOB':
+            self.conn.execute("""
+                ALTER TABLE pdf_reports ALTER COLUMN file_data SET DATA TYPE BLOB USING from_base64(file_data)
+            """)
+        
+        self.conn.execute("ALTER TABLE pdf_reports ADD COLUMN IF NOT EXISTS content_hash VARCHAR")
+        self.conn.execute("""
+            INSERT INTO pdf_contents (content_hash, file_data, file_size)
+            SELECT sha256(file_data), any_value(file_data), any_value(octet_length(file_data))
+            FROM pdf_reports
+            GROUP BY sha256(file_data)
+            ON CONFLICT DO NOTHING
+        """)
+        self.conn.execute("UPDATE pdf_reports SET content_hash = sha256(file_data)")
+        self.conn.execute("ALTER TABLE pdf_reports DROP COLUMN file_data")
+    
     def store_customers_from_excel(self, excel_file_path: str, company_name: str) -> int:
         """
         Store customer data from Excel file into MotherDuck
         
         Args:
-            excel_file_path: Path to Excel file
+            excel_file_path: Path to Excel file, or an uploaded file object
             company_name: Name of the company
             
         Returns:
             Number of customers stored
         """
         try:
-            # Read Excel file
-            df = pd.read_excel(excel_file_path)
+            # Read Excel file (reuses the parsed copy if the workbook was already loaded)
+            df = load_workbook(excel_file_path)
             
             # Prepare customer data
             customers_data = []
@@ -131,6 +348,8 @@ class MotherDuckDB:
                     'name': name,
                     'email': email,
                     'phone': phone,
+                    'email_normalized': normalize_email(email),
+                    'phone_normalized': normalize_phone(phone),
                     'report_file_name': report_file_name,
                     'company_name': company_name
                 })
@@ -139,11 +358,18 @@ class MotherDuckDB:
             customers_df = pd.DataFrame(customers_data)
             
             # Insert or update customers
-            self.conn.execute("""
-                INSERT OR REPLACE INTO customers (id, name, email, phone, report_file_name, company_name, updated_at)
-                SELECT id, name, email, phone, report_file_name, company_name, CURRENT_TIMESTAMP
-                FROM customers_df
-            """, {"customers_df": customers_df})
+            self.conn.register('customers_df', customers_df)
+            try:
+                self.conn.execute("""
+                    INSERT OR REPLACE INTO customers (id, name, email, phone, email_normalized, phone_normalized,
+                                                      report_file_name, company_name, updated_at)
+                    SELECT id, name, email, phone, email_normalized, phone_normalized,
+                           report_file_name, company_name, CURRENT_TIMESTAMP
+                    FROM customers_df
+                """)
+            finally:
+                self.conn.unregister('customers_df')
+            self.customer_cache.clear()
             
             logger.info(f"Stored {len(customers_data)} customers for {company_name}")
             return len(customers_data)
@@ -175,24 +401,34 @@ class MotherDuckDB:
             raise
     
     def get_customer(self, customer_id: str) -> Optional[Dict[str, Any]]:
-        """Get customer data by ID"""
+        """Get customer data by ID, from the local cache when it was looked up recently"""
+        cached = self.customer_cache.get(customer_id)
+        if not is_missing(cached):
+            return dict(cached) if cached else None
+        
         try:
             result = self.conn.execute("""
-                SELECT id, name, email, phone, report_file_name, company_name
+                SELECT id, name, email, phone, report_file_name, company_name, email_normalized, phone_normalized
                 FROM customers 
                 WHERE id = ?
             """, [customer_id]).fetchone()
             
+            customer = None
             if result:
-                return {
+                customer = {
                     'id': result[0],
                     'name': result[1],
                     'email': result[2],
                     'phone': result[3],
                     'report_file_name': result[4],
-                    'company_name': result[5]
+                    'company_name': result[5],
+                    'email_normalized': result[6],
+                    'phone_normalized': result[7]
                 }
-            return None
+            
+            # Unknown IDs are cached too, so repeated failed verifications stay local
+            self.customer_cache.set(customer_id, customer)
+            return dict(customer) if customer else None
             
         except Exception as e:
             logger.error(f"Error getting customer {customer_id}: {e}")
@@ -202,6 +438,10 @@ class MotherDuckDB:
         """
         Verify customer credentials
         
+        A primary-key lookup (usually answered by the local cache) followed
+        by constant-time comparisons against the email and phone normalized
+        when the customer was stored.
+        
         Args:
             customer_id: Customer ID
             email: Email address
@@ -211,29 +451,21 @@ class MotherDuckDB:
             Customer data if verified, None otherwise
         """
         try:
-            # Normalize phone number
-            phone_normalized = phone[1:] if phone.startswith('0') else phone
+            customer = self.get_customer(customer_id)
+            if not customer:
+                return None
             
-            result = self.conn.execute("""
-                SELECT id, name, email, phone, report_file_name, company_name
-                FROM customers 
-                WHERE id = ? AND LOWER(email) = LOWER(?)
-            """, [customer_id, email]).fetchone()
+            # Both comparisons always run, so timing does not reveal which one failed
+            email_matches = hmac.compare_digest(
+                normalize_email(email).encode('utf-8'), (customer['email_normalized'] or '').encode('utf-8')
+            )
+            # Phone numbers match with or without their leading 0
+            phone_matches = hmac.compare_digest(
+                normalize_phone(phone).encode('utf-8'), (customer['phone_normalized'] or '').encode('utf-8')
+            )
             
-            if result:
-                stored_phone = result[3]
-                stored_phone_normalized = stored_phone[1:] if stored_phone.startswith('0') else stored_phone
-                
-                # Check phone match (with or without leading 0)
-                if (stored_phone == phone or stored_phone_normalized == phone_normalized):
-                    return {
-                        'id': result[0],
-                        'name': result[1],
-                        'email': result[2],
-                        'phone': result[3],
-                        'report_file_name': result[4],
-                        'company_name': result[5]
-                    }
+            if email_matches and phone_matches:
+                return customer
             
             return None
             
@@ -241,6 +473,73 @@ class MotherDuckDB:
             logger.error(f"Error verifying customer {customer_id}: {e}")
             return None
     
+    def get_delivered(self, report_keys: Iterable[Tuple[str, str]]) -> Set[Tuple[str, str]]:
+        """
+        Find which reports have already been emailed
+        
+        Args:
+            report_keys: (customer_id, report_hash) pairs to check
+            
+        Returns:
+            The subset of report_keys recorded as sent
+        """
+        try:
+            keys_df = pd.DataFrame(list(report_keys), columns=['customer_id', 'report_hash'])
+            if keys_df.empty:
+                return set()
+            
+            self.conn.register('delivery_keys', keys_df)
+            try:
+                result = self.conn.execute("""
+                    SELECT d.customer_id, d.report_hash
+                    FROM email_deliveries d
+                    JOIN delivery_keys k ON d.customer_id = k.customer_id AND d.report_hash = k.report_hash
+                    WHERE d.status = 'sent'
+                """).fetchall()
+            finally:
+                self.conn.unregister('delivery_keys')
+            
+            return {(row[0], row[1]) for row in result}
+            
+        except Exception as e:
+            logger.error(f"Error reading delivery ledger: {e}")
+            return set()
+    
+    def record_delivery(self, customer_id: str, report_hash: str, email: str, delivery_method: str,
+                        success: bool, error: Optional[str] = None) -> bool:
+        """
+        Record the outcome of emailing a report
+        
+        Args:
+            customer_id: Customer ID
+            report_hash: Fingerprint of the report's inputs
+            email: Address the report was sent to
+            delivery_method: How it was sent (SMTP or Zoho API)
+            success: Whether the email was accepted
+            error: Failure message, if any
+            
+        Returns:
+            True if the ledger was updated. Failures are logged rather than
+            raised so a ledger problem never aborts a send in progress.
+        """
+        try:
+            self.conn.execute("""
+                INSERT INTO email_deliveries (customer_id, report_hash, email, delivery_method, status, error)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (customer_id, report_hash) DO UPDATE SET
+                    email = EXCLUDED.email,
+                    delivery_method = EXCLUDED.delivery_method,
+                    status = EXCLUDED.status,
+                    error = EXCLUDED.error,
+                    attempts = email_deliveries.attempts + 1,
+                    updated_at = now()
+            """, [customer_id, report_hash, email, delivery_method, 'sent' if success else 'failed', error])
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error recording delivery for {customer_id}: {e}")
+            return False
+    
     def get_all_customers(self, company_name: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all customers, optionally filtered by company"""
         try:
@@ -313,18 +612,25 @@ class MotherDuckDB:
             return {}
     
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
+        """Close database connection and every thread's cursor on it"""
+        for connection, cursors in [(self._connection, self._cursors)] + list(self._retired.values()):
+            for cursor in list(cursors):
+                self._discard(cursor)
+            if connection:
+                self._discard(connection)
+        self._retired.clear()
 
 # Global database instance
 db_instance = None
+_db_instance_lock = threading.Lock()
 
 def get_db() -> MotherDuckDB:
-    """Get database instance (singleton pattern)"""
+    """Get database instance (singleton pattern), safe to share between threads"""
     global db_instance
     if db_instance is None:
-        db_instance = MotherDuckDB()
+        with _db_instance_lock:
+            if db_instance is None:
+                db_instance = MotherDuckDB()
     return db_instance
 
 def close_db():
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Email Delivery
+Connection handling and pacing for the bulk email paths, so a batch reuses
+one authenticated SMTP session and one Zoho access token, and sends as fast
+as the provider tolerates
+"""
+
+import os
+import time
+import asyncio
+import logging
+import smtplib
+import threading
+from typing import Any, Callable, Optional, Dict, List, Tuple
+import requests
+
+logger = logging.getLogger(__name__)
+
+ZOHO_TOKEN_URL = "https://accounts.zoho.com/oauth/v2/token"
+ZOHO_MAIL_API = "https://mail.zoho.com/api"
+# Zoho messages sent at once by send_zoho_batch
+ZOHO_CONCURRENCY = int(os.environ.get('ZOHO_CONCURRENCY', '5'))
+# Refresh this many seconds before the token actually expires
+ZOHO_TOKEN_REFRESH_MARGIN = 300
+# Zoho access tokens last an hour; used when the response omits expires_in
+ZOHO_TOKEN_DEFAULT_LIFETIME = 3600
+
+# Send results containing any of these mean the provider wants us to slow down
+THROTTLE_MARKERS = ("Unusual sending activity", "550", "Status: 429")
+
+# Reply codes meaning the server is closing the connection and a fresh one may work
+_RECONNECT_CODES = (421,)
+
+
+class SMTPSession:
+    """
+    Persistent SMTP connection shared by many sends
+
+    The connection is opened (STARTTLS and login included) on the first
+    send and kept until close(). A send that finds the connection dropped
+    reconnects once and retries; delivery errors such as 550 rejections are
+    raised to the caller unchanged.
+    """
+
+    def __init__(self, host: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 use_tls: bool = True, timeout: float = 30, max_messages: Optional[int] = None):
+        """
+        Args:
+            host: SMTP server host
+            port: SMTP server port
+            username: Login user; no login is attempted when empty
+            password: Login password
+            use_tls: Upgrade the connection with STARTTLS before logging in
+            timeout: Socket timeout in seconds
+            max_messages: Reconnect after this many messages, for servers
+                that cap messages per connection
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.messages_sent = 0
+        self.connections_opened = 0
+        self._server = None
+        self._messages_on_connection = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connect(self):
+        """Open and authenticate the connection if it is not already open"""
+        with self._lock:
+            self._connect()
+
+    def close(self):
+        """Quit the connection, ignoring errors from a server that already hung up"""
+        with self._lock:
+            self._disconnect()
+
+    def send(self, from_addr: str, to_addrs, message: str):
+        """
+        Send one message over the shared connection
+
+        Args:
+            from_addr: Envelope sender
+            to_addrs: Recipient address or list of addresses
+            message: Full message text, e.g. MIMEMultipart.as_string()
+
+        Returns:
+            Refused recipients dict from smtplib.SMTP.sendmail
+        """
+        with self._lock:
+            for attempt in range(2):
+                self._connect()
+                try:
+                    refused = self._server.sendmail(from_addr, to_addrs, message)
+                except Exception as e:
+                    if attempt == 0 and self._is_connection_lost(e):
+                        logger.info(f"SMTP connection lost ({e}), reconnecting")
+                        self._drop()
+                        continue
+                    raise
+
+                self.messages_sent += 1
+                self._messages_on_connection += 1
+                if self.max_messages and self._messages_on_connection >= self.max_messages:
+                    self._disconnect()
+                return refused
+
+    def _connect(self):
+        if self._server is not None:
+            return
+
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_tls:
+                server.starttls()
+            if self.username:
+                server.login(self.username, self.password)
+        except Exception:
+            server.close()
+            raise
+
+        self._server = server
+        self._messages_on_connection = 0
+        self.connections_opened += 1
+        logger.info(f"Opened SMTP connection to {self.host}:{self.port}")
+
+    def _disconnect(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        self._server = None
+
+    def _drop(self):
+        """Forget a connection that is already unusable"""
+        try:
+            self._server.close()
+        except Exception:
+            pass
+        self._server = None
+
+    @staticmethod
+    def _is_connection_lost(error: Exception) -> bool:
+        if isinstance(error, smtplib.SMTPServerDisconnected):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return error.smtp_code in _RECONNECT_CODES
+        return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class ZohoTokenCache:
+    """
+    Zoho OAuth access token kept until shortly before it expires
+
+    The token is refreshed at most once at a time: concurrent callers that
+    find it stale wait on the lock and reuse the token the first one fetched.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, refresh_token: str,
+                 token_url: str = ZOHO_TOKEN_URL, refresh_margin: float = ZOHO_TOKEN_REFRESH_MARGIN):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.refresh_token = refresh_token
+        self.token_url = token_url
+        self.refresh_margin = refresh_margin
+        self.refresh_count = 0
+        self._access_token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_token(self) -> str:
+        """Return a valid access token, refreshing it only when it is close to expiry"""
+        token = self._access_token
+        if token and time.monotonic() < self._expires_at:
+            return token
+
+        with self._lock:
+            if self._access_token and time.monotonic() < self._expires_at:
+                return self._access_token
+            return self._refresh()
+
+    def invalidate(self, token: Optional[str] = None):
+        """
+        Drop the cached token, e.g. after the API rejects it with 401
+
+        Args:
+            token: The rejected token; if another caller has already replaced
+                it, the newer token is kept
+        """
+        with self._lock:
+            if token is None or token == self._access_token:
+                self._access_token = None
+                self._expires_at = 0.0
+
+    def _refresh(self) -> str:
+        data = {
+            "refresh_token": self.refresh_token,
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "grant_type": "refresh_token"
+        }
+        response = get_http_session().post(self.token_url, data=data)
+        resp_json = response.json()
+
+        if "access_token" not in resp_json:
+            raise Exception(f"Failed to get access token: {resp_json}")
+
+        lifetime = float(resp_json.get("expires_in", ZOHO_TOKEN_DEFAULT_LIFETIME))
+        self._access_token = resp_json["access_token"]
+        self._expires_at = time.monotonic() + max(lifetime - self.refresh_margin, 0)
+        self.refresh_count += 1
+        logger.info(f"Refreshed Zoho access token, valid for {lifetime:.0f}s")
+        return self._access_token
+
+
+# Process-wide HTTP session and token caches, kept across Streamlit reruns
+_http_session = None
+_http_session_lock = threading.Lock()
+_zoho_token_caches: Dict[Tuple[str, str], ZohoTokenCache] = {}
+_zoho_token_caches_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Get the shared keep-alive HTTP session (singleton pattern)"""
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                _http_session = requests.Session()
+    return _http_session
+
+
+def get_zoho_token_cache(client_id: str, client_secret: str, refresh_token: str) -> ZohoTokenCache:
+    """Get the token cache for a Zoho client and refresh token (singleton per credential pair)"""
+    key = (client_id, refresh_token)
+    with _zoho_token_caches_lock:
+        cache = _zoho_token_caches.get(key)
+        if cache is None:
+            cache = ZohoTokenCache(client_id, client_secret, refresh_token)
+            _zoho_token_caches[key] = cache
+        return cache
+
+
+def is_throttled(message: str) -> bool:
+    """Whether a failed send's message says the provider is rate limiting us"""
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to what the provider tolerates
+
+    Every throttling response halves the rate (down to min_rate) and every
+    successful send raises it by a fixed step (up to max_rate), so a run
+    settles just below the provider's limit instead of a fixed delay.
+    Rates are in messages per second.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float, burst: float = 1.0,
+                 increase: Optional[float] = None, backoff: float = 0.5):
+        """
+        Args:
+            rate: Starting rate
+            min_rate: Slowest rate backoff may reach
+            max_rate: Fastest rate speed-up may reach
+            burst: Sends allowed back to back after an idle period
+            increase: Rate added per success; defaults to a twentieth of max_rate
+            backoff: Factor the rate is multiplied by on throttling
+        """
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = min(max(rate, min_rate), max_rate)
+        self.burst = burst
+        self.increase = increase if increase is not None else max_rate / 20
+        self.backoff = backoff
+        self.throttled_count = 0
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, returning how many seconds to wait before using it
+
+        Callers that cannot block (e.g. coroutines) wait the returned time
+        themselves; acquire() sleeps on it.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        """Block until a send is allowed, returning the time waited"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_success(self):
+        with self._lock:
+            self._refill()
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def record_throttled(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.rate * self.backoff, self.min_rate)
+            # Spend any saved-up burst so the next send waits a full interval
+            self._tokens = min(self._tokens, 0.0)
+            self.throttled_count += 1
+            logger.warning(f"Provider throttled sending, slowing to {self.rate * 60:.1f} emails/min")
+
+    def record(self, success: bool, message: str):
+        """Feed a send result back into the rate"""
+        if success:
+            self.record_success()
+        elif is_throttled(message):
+            self.record_throttled()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
+
+
+def send_rate_limited(rate_limiter: Optional[AdaptiveRateLimiter], send: Callable[[], Tuple[bool, str]]) -> Tuple[bool, str]:
+    """
+    Run a send through a rate limiter and feed its outcome back
+
+    Args:
+        rate_limiter: Limiter to wait on, or None to send immediately
+        send: Callable returning (success, message)
+
+    Returns:
+        The (success, message) returned by send
+    """
+    if rate_limiter is None:
+        return send()
+    rate_limiter.acquire()
+    success, message = send()
+    rate_limiter.record(success, message)
+    return success, message
+
+
+def zoho_async_available() -> bool:
+    """Whether the optional httpx dependency for send_zoho_batch is installed"""
+    try:
+        import httpx
+        return True
+    except ImportError:
+        return False
+
+
+def send_zoho_batch(messages: List[Dict[str, Any]], token_cache: ZohoTokenCache, account_id: str,
+                    concurrency: int = ZOHO_CONCURRENCY, rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                    api_base: str = ZOHO_MAIL_API,
+                    progress_callback: Optional[Callable[[int, int, Dict[str, Any], bool, str], None]] = None
+                    ) -> Tuple[int, List[Dict[str, str]]]:
+    """
+    Send many messages through the Zoho messages endpoint concurrently
+
+    Requests run on an asyncio event loop with at most `concurrency` in
+    flight, all sharing the cached access token. A throttled message is
+    retried once, like the sequential bulk loop does.
+
+    Args:
+        messages: Dicts with 'Name', 'Email' and 'data' (the JSON body for
+            the messages endpoint)
+        token_cache: Shared Zoho access token
+        account_id: Zoho Mail account ID
+        concurrency: Maximum requests in flight
+        rate_limiter: Optional limiter pacing the requests
+        api_base: Zoho Mail API root, overridable for a local mock server
+        progress_callback: Called as progress_callback(completed, total,
+            message, success, result) after each message; it runs in the
+            calling thread
+
+    Returns:
+        (success_count, failed_emails) where failures are {'Name', 'Email',
+        'Error'} rows like the Streamlit results table
+    """
+    return asyncio.run(_send_zoho_batch(messages, token_cache, account_id, concurrency,
+                                        rate_limiter, api_base, progress_callback))
+
+
+async def _send_zoho_batch(messages, token_cache, account_id, concurrency, rate_limiter, api_base, progress_callback):
+    import httpx
+
+    url = f"{api_base}/accounts/{account_id}/messages"
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    success_count = 0
+    failed_emails = []
+
+    async with httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=max(concurrency, 1))) as client:
+
+        async def deliver(message):
+            async with semaphore:
+                success, result = await _post_zoho_message(client, url, token_cache, rate_limiter, message['data'])
+                if not success and is_throttled(result):
+                    success, result = await _post_zoho_message(client, url, token_cache, rate_limiter, message['data'])
+                    if not success:
+                        result = f"Rate limit retry failed: {result}"
+                return message, success, result
+
+        for completed, delivery in enumerate(asyncio.as_completed([deliver(message) for message in messages]), start=1):
+            message, success, result = await delivery
+            if success:
+                success_count += 1
+            else:
+                failed_emails.append({
+                    'Name': message.get('Name', 'Unknown'),
+                    'Email': message.get('Email', 'Unknown'),
+                    'Error': result
+                })
+            if progress_callback:
+                progress_callback(completed, len(messages), message, success, result)
+
+    return success_count, failed_emails
+
+
+async def _post_zoho_message(client, url, token_cache, rate_limiter, data) -> Tuple[bool, str]:
+    """Post one message, refreshing a rejected token once"""
+    if rate_limiter is not None:
+        wait = rate_limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    result = (False, "Error sending email: not attempted")
+    for attempt in range(2):
+        try:
+            # Token refreshes block on HTTP, so they run off the event loop
+            token = await asyncio.to_thread(token_cache.get_token)
+            response = await client.post(url, headers={"Authorization": f"Zoho-oauthtoken {token}"}, json=data)
+        except Exception as e:
+            result = (False, f"Error sending email: {str(e)}")
+            break
+
+        if response.status_code == 401 and attempt == 0:
+            token_cache.invalidate(token)
+            continue
+        if response.status_code == 200:
+            result = (True, "Email sent successfully")
+        else:
+            result = (False, f"Failed to send email. Status: {response.status_code}, Response: {response.text}")
+        break
+
+    if rate_limiter is not None:
+        rate_limiter.record(*result)
+    return result
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Health Metric Categorization
+Table-driven, vectorized categorization of screening readings shared by the
+company and individual analyzers in HEALTH_SCREEN.py and streamlit_health_app.py
+"""
+
+import numpy as np
+import pandas as pd
+
+# A category table lists its rules in priority order. Each rule is
+# (category, tests) and matches a row when ANY of its (column, test) pairs
+# holds; rows matching no rule fall back to the table's default category.
+# Tests are ('<', x), ('>', x) or ('between', low, high) with inclusive bounds.
+BLOOD_PRESSURE = {
+    'rules': [
+        ('LOW', [('SYSTOLIC', ('<', 100)), ('DIASTOLIC', ('<', 60))]),
+        ('HIGH', [('SYSTOLIC', ('>', 160)), ('DIASTOLIC', ('>', 99))]),
+        ('MODERATE HIGH', [('SYSTOLIC', ('between', 141, 160)), ('DIASTOLIC', ('between', 91, 99))]),
+    ],
+    'default': 'NORMAL'
+}
+
+BLOOD_SUGAR = {
+    'rules': [
+        ('DIABETIC', [('BLOOD GLUCOSE', ('>', 125))]),
+        ('PRE_DIABETIC', [('BLOOD GLUCOSE', ('between', 100, 125))]),
+    ],
+    'default': 'NORMAL'
+}
+
+CHOLESTEROL = {
+    'rules': [
+        ('HIGH', [('CHOLESTEROL', ('>', 240))]),
+        ('BORDERLINE HIGH', [('CHOLESTEROL', ('between', 200, 239))]),
+    ],
+    'default': 'NORMAL'
+}
+
+BMI = {
+    'rules': [
+        ('OBESITY', [('BMI', ('>', 30))]),
+        ('OVERWEIGHT', [('BMI', ('between', 25, 30))]),
+        ('NORMAL', [('BMI', ('between', 18.5, 25))]),
+    ],
+    'default': 'BELOW NORMAL'
+}
+
+# Individual reports band BMI differently from the company summary
+INDIVIDUAL_BMI = {
+    'rules': [
+        ('UNDERWEIGHT', [('BMI', ('<', 18.5))]),
+        ('NORMAL', [('BMI', ('between', 18.5, 24.9))]),
+        ('OVERWEIGHT', [('BMI', ('between', 25, 29.9))]),
+    ],
+    'default': 'OBESE'
+}
+
+# Numeric PSA readings above this (ng/mL) are reported as POSITIVE
+PSA_THRESHOLD = 4.0
+
+# Reading columns that hold numbers; PSA is excluded as it may be POSITIVE/NEGATIVE text
+NUMERIC_COLUMNS = ['AGE', 'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI', 'CHOLESTEROL']
+
+# Age groups are contiguous, so they are binned with pd.cut instead
+AGE_BINS = [0, 20, 30, 40, 50, 60, 70]
+AGE_LABELS = ['0-20', '21-30', '31-40', '41-50', '51-60', '61-70']
+
+
+def _evaluate_test(values, test):
+    """Evaluate a single rule test against a float array"""
+    operator = test[0]
+    if operator == '<':
+        return values < test[1]
+    if operator == '>':
+        return values > test[1]
+    if operator == 'between':
+        return (values >= test[1]) & (values <= test[2])
+    raise ValueError(f"Unknown category test: {operator}")
+
+
+def categorize(data_df, table):
+    """
+    Categorize every row of a DataFrame according to a category table
+
+    Args:
+        data_df: DataFrame holding the numeric columns the table refers to
+        table: Category table such as BLOOD_PRESSURE or BMI
+
+    Returns:
+        Series of category labels aligned with data_df.index
+    """
+    columns = {}
+    conditions = []
+    for _, tests in table['rules']:
+        matched = np.zeros(len(data_df), dtype=bool)
+        for column, test in tests:
+            if column not in columns:
+                columns[column] = data_df[column].to_numpy(dtype=float, na_value=np.nan)
+            matched |= _evaluate_test(columns[column], test)
+        conditions.append(matched)
+
+    # Select integer codes and look the labels up afterwards, which is much
+    # cheaper than letting np.select build a fixed-width string array
+    labels = np.array([category for category, _ in table['rules']] + [table['default']], dtype=object)
+    codes = np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+    return pd.Series(labels[codes], index=data_df.index)
+
+
+def categorize_age(ages):
+    """Bin ages into the report's age groups"""
+    return pd.cut(ages, bins=AGE_BINS, labels=AGE_LABELS, right=True)
+
+
+def normalize_urine_results(results):
+    """
+    Strip and upper-case urine test results, turning blank strings into NA
+
+    Non-string values (numbers, NaN) are left untouched. Result columns only
+    hold a handful of distinct spellings, so each unique value is cleaned once
+    and broadcast back through the factorized codes.
+    """
+    codes, uniques = pd.factorize(results)
+    cleaned = np.empty(len(uniques), dtype=object)
+    for position, value in enumerate(uniques):
+        if isinstance(value, str):
+            value = value.strip()
+            value = value.upper() if value else pd.NA
+        cleaned[position] = value
+
+    normalized = results.to_numpy(dtype=object, copy=True)
+    present = codes >= 0
+    normalized[present] = cleaned[codes[present]]
+    return pd.Series(normalized, index=results.index, name=results.name)
+
+
+def summarize_categories(data_df, categories):
+    """
+    Aggregate several category columns against GENDER and AGE in one stage
+
+    GENDER is factorized and AGE coerced once for the whole frame, then each
+    category column is reduced with a single bincount over its (gender,
+    category) codes. The pandas objects returned match what value_counts(),
+    groupby(['GENDER', X]).size().unstack(fill_value=0) and
+    groupby(X)['AGE'].mean() give for the rows where the category is present.
+
+    Args:
+        data_df: DataFrame with GENDER and AGE columns
+        categories: Dict of column name -> category Series aligned with
+            data_df; rows where the category is missing are left out
+
+    Returns:
+        Dict of column name -> {'distribution', 'distribution_pct',
+        'by_gender', 'by_gender_pct', 'avg_age'}
+    """
+    gender_codes, genders = pd.factorize(data_df['GENDER'], sort=True)
+    # Rows without a gender still count towards the distribution and average
+    # age, so they get a slot of their own that is dropped from the cross-tab
+    gender_slots = np.where(gender_codes >= 0, gender_codes, len(genders))
+
+    ages = data_df['AGE'].to_numpy(dtype=float, na_value=np.nan)
+    has_age = ~np.isnan(ages)
+    ages = np.where(has_age, ages, 0.0)
+
+    return {
+        column: _summarize_category(column, values, genders, gender_slots, ages, has_age)
+        for column, values in categories.items()
+    }
+
+
+def _summarize_category(column, values, genders, gender_slots, ages, has_age):
+    """Reduce one category column to its distribution, gender cross-tab and average ages"""
+    observed = not isinstance(values.dtype, pd.CategoricalDtype)
+    if observed:
+        # First-occurrence order, which is what value_counts() sorts from
+        codes, labels = pd.factorize(values)
+    else:
+        # Categorical columns report every category, as groupby(observed=False) does
+        codes, labels = values.cat.codes.to_numpy(), values.cat.categories
+
+    present = codes >= 0
+    codes = codes[present]
+    n_labels = len(labels)
+    n_slots = len(genders) + 1
+
+    cells = gender_slots[present] * n_labels + codes
+    counts = np.bincount(cells, minlength=n_slots * n_labels).reshape(n_slots, n_labels)
+    age_sums = np.bincount(codes, weights=ages[present], minlength=n_labels)
+    age_counts = np.bincount(codes, weights=has_age[present], minlength=n_labels)
+
+    label_index = pd.Index(labels, name=column)
+    totals = counts.sum(axis=0)
+
+    distribution = pd.Series(totals, index=label_index, name='count').sort_values(ascending=False)
+    distribution_pct = (distribution / len(codes) * 100).round(2)
+
+    by_gender = pd.DataFrame(counts[:-1], index=pd.Index(genders, name='GENDER'), columns=label_index)
+    if observed:
+        by_gender = by_gender.loc[by_gender.sum(axis=1) > 0, by_gender.sum(axis=0) > 0].sort_index(axis=1)
+    by_gender_pct = (by_gender.div(by_gender.sum(axis=1), axis=0) * 100).round(2)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_age = pd.Series(age_sums / age_counts, index=label_index, name='AGE')
+    if observed:
+        avg_age = avg_age[totals > 0].sort_index()
+    avg_age = avg_age.round(2)
+
+    return {
+        'distribution': distribution,
+        'distribution_pct': distribution_pct,
+        'by_gender': by_gender,
+        'by_gender_pct': by_gender_pct,
+        'avg_age': avg_age
+    }
+
+
+def analyze_individual_health_frame(data_df):
+    """
+    Analyze every enrollee of a DataFrame at once
+
+    Categories for BMI, blood pressure, blood sugar, cholesterol, urine and
+    PSA are computed as whole columns; the loop only assembles the
+    per-person dicts. Numeric columns are coerced first, as the bulk paths
+    did per row before calling analyze_individual_health.
+
+    Args:
+        data_df: DataFrame with one enrollee per row
+
+    Yields:
+        (individual_data, analysis) tuples, where analysis is identical to
+        what analyze_individual_health(individual_data) returns
+    """
+    data_df = data_df.copy()
+    for col in NUMERIC_COLUMNS:
+        if col in data_df.columns:
+            data_df[col] = pd.to_numeric(data_df[col], errors='coerce')
+
+    # Missing columns behave like all-missing readings
+    readings = pd.DataFrame(
+        {col: data_df[col] if col in data_df.columns else np.nan for col in NUMERIC_COLUMNS},
+        index=data_df.index
+    )
+    has_reading = {col: readings[col].notna().tolist() for col in NUMERIC_COLUMNS}
+
+    bmi_categories = categorize(readings, INDIVIDUAL_BMI).tolist()
+    bp_categories = categorize(readings, BLOOD_PRESSURE).tolist()
+    glucose_categories = categorize(readings, BLOOD_SUGAR).tolist()
+    chol_categories = categorize(readings, CHOLESTEROL).tolist()
+
+    # Urine results are reported upper-cased as text when both are present
+    has_urine = [False] * len(data_df)
+    urine_glucose = urine_protein = [None] * len(data_df)
+    if 'GLUCOSE' in data_df.columns and 'PROTEIN' in data_df.columns:
+        urine_present = data_df['GLUCOSE'].notna() & data_df['PROTEIN'].notna()
+        has_urine = urine_present.tolist()
+        urine_glucose = data_df['GLUCOSE'].where(urine_present).astype(str).str.upper().tolist()
+        urine_protein = data_df['PROTEIN'].where(urine_present).astype(str).str.upper().tolist()
+
+    # PSA is either POSITIVE/NEGATIVE text or a numeric reading against the threshold
+    has_psa = [False] * len(data_df)
+    psa_results = [None] * len(data_df)
+    if 'PSA' in data_df.columns:
+        psa = data_df['PSA']
+        has_psa = psa.notna().tolist()
+        is_text = np.fromiter((isinstance(value, str) for value in psa), dtype=bool, count=len(psa))
+        numeric_psa = pd.to_numeric(psa.where(~is_text), errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        text_psa = psa.where(is_text).astype(str).str.upper().to_numpy(dtype=object)
+        psa_results = np.where(
+            is_text, text_psa, np.where(numeric_psa > PSA_THRESHOLD, 'POSITIVE', 'NEGATIVE')
+        ).tolist()
+
+    for position, individual_data in enumerate(data_df.to_dict('records')):
+        analysis = {}
+
+        if has_reading['BMI'][position]:
+            analysis['bmi'] = {
+                'value': individual_data['BMI'],
+                'category': bmi_categories[position],
+                'systolic': individual_data.get('SYSTOLIC'),
+                'diastolic': individual_data.get('DIASTOLIC'),
+                'blood_glucose': individual_data.get('BLOOD GLUCOSE'),
+                'cholesterol': individual_data.get('CHOLESTEROL')
+            }
+
+        if has_reading['SYSTOLIC'][position] and has_reading['DIASTOLIC'][position]:
+            analysis['blood_pressure'] = {
+                'systolic': individual_data['SYSTOLIC'],
+                'diastolic': individual_data['DIASTOLIC'],
+                'category': bp_categories[position],
+                'bmi': individual_data.get('BMI'),
+                'blood_glucose': individual_data.get('BLOOD GLUCOSE'),
+                'cholesterol': individual_data.get('CHOLESTEROL')
+            }
+
+        if has_reading['BLOOD GLUCOSE'][position]:
+            analysis['blood_sugar'] = {
+                'value': individual_data['BLOOD GLUCOSE'],
+                'category': glucose_categories[position],
+                'bmi': individual_data.get('BMI'),
+                'systolic': individual_data.get('SYSTOLIC'),
+                'diastolic': individual_data.get('DIASTOLIC'),
+                'cholesterol': individual_data.get('CHOLESTEROL')
+            }
+
+        if has_reading['CHOLESTEROL'][position]:
+            analysis['cholesterol'] = {
+                'value': individual_data['CHOLESTEROL'],
+                'category': chol_categories[position],
+                'bmi': individual_data.get('BMI'),
+                'systolic': individual_data.get('SYSTOLIC'),
+                'diastolic': individual_data.get('DIASTOLIC'),
+                'blood_glucose': individual_data.get('BLOOD GLUCOSE')
+            }
+
+        if has_urine[position]:
+            analysis['urine'] = {
+                'glucose': urine_glucose[position],
+                'protein': urine_protein[position]
+            }
+
+        if has_psa[position]:
+            analysis['psa'] = {
+                'value': individual_data['PSA'],
+                'result': psa_results[position],
+                'age': individual_data.get('AGE'),
+                'gender': individual_data.get('GENDER')
+            }
+
+        yield individual_data, analysis
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Local Cache
+Keeps recently used customers and PDF reports on this machine so repeat
+portal views and verifications do not go back to MotherDuck
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join('.cache', 'pdfs'))
+# Total size of cached PDF files before the least recently used are evicted
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Customer records and report lookups held in memory per process
+CUSTOMER_CACHE_SIZE = int(os.environ.get('CUSTOMER_CACHE_SIZE', '10000'))
+# Writes made by another process (e.g. the Streamlit app) are picked up after this many seconds
+CACHE_TTL_SECONDS = float(os.environ.get('CACHE_TTL_SECONDS', '300'))
+
+_MISSING = object()
+
+
+class MemoryCache:
+    """
+    Thread-safe LRU cache with a time-to-live per entry
+
+    None is a valid cached value, so unknown keys can be cached too; get()
+    tells a miss apart by returning the default instead.
+    """
+
+    def __init__(self, max_items: int = CUSTOMER_CACHE_SIZE, ttl: float = CACHE_TTL_SECONDS):
+        self.max_items = max(max_items, 1)
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        """Return the cached value, or default if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def is_missing(value: Any) -> bool:
+    """Whether a MemoryCache.get() result was a miss"""
+    return value is _MISSING
+
+
+class FileCache:
+    """
+    Content-addressed file cache on local disk, evicting by total size
+
+    Entries are keyed by the SHA-256 of their content, so a cached file can
+    never be stale and writes elsewhere never need to invalidate it. Files
+    are written through a temporary name and renamed into place, so other
+    processes sharing the directory never read a partial file.
+    """
+
+    def __init__(self, directory: str = PDF_CACHE_DIR, max_bytes: int = PDF_CACHE_MAX_BYTES):
+        # Absolute, so paths handed to Flask's send_file do not resolve against the app root
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._sizes = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._scan()
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f"{content_hash}.pdf")
+
+    def _scan(self):
+        """Pick up files left by earlier runs, oldest use first"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith('.pdf'):
+                    stat = os.stat(os.path.join(self.directory, name))
+                    entries.append((stat.st_mtime, name[:-len('.pdf')], stat.st_size))
+        except OSError as e:
+            logger.warning(f"PDF cache directory unavailable: {e}")
+            return
+
+        for _, content_hash, size in sorted(entries):
+            self._sizes[content_hash] = size
+            self._total_bytes += size
+        self._evict()
+
+    def path(self, content_hash: str) -> Optional[str]:
+        """Path of the cached file, or None on a miss"""
+        path = self._path(content_hash)
+        with self._lock:
+            if content_hash not in self._sizes:
+                return None
+            self._sizes.move_to_end(content_hash)
+        try:
+            # The modification time records recency for the next process's scan
+            os.utime(path)
+            return path
+        except OSError:
+            # Removed by another process sharing the directory
+            self._forget(content_hash)
+            return None
+
+    def get(self, content_hash: str) -> Optional[bytes]:
+        """Cached content, or None on a miss"""
+        path = self.path(content_hash)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            self._forget(content_hash)
+            return None
+
+    def iter_chunks(self, content_hash: str, chunk_size: int, start: int = 0,
+                    end: Optional[int] = None) -> Optional[Iterator[bytes]]:
+        """Cached content from start up to end as a chunk generator, or None on a miss"""
+        path = self.path(content_hash)
+        if path is None:
+            return None
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self._forget(content_hash)
+            return None
+
+        def chunks():
+            with f:
+                f.seek(start)
+                remaining = None if end is None else end - start
+                while remaining is None or remaining > 0:
+                    chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                    if not chunk:
+                        return
+                    if remaining is not None:
+                        remaining -= len(chunk)
+                    yield chunk
+        return chunks()
+
+    def put(self, content_hash: str, data: bytes):
+        """Cache content; failures are logged and otherwise ignored"""
+        for _ in self.tee(content_hash, [data]):
+            pass
+
+    def tee(self, content_hash: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Pass chunks through while writing them to the cache
+
+        The file only enters the cache once every chunk has been consumed,
+        so a download that stops early leaves nothing behind.
+        """
+        if self.max_bytes <= 0:
+            yield from chunks
+            return
+
+        path = self._path(content_hash)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            f = open(temp_path, 'wb')
+        except OSError as e:
+            logger.warning(f"Could not cache PDF {content_hash[:12]}: {e}")
+            yield from chunks
+            return
+
+        size = 0
+        cached = False
+        try:
+            for chunk in chunks:
+                if f is not None:
+                    try:
+                        f.write(chunk)
+                        size += len(chunk)
+                    except OSError as e:
+                        # Keep serving the caller even if the cache disk fills up
+                        logger.warning(f"Could not cache PDF {content_hash[:12]}: {e}")
+                        f.close()
+                        f = None
+                yield chunk
+            if f is not None and size:
+                f.close()
+                try:
+                    os.replace(temp_path, path)
+                    cached = True
+                except OSError as e:
+                    logger.warning(f"Could not cache PDF {content_hash[:12]}: {e}")
+        finally:
+            if f is not None and not f.closed:
+                f.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        if cached:
+            with self._lock:
+                self._total_bytes += size - self._sizes.pop(content_hash, 0)
+                self._sizes[content_hash] = size
+            self._evict()
+
+    def _forget(self, content_hash: str):
+        with self._lock:
+            self._total_bytes -= self._sizes.pop(content_hash, 0)
+
+    def _evict(self):
+        """Remove least recently used files until the cache fits its byte budget"""
+        while True:
+            with self._lock:
+                if self._total_bytes <= self.max_bytes or not self._sizes:
+                    return
+                content_hash, size = self._sizes.popitem(last=False)
+                self._total_bytes -= size
+            try:
+                os.remove(self._path(content_hash))
+            except OSError:
+                pass
+
+
+# Global PDF file cache instance, shared by every PDFStorage in the process
+pdf_file_cache = None
+_pdf_file_cache_lock = threading.Lock()
+
+def get_pdf_file_cache() -> FileCache:
+    """Get the PDF file cache instance (singleton pattern)"""
+    global pdf_file_cache
+    if pdf_file_cache is None:
+        with _pdf_file_cache_lock:
+            if pdf_file_cache is None:
+                pdf_file_cache = FileCache()
+    return pdf_file_cache
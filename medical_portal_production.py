@@ -4,10 +4,17 @@ Medical Report Portal - Production Version
 Deploy-ready version with environment variables
 """
 
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash, session
+from flask import Flask, render_template, request, send_file, redirect, url_for, flash, session, Response
 import pandas as pd
 import os
+import io
+import hmac
+import time
 import hashlib
+import threading
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 from datetime import datetime, timedelta
@@ -21,6 +28,10 @@ REPORTS_FOLDER = os.environ.get('REPORTS_FOLDER', 'reports')
 CUSTOMER_DATA_FILE = os.environ.get('CUSTOMER_DATA_FILE', 'customers.csv')
 LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
 ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
+# Seconds between checks of the customer data file for changes
+CUSTOMER_RELOAD_INTERVAL = float(os.environ.get('CUSTOMER_RELOAD_INTERVAL', '5'))
+# Seconds between background rescans of REPORTS_FOLDER
+REPORT_SCAN_INTERVAL = float(os.environ.get('REPORT_SCAN_INTERVAL', '10'))
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL))
@@ -30,34 +41,105 @@ logger = logging.getLogger(__name__)
 app.permanent_session_lifetime = timedelta(minutes=30)
 
 class CustomerDatabase:
-    def __init__(self, csv_file):
+    def __init__(self, csv_file, reload_interval=CUSTOMER_RELOAD_INTERVAL):
         self.csv_file = csv_file
+        self.reload_interval = reload_interval
+        self._file_signature = None
+        self._content_hash = None
+        self._next_check = time.monotonic() + reload_interval
+        self._reload_lock = threading.Lock()
         self.customers = self.load_customers()
     
+    def _stat_file(self):
+        """(mtime, size) of the data file, or None if it is missing"""
+        try:
+            stat = os.stat(self.csv_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    
     def load_customers(self):
         """Load customer data from CSV"""
         try:
             if not os.path.exists(self.csv_file):
                 logger.error(f"Customer data file not found: {self.csv_file}")
                 return {}
-                
-            df = pd.read_csv(self.csv_file)
-            customers = {}
-            for _, row in df.iterrows():
-                customers[str(row['ID'])] = {
-                    'name': str(row['Name']).strip(),
-                    'email': str(row['Email']).strip().lower(),
-                    'phone': str(row['Phone']).strip(),
-                    'report_file': str(row.get('ReportFileName', f"{row['ID']}.pdf")).strip()
-                }
+            
+            self._file_signature = self._stat_file()
+            with open(self.csv_file, 'rb') as f:
+                data = f.read()
+            self._content_hash = hashlib.sha256(data).hexdigest()
+            
+            customers = self.parse_customers(data)
             logger.info(f"Loaded {len(customers)} customers from {self.csv_file}")
             return customers
         except Exception as e:
             logger.error(f"Error loading customer data: {e}")
             return {}
     
+    @staticmethod
+    def parse_customers(data):
+        """Build the ID to customer map from CSV content with column-wise string operations"""
+        df = pd.read_csv(io.BytesIO(data))
+        ids = df['ID'].astype(str)
+        
+        if 'ReportFileName' in df.columns:
+            report_files = df['ReportFileName'].astype(str).str.strip()
+        else:
+            report_files = df['ID'].astype(str) + '.pdf'
+        
+        phones = df['Phone'].astype(str).str.strip()
+        records = pd.DataFrame({
+            'name': df['Name'].astype(str).str.strip(),
+            'email': df['Email'].astype(str).str.strip().str.lower(),
+            'phone': phones,
+            # Phone numbers match with or without their leading 0
+            'phone_normalized': phones.str.replace(r'^0', '', regex=True),
+            'report_file': report_files
+        }).to_dict('records')
+        
+        # Later rows win for repeated IDs, as with row-by-row assignment
+        return dict(zip(ids, records))
+    
+    def reload_if_changed(self):
+        """
+        Swap in a fresh customer map if the data file has changed
+        
+        Runs at most once per reload_interval. The file's mtime and size are
+        checked first and its content hash second, so a touched but unchanged
+        file is not parsed again. The new map replaces the old one in a
+        single assignment, so requests never see a partial map, and a file
+        that fails to parse leaves the current map in place.
+        """
+        now = time.monotonic()
+        if now < self._next_check or not self._reload_lock.acquire(blocking=False):
+            return
+        
+        try:
+            self._next_check = now + self.reload_interval
+            signature = self._stat_file()
+            if signature is None or signature == self._file_signature:
+                return
+            
+            with open(self.csv_file, 'rb') as f:
+                data = f.read()
+            self._file_signature = signature
+            content_hash = hashlib.sha256(data).hexdigest()
+            if content_hash == self._content_hash:
+                return
+            
+            customers = self.parse_customers(data)
+            self.customers = customers
+            self._content_hash = content_hash
+            logger.info(f"Reloaded {len(customers)} customers from {self.csv_file}")
+        except Exception as e:
+            logger.error(f"Error reloading customer data, keeping the current customers: {e}")
+        finally:
+            self._reload_lock.release()
+    
     def verify_customer(self, customer_id, email, phone):
         """Verify customer credentials with case-insensitive matching"""
+        self.reload_if_changed()
         customer_id = str(customer_id).strip()
         email = email.strip().lower()
         phone = str(phone).strip()
@@ -68,29 +150,249 @@ class CustomerDatabase:
         else:
             phone_normalized = phone
         
-        if customer_id in self.customers:
-            customer = self.customers[customer_id]
-            customer_phone = customer['phone']
-            
-            # Normalize stored phone number too
-            if customer_phone.startswith('0'):
-                customer_phone_normalized = customer_phone[1:]
-            else:
-                customer_phone_normalized = customer_phone
-            
-            # Case-insensitive email matching and flexible phone matching
-            if (customer['email'] == email and 
-                (customer_phone == phone or customer_phone_normalized == phone_normalized)):
+        customer = self.customers.get(customer_id)
+        if customer:
+            # Case-insensitive email matching and flexible phone matching against
+            # values normalized at load time; both comparisons are constant-time
+            # and always run, so timing does not reveal which one failed
+            email_matches = hmac.compare_digest(customer['email'].encode('utf-8'), email.encode('utf-8'))
+            phone_matches = hmac.compare_digest(customer['phone_normalized'].encode('utf-8'),
+                                                phone_normalized.encode('utf-8'))
+            if email_matches and phone_matches:
                 return customer
         return None
     
     def get_customer_by_id(self, customer_id):
         """Get customer data by ID"""
+        self.reload_if_changed()
         return self.customers.get(str(customer_id))
 
+class ReportCatalog:
+    """
+    In-process index of the PDF reports in a folder
+    
+    Maps each file name to its size, mtime and SHA-256 so routes can answer
+    "does this report exist" without touching the filesystem, which is slow
+    on network-mounted report volumes, and build ETags without rereading
+    the file. A background thread rescans the folder every scan_interval
+    seconds; files whose size and mtime are unchanged keep their entry, so a
+    report is hashed once per version, on first use.
+    """
+    
+    def __init__(self, folder, scan_interval=REPORT_SCAN_INTERVAL):
+        self.folder = folder
+        self.scan_interval = scan_interval
+        self.reports = {}
+        self._scan_lock = threading.Lock()
+        self._watcher_pid = None
+        self.refresh()
+    
+    def __len__(self):
+        return len(self.reports)
+    
+    def refresh(self):
+        """Rescan the folder and swap in the new index"""
+        with self._scan_lock:
+            previous = self.reports
+            reports = {}
+            try:
+                with os.scandir(self.folder) as entries:
+                    for entry in entries:
+                        if not entry.name.endswith('.pdf') or not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                        known = previous.get(entry.name)
+                        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+                            reports[entry.name] = known
+                        else:
+                            reports[entry.name] = self._entry(stat)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error scanning reports folder {self.folder}, keeping the current index: {e}")
+                return
+            
+            if reports.keys() != previous.keys():
+                logger.info(f"Report catalog: {len(reports)} reports in {self.folder}")
+            self.reports = reports
+    
+    @staticmethod
+    def _entry(stat):
+        return {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'mtime_ns': stat.st_mtime_ns,
+            'etag': None
+        }
+    
+    def _ensure_watcher(self):
+        """Start the rescan thread in this process (gunicorn workers fork after import)"""
+        if self.scan_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._scan_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name='report-catalog', daemon=True).start()
+    
+    def _watch(self):
+        while True:
+            time.sleep(self.scan_interval)
+            self.refresh()
+    
+    def get(self, report_file):
+        """Catalog entry of a report, or None if the folder has no such file"""
+        self._ensure_watcher()
+        return self.reports.get(report_file)
+    
+    def with_etag(self, report_file, info, attempts=3):
+        """
+        The report's current entry with its SHA-256 ETag
+        
+        The file is stat'ed first (send_file does so anyway), and a report
+        replaced since the last scan gets a fresh entry, so an ETag is never
+        paired with another version's Last-Modified. The hash is computed on
+        the first request for each version and only kept when the file's size
+        and mtime were unchanged while it was read.
+        """
+        path = os.path.join(self.folder, report_file)
+        for _ in range(attempts):
+            stat = os.stat(path)
+            if (stat.st_size, stat.st_mtime_ns) != (info['size'], info['mtime_ns']):
+                info = self._entry(stat)
+                self.reports[report_file] = info
+            if info['etag'] is not None:
+                return info
+            
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                before = os.fstat(f.fileno())
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                after = os.fstat(f.fileno())
+            if (before.st_size, before.st_mtime_ns) == (after.st_size, after.st_mtime_ns) == (info['size'], info['mtime_ns']):
+                info['etag'] = digest.hexdigest()
+                return info
+        # Still being rewritten; serve the last hash without keeping it
+        return dict(self._entry(after), etag=digest.hexdigest())
+
 # Initialize database
 db = CustomerDatabase(CUSTOMER_DATA_FILE)
 
+# Initialize report catalog
+report_catalog = ReportCatalog(REPORTS_FOLDER)
+
+# Reports missing from REPORTS_FOLDER are streamed from MotherDuck when MOTHERDUCK_TOKEN is set
+report_storage = None
+
+def get_report_storage():
+    """Get the MotherDuck PDF storage, or None if it is not configured or unreachable"""
+    global report_storage
+    if report_storage is None and os.environ.get('MOTHERDUCK_TOKEN'):
+        try:
+            from pdf_storage import get_pdf_storage
+            report_storage = get_pdf_storage()
+        except Exception as e:
+            logger.error(f"MotherDuck report storage unavailable: {e}")
+    return report_storage
+
+def get_stored_report(customer_id):
+    """Metadata of the customer's report stored in MotherDuck, or None"""
+    storage = get_report_storage()
+    if storage is None:
+        return None
+    metadata = storage.get_pdf_metadata(customer_id)
+    if metadata and metadata.get('content_hash'):
+        return metadata
+    return None
+
+def stored_report_response(customer_id, download_name=None):
+    """
+    Serve the customer's report from MotherDuck storage
+    
+    Reports already in the local file cache are sent from disk like local
+    reports. Otherwise the report is streamed out of the database in
+    fixed-size chunks, and a single byte range is answered with a 206 that
+    reads only the requested slice, so PDF viewers can show the first page
+    early.
+    
+    Returns None if the report is not stored there, so the caller can fall
+    back to its usual not-found handling.
+    """
+    metadata = get_stored_report(customer_id)
+    if metadata is None:
+        return None
+    
+    storage = get_report_storage()
+    # Stored content is addressed by its SHA-256, which makes a strong ETag
+    etag = metadata['content_hash']
+    
+    cached_path = storage.cached_pdf_path(etag)
+    if cached_path is not None:
+        response = send_file(
+            cached_path,
+            mimetype='application/pdf',
+            as_attachment=download_name is not None,
+            download_name=download_name or f"Health_Report_{customer_id}.pdf",
+            etag=etag,
+            conditional=True
+        )
+        return private_report_cache(response)
+    
+    if not is_resource_modified(request.environ, etag=etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return private_report_cache(response)
+    
+    file_size = metadata['file_size']
+    start, end = 0, file_size
+    byte_range = None
+    # Multi-range requests and an If-Range for another version get the whole file
+    if (request.range and len(request.range.ranges) == 1
+            and ('If-Range' not in request.headers or request.if_range.etag == etag)):
+        byte_range = request.range.range_for_length(file_size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.content_range = ContentRange('bytes', None, None, file_size)
+            return response
+        start, end = byte_range
+    
+    headers = {'Content-Length': str(end - start), 'Accept-Ranges': 'bytes'}
+    if download_name:
+        headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    
+    response = Response(storage.iter_pdf_content(etag, start=start, end=end if byte_range else None),
+                        status=206 if byte_range else 200, mimetype='application/pdf', headers=headers)
+    if byte_range:
+        response.content_range = ContentRange('bytes', start, end, file_size)
+    response.set_etag(etag)
+    return private_report_cache(response)
+
+def private_report_cache(response):
+    """Let the browser keep the report but revalidate it on every open; shared caches must not store it"""
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def send_report(report_file, report_info, download_name=None):
+    """
+    Send a local report with a strong ETag and Last-Modified from the catalog
+    
+    A browser reopening a report it already has gets a 304 with no body.
+    """
+    report_info = report_catalog.with_etag(report_file, report_info)
+    response = send_file(
+        os.path.join(REPORTS_FOLDER, report_file),
+        mimetype='application/pdf',
+        as_attachment=download_name is not None,
+        download_name=download_name,
+        etag=report_info['etag'],
+        last_modified=report_info['mtime'],
+        conditional=True
+    )
+    return private_report_cache(response)
+
 # Security headers
 @app.after_request
 def after_request(response):
@@ -171,8 +473,7 @@ def dashboard():
         return redirect(url_for('verify'))
     
     report_file = customer['report_file']
-    report_path = os.path.join(REPORTS_FOLDER, report_file)
-    report_exists = os.path.exists(report_path)
+    report_exists = report_catalog.get(report_file) is not None or get_stored_report(customer_id) is not None
     
     # Log dashboard access
     log_access("DASHBOARD_ACCESS", customer_id, success=True)
@@ -200,9 +501,14 @@ def download_report():
         return redirect(url_for('dashboard'))
     
     report_file = customer['report_file']
-    report_path = os.path.join(REPORTS_FOLDER, report_file)
+    report_info = report_catalog.get(report_file)
     
-    if not os.path.exists(report_path):
+    if report_info is None:
+        response = stored_report_response(customer_id, download_name=f"Health_Report_{customer_id}.pdf")
+        if response is not None:
+            log_access("REPORT_DOWNLOAD", customer_id, success=True, details="Streamed from MotherDuck")
+            return response
+        
         log_access("DOWNLOAD_ERROR", customer_id, success=False, details="Report file not found")
         flash('Report file not found. Please contact support.', 'error')
         return redirect(url_for('dashboard'))
@@ -211,12 +517,10 @@ def download_report():
         # Log successful download
         log_access("REPORT_DOWNLOAD", customer_id, success=True, details=f"File: {report_file}")
         
-        return send_file(
-            report_path,
-            as_attachment=True,
-            download_name=f"Health_Report_{customer_id}.pdf",
-            mimetype='application/pdf'
-        )
+        return send_report(report_file, report_info, download_name=f"Health_Report_{customer_id}.pdf")
+    except HTTPException:
+        # e.g. 416 for an unsatisfiable Range, which the client must see
+        raise
     except Exception as e:
         logger.error(f"Error downloading report for customer {customer_id}: {e}")
         log_access("DOWNLOAD_ERROR", customer_id, success=False, details=f"Error: {str(e)}")
@@ -240,9 +544,14 @@ def view_report():
         return redirect(url_for('dashboard'))
     
     report_file = customer['report_file']
-    report_path = os.path.join(REPORTS_FOLDER, report_file)
+    report_info = report_catalog.get(report_file)
     
-    if not os.path.exists(report_path):
+    if report_info is None:
+        response = stored_report_response(customer_id)
+        if response is not None:
+            log_access("REPORT_VIEW", customer_id, success=True, details="Streamed from MotherDuck")
+            return response
+        
         log_access("VIEW_ERROR", customer_id, success=False, details="Report file not found")
         flash('Report file not found. Please contact support.', 'error')
         return redirect(url_for('dashboard'))
@@ -251,10 +560,10 @@ def view_report():
         # Log successful view
         log_access("REPORT_VIEW", customer_id, success=True, details=f"File: {report_file}")
         
-        return send_file(
-            report_path,
-            mimetype='application/pdf'
-        )
+        return send_report(report_file, report_info)
+    except HTTPException:
+        # e.g. 416 for an unsatisfiable Range, which the client must see
+        raise
     except Exception as e:
         logger.error(f"Error viewing report for customer {customer_id}: {e}")
         log_access("VIEW_ERROR", customer_id, success=False, details=f"Error: {str(e)}")
@@ -284,7 +593,7 @@ def admin_stats():
             'total_customers': len(db.customers),
             'reports_folder': REPORTS_FOLDER,
             'customer_file': CUSTOMER_DATA_FILE,
-            'reports_count': len([f for f in os.listdir(REPORTS_FOLDER) if f.endswith('.pdf')]) if os.path.exists(REPORTS_FOLDER) else 0
+            'reports_count': len(report_catalog)
         }
         
         return f"""
@@ -314,9 +623,8 @@ if __name__ == '__main__':
     
     # Check if reports folder has files
     if os.path.exists(REPORTS_FOLDER):
-        report_files = [f for f in os.listdir(REPORTS_FOLDER) if f.endswith('.pdf')]
-        print(f"📁 Found {len(report_files)} PDF reports in {REPORTS_FOLDER}")
-        if len(report_files) == 0:
+        print(f"📁 Found {len(report_catalog)} PDF reports in {REPORTS_FOLDER}")
+        if len(report_catalog) == 0:
             print("⚠️  No PDF reports found. Please upload reports to the server.")
     else:
         print(f"📁 Creating reports folder: {REPORTS_FOLDER}")
@@ -5,17 +5,33 @@ Handles storing and retrieving PDF reports from the cloud database
 """
 
 import os
-import base64
 import hashlib
-from typing import Optional, Dict, Any
+from typing import Optional, Callable, Dict, Any, Iterable, Iterator, List, Tuple, Union
 import logging
+import pandas as pd
 from database_config import get_db
+from local_cache import MemoryCache, get_pdf_file_cache, is_missing
 
 logger = logging.getLogger(__name__)
 
+# Bytes fetched per query when streaming a PDF out of the database
+PDF_CHUNK_SIZE = int(os.environ.get('PDF_CHUNK_SIZE', str(256 * 1024)))
+# Reports written per transaction by store_many; each one is held in memory until its batch is written
+PDF_BATCH_SIZE = int(os.environ.get('PDF_BATCH_SIZE', '25'))
+
+
+def pdf_content_hash(pdf_data: Union[bytes, memoryview]) -> str:
+    """SHA-256 hex digest identifying a PDF's content"""
+    return hashlib.sha256(pdf_data).hexdigest()
+
+
 class PDFStorage:
     def __init__(self):
         self.db = get_db()
+        # Customer to report lookups, invalidated on every write through this instance
+        self.metadata_cache = MemoryCache()
+        # PDF content on local disk, keyed by hash so it never goes stale
+        self.file_cache = get_pdf_file_cache()
     
     def store_pdf(self, file_path: str, customer_id: str, company_name: str) -> bool:
         """
@@ -38,27 +54,79 @@ class PDFStorage:
             with open(file_path, 'rb') as f:
                 pdf_data = f.read()
             
-            # Encode to base64 for storage
-            pdf_base64 = base64.b64encode(pdf_data).decode('utf-8')
+            return self.store_pdf_data(pdf_data, os.path.basename(file_path), customer_id, company_name)
+            
+        except Exception as e:
+            logger.error(f"Error storing PDF for {customer_id}: {e}")
+            return False
+    
+    def store_pdf_data(self, pdf_data: Union[bytes, memoryview], file_name: str, customer_id: str,
+                       company_name: str) -> bool:
+        """
+        Store PDF content already held in memory
+        
+        Content is stored once per SHA-256 in pdf_contents and the
+        customer's pdf_reports row points at it, so storing a PDF whose
+        bytes are already in the database only writes the small report row.
+        Content the replaced report pointed at is deleted in the same
+        transaction once nothing refers to it.
+        
+        Args:
+            pdf_data: PDF content as bytes or a memoryview over it
+            file_name: Report file name
+            customer_id: Customer ID
+            company_name: Company name
+            
+        Returns:
+            True if successful, False otherwise
+        """
+        try:
+            file_size = len(pdf_data) if isinstance(pdf_data, bytes) else memoryview(pdf_data).nbytes
+            content_hash = pdf_content_hash(pdf_data)
+            report_id = f"{customer_id}_{file_name}"
             
-            # Get file info
-            file_size = len(pdf_data)
-            file_name = os.path.basename(file_path)
+            # Upload the content only if these exact bytes are not stored yet
+            upload = not self.has_content(content_hash)
+            if not upload:
+                logger.info(f"PDF content for {customer_id} already stored, skipping upload")
             
-            # Store in database
-            self.db.conn.execute("""
-                INSERT OR REPLACE INTO pdf_reports (
-                    customer_id, 
-                    file_name, 
-                    file_data, 
-                    file_size, 
-                    company_name,
-                    created_at
-                ) VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            """, [customer_id, file_name, pdf_base64, file_size, company_name])
-            
-            # Store metadata
-            self.db.store_report_metadata(customer_id, file_name, file_size, company_name)
+            conn = self.db.conn
+            conn.execute("BEGIN TRANSACTION")
+            try:
+                replaced = [row[0] for row in conn.execute("""
+                    SELECT content_hash FROM pdf_reports WHERE id = ?
+                """, [report_id]).fetchall()]
+                
+                if upload:
+                    conn.execute("""
+                        INSERT INTO pdf_contents (content_hash, file_data, file_size)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                    """, [content_hash, pdf_data, file_size])
+                
+                # Store in database
+                conn.execute("""
+                    INSERT OR REPLACE INTO pdf_reports (
+                        id,
+                        customer_id, 
+                        file_name, 
+                        content_hash, 
+                        file_size, 
+                        company_name,
+                        created_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                """, [report_id, customer_id, file_name, content_hash, file_size, company_name])
+                
+                # Store metadata
+                self.db.store_report_metadata(customer_id, file_name, file_size, company_name)
+                
+                self._delete_replaced_contents(conn, replaced)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            
+            self.metadata_cache.invalidate(customer_id)
             
             logger.info(f"Stored PDF for {customer_id}: {file_name} ({file_size} bytes)")
             return True
@@ -67,6 +135,132 @@ class PDFStorage:
             logger.error(f"Error storing PDF for {customer_id}: {e}")
             return False
     
+    def store_many(self, reports: Iterable[Tuple[str, ...]], batch_size: int = PDF_BATCH_SIZE) -> int:
+        """
+        Store many PDF files, a batch per transaction
+        
+        Each batch costs a handful of round trips (a content lookup and one
+        multi-row insert per table) instead of two per report.
+        
+        Args:
+            reports: (file_path, customer_id, company_name) tuples, as
+                passed to store_pdf, optionally followed by the file name
+                to store the report under
+            batch_size: Reports written per transaction
+            
+        Returns:
+            Number of reports stored
+        """
+        with PDFBatchWriter(self, batch_size) as writer:
+            for report in reports:
+                writer.add(*report)
+        return writer.stored
+    
+    def _write_batch(self, batch: List[Dict[str, Any]]) -> int:
+        """
+        Write buffered reports in one transaction
+        
+        Returns:
+            Number of reports stored, 0 if the batch failed
+        """
+        # A report added twice keeps its last content, as repeated store_pdf calls would
+        reports = {f"{report['customer_id']}_{report['file_name']}": report for report in batch}
+        reports_df = pd.DataFrame([{
+            'id': report_id,
+            'customer_id': report['customer_id'],
+            'file_name': report['file_name'],
+            'content_hash': report['content_hash'],
+            'file_size': report['file_size'],
+            'company_name': report['company_name']
+        } for report_id, report in reports.items()])
+        
+        conn = self.db.conn
+        registered = []
+        try:
+            conn.register('pdf_batch_reports', reports_df)
+            registered.append('pdf_batch_reports')
+            
+            # Only upload content that is not stored yet
+            existing = {row[0] for row in conn.execute("""
+                SELECT DISTINCT c.content_hash
+                FROM pdf_contents c
+                JOIN pdf_batch_reports b ON c.content_hash = b.content_hash
+            """).fetchall()}
+            contents = {}
+            for report in reports.values():
+                if report['content_hash'] not in existing:
+                    contents.setdefault(report['content_hash'], report)
+            
+            if contents:
+                contents_df = pd.DataFrame({
+                    'content_hash': list(contents),
+                    'file_data': [report['pdf_data'] for report in contents.values()],
+                    'file_size': [report['file_size'] for report in contents.values()]
+                })
+                conn.register('pdf_batch_contents', contents_df)
+                registered.append('pdf_batch_contents')
+            
+            conn.execute("BEGIN TRANSACTION")
+            try:
+                replaced = [row[0] for row in conn.execute("""
+                    SELECT DISTINCT p.content_hash
+                    FROM pdf_reports p
+                    JOIN pdf_batch_reports b ON p.id = b.id
+                """).fetchall()]
+                if contents:
+                    conn.execute("""
+                        INSERT INTO pdf_contents (content_hash, file_data, file_size)
+                        SELECT content_hash, file_data, file_size FROM pdf_batch_contents
+                        ON CONFLICT DO NOTHING
+                    """)
+                conn.execute("""
+                    INSERT OR REPLACE INTO pdf_reports (id, customer_id, file_name, content_hash, file_size, company_name, created_at)
+                    SELECT id, customer_id, file_name, content_hash, file_size, company_name, CURRENT_TIMESTAMP
+                    FROM pdf_batch_reports
+                """)
+                conn.execute("""
+                    INSERT OR REPLACE INTO reports (id, customer_id, report_name, file_size, company_name)
+                    SELECT id, customer_id, file_name, file_size, company_name FROM pdf_batch_reports
+                """)
+                self._delete_replaced_contents(conn, replaced)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            
+            for report in reports.values():
+                self.metadata_cache.invalidate(report['customer_id'])
+            
+            logger.info(f"Stored {len(reports)} PDFs ({len(contents)} new, {len(reports) - len(contents)} already stored)")
+            return len(reports)
+            
+        except Exception as e:
+            logger.error(f"Error storing batch of {len(reports)} PDFs: {e}")
+            return 0
+        finally:
+            for name in registered:
+                conn.unregister(name)
+    
+    def _delete_replaced_contents(self, conn, content_hashes: List[str]):
+        """Delete content that replaced reports pointed at, unless another report still does"""
+        if not content_hashes:
+            return
+        placeholders = ', '.join('?' for _ in content_hashes)
+        conn.execute(f"""
+            DELETE FROM pdf_contents
+            WHERE content_hash IN ({placeholders})
+            AND content_hash NOT IN (
+                SELECT content_hash FROM pdf_reports WHERE content_hash IS NOT NULL
+            )
+        """, list(content_hashes))
+    
+    def has_content(self, content_hash: str) -> bool:
+        """Check whether a PDF with this SHA-256 is already stored"""
+        result = self.db.conn.execute("""
+            SELECT 1 FROM pdf_contents WHERE content_hash = ?
+        """, [content_hash]).fetchone()
+        return result is not None
+    
     def get_pdf(self, customer_id: str) -> Optional[bytes]:
         """
         Retrieve PDF file from MotherDuck database
@@ -78,18 +272,22 @@ class PDFStorage:
             PDF data as bytes, or None if not found
         """
         try:
-            result = self.db.conn.execute("""
-                SELECT file_data FROM pdf_reports 
-                WHERE customer_id = ?
-                ORDER BY created_at DESC
-                LIMIT 1
-            """, [customer_id]).fetchone()
-            
-            if result:
-                # Decode from base64
-                pdf_data = base64.b64decode(result[0])
-                logger.info(f"Retrieved PDF for {customer_id}")
-                return pdf_data
+            metadata = self.get_pdf_metadata(customer_id)
+            if metadata and metadata.get('content_hash'):
+                content_hash = metadata['content_hash']
+                pdf_data = self.file_cache.get(content_hash)
+                if pdf_data is None:
+                    result = self.db.conn.execute("""
+                        SELECT file_data FROM pdf_contents WHERE content_hash = ?
+                    """, [content_hash]).fetchone()
+                    # BLOB columns come back as bytes, no decoding needed
+                    pdf_data = result[0] if result else None
+                    if pdf_data is not None:
+                        self.file_cache.put(content_hash, pdf_data)
+                
+                if pdf_data is not None:
+                    logger.info(f"Retrieved PDF for {customer_id}")
+                    return pdf_data
             
             logger.warning(f"No PDF found for customer {customer_id}")
             return None
@@ -98,34 +296,99 @@ class PDFStorage:
             logger.error(f"Error retrieving PDF for {customer_id}: {e}")
             return None
     
+    def iter_pdf_content(self, content_hash: str, chunk_size: int = PDF_CHUNK_SIZE, start: int = 0,
+                         end: Optional[int] = None) -> Iterator[bytes]:
+        """
+        Stream stored PDF content in fixed-size chunks
+        
+        Content in the local file cache is read from disk. Otherwise each
+        chunk is sliced out of the BLOB by its own query, so at most one
+        chunk is held in memory at a time, and the file is cached once the
+        whole PDF has been streamed. The reads go through a separate cursor,
+        which lets a web server consume the generator after the request
+        handler has returned.
+        
+        Args:
+            content_hash: SHA-256 of the content, e.g. from get_pdf_metadata
+            chunk_size: Bytes per chunk
+            start: Offset of the first byte, for range requests
+            end: Offset just past the last byte, or None for the rest of the PDF
+            
+        Returns:
+            Iterator over consecutive chunks of the PDF
+        """
+        cached = self.file_cache.iter_chunks(content_hash, chunk_size, start, end)
+        if cached is not None:
+            return cached
+        stored = self._iter_stored_content(content_hash, chunk_size, start, end)
+        if start or end is not None:
+            # Only complete reads are worth caching
+            return stored
+        return self.file_cache.tee(content_hash, stored)
+    
+    def cached_pdf_path(self, content_hash: str) -> Optional[str]:
+        """Path of the PDF in the local file cache, or None if it is not cached"""
+        return self.file_cache.path(content_hash)
+    
+    def _iter_stored_content(self, content_hash: str, chunk_size: int, start: int = 0,
+                             end: Optional[int] = None) -> Iterator[bytes]:
+        """Read stored PDF content from the database a chunk at a time"""
+        cursor = self.db.conn.cursor()
+        try:
+            result = cursor.execute("""
+                SELECT file_size FROM pdf_contents WHERE content_hash = ?
+            """, [content_hash]).fetchone()
+            if not result:
+                logger.warning(f"No PDF content stored for {content_hash}")
+                return
+            
+            end = result[0] if end is None else min(end, result[0])
+            for offset in range(start, end, chunk_size):
+                # BLOB slices are 1-based and include both ends
+                chunk = cursor.execute("""
+                    SELECT file_data[?:?] FROM pdf_contents WHERE content_hash = ?
+                """, [offset + 1, min(offset + chunk_size, end), content_hash]).fetchone()[0]
+                yield chunk
+        finally:
+            cursor.close()
+    
     def get_pdf_metadata(self, customer_id: str) -> Optional[Dict[str, Any]]:
         """
         Get PDF metadata for a customer
         
+        Recent lookups, including misses, are answered from memory.
+        
         Args:
             customer_id: Customer ID
             
         Returns:
             PDF metadata dictionary, or None if not found
         """
+        cached = self.metadata_cache.get(customer_id)
+        if not is_missing(cached):
+            return dict(cached) if cached else None
+        
         try:
             result = self.db.conn.execute("""
-                SELECT file_name, file_size, created_at, company_name
+                SELECT file_name, file_size, created_at, company_name, content_hash
                 FROM pdf_reports 
                 WHERE customer_id = ?
                 ORDER BY created_at DESC
                 LIMIT 1
             """, [customer_id]).fetchone()
             
+            metadata = None
             if result:
-                return {
+                metadata = {
                     'file_name': result[0],
                     'file_size': result[1],
                     'created_at': result[2],
-                    'company_name': result[3]
+                    'company_name': result[3],
+                    'content_hash': result[4]
                 }
             
-            return None
+            self.metadata_cache.set(customer_id, metadata)
+            return dict(metadata) if metadata else None
             
         except Exception as e:
             logger.error(f"Error getting PDF metadata for {customer_id}: {e}")
@@ -178,6 +441,8 @@ class PDFStorage:
             self.db.conn.execute("""
                 DELETE FROM pdf_reports WHERE customer_id = ?
             """, [customer_id])
+            self.metadata_cache.invalidate(customer_id)
+            self.prune_contents()
             
             logger.info(f"Deleted PDF for {customer_id}")
             return True
@@ -186,6 +451,112 @@ class PDFStorage:
             logger.error(f"Error deleting PDF for {customer_id}: {e}")
             return False
 
+    def prune_contents(self) -> int:
+        """
+        Delete stored PDF content no report refers to any more
+        
+        Returns:
+            Number of content rows removed
+        """
+        try:
+            result = self.db.conn.execute("""
+                DELETE FROM pdf_contents
+                WHERE content_hash NOT IN (
+                    SELECT content_hash FROM pdf_reports WHERE content_hash IS NOT NULL
+                )
+            """).fetchone()
+            removed = result[0] if result else 0
+            if removed:
+                logger.info(f"Pruned {removed} unreferenced PDF contents")
+            return removed
+            
+        except Exception as e:
+            logger.error(f"Error pruning PDF contents: {e}")
+            return 0
+
+class PDFBatchWriter:
+    """
+    Buffers PDFs and writes them to the database a batch at a time
+    
+    Files are read when they are added, so callers may delete them right
+    away. Use it as a context manager, or call flush() at the end, so the
+    last partial batch is written too.
+    
+    on_stored, if given, is called with the customer IDs of each batch once
+    it is committed, from whichever thread flushed it.
+    """
+    
+    def __init__(self, storage: PDFStorage, batch_size: int = PDF_BATCH_SIZE,
+                 on_stored: Optional[Callable[[List[str]], None]] = None):
+        self.storage = storage
+        self.batch_size = max(batch_size, 1)
+        self.on_stored = on_stored
+        self.stored = 0
+        self.failed: List[str] = []
+        self._pending: List[Dict[str, Any]] = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+        return False
+    
+    def add(self, file_path: str, customer_id: str, company_name: str,
+            file_name: Optional[str] = None) -> bool:
+        """
+        Queue a PDF file, writing the batch once it is full
+        
+        Args:
+            file_path: Path to PDF file
+            customer_id: Customer ID
+            company_name: Company name
+            file_name: Name to store the report under, replacing any earlier
+                report of the customer with that name; defaults to the
+                file's own name
+        
+        Returns:
+            False if the file could not be read
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                pdf_data = f.read()
+        except OSError as e:
+            logger.error(f"PDF file not readable: {file_path}: {e}")
+            self.failed.append(customer_id)
+            return False
+        
+        self._pending.append({
+            'customer_id': customer_id,
+            'file_name': file_name or os.path.basename(file_path),
+            'company_name': company_name,
+            'pdf_data': pdf_data,
+            'content_hash': pdf_content_hash(pdf_data),
+            'file_size': len(pdf_data)
+        })
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+        return True
+    
+    def flush(self) -> int:
+        """
+        Write whatever is buffered
+        
+        Returns:
+            Number of reports stored by this flush
+        """
+        if not self._pending:
+            return 0
+        
+        batch, self._pending = self._pending, []
+        stored = self.storage._write_batch(batch)
+        self.stored += stored
+        if not stored:
+            self.failed.extend(report['customer_id'] for report in batch)
+        elif self.on_stored:
+            self.on_stored([report['customer_id'] for report in batch])
+        return stored
+
 # Global PDF storage instance
 pdf_storage = None
 
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Report Scheduler
+Renders individual PDF reports across a pool of worker processes so bulk
+runs use every core instead of rendering one report at a time, optionally
+ahead of a slower consumer such as the email sender
+"""
+
+import os
+import json
+import queue
+import hashlib
+import logging
+import threading
+import numbers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+import pandas as pd
+from individual_report_generator import generate_individual_report
+
+logger = logging.getLogger(__name__)
+
+# Worker processes used when the caller does not choose; override with REPORT_WORKERS
+DEFAULT_REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', os.cpu_count() or 1))
+# Finished reports the pipeline may hold ahead of its consumer
+DEFAULT_REPORT_BUFFER = int(os.environ.get('REPORT_BUFFER', '16'))
+# Workers start fresh instead of being forked: pools are created from worker threads of
+# a process running other threads, and a forked child could inherit a lock held mid-fork
+_WORKER_CONTEXT = multiprocessing.get_context('spawn')
+
+# Characters that cannot appear in file names on Windows or in URLs
+_UNSAFE_FILENAME_CHARS = '/\\:*?"<>|'
+
+# Record fields an individual report and its email are built from
+REPORT_FIELDS = [
+    'ENROLLEE ID', 'NAME', 'EMAIL', 'COMPANY', 'AGE', 'GENDER',
+    'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI', 'CHOLESTEROL',
+    'GLUCOSE', 'PROTEIN', 'PSA'
+]
+
+
+def clean_report_filename(enrollee_id) -> str:
+    """Make an ENROLLEE ID safe to use as a file name while keeping it readable"""
+    clean_enrollee_id = str(enrollee_id)
+    for char in _UNSAFE_FILENAME_CHARS:
+        clean_enrollee_id = clean_enrollee_id.replace(char, '_')
+    return clean_enrollee_id
+
+
+def report_fingerprint(individual_data: Dict[str, Any]) -> str:
+    """
+    SHA-256 of the record a report is rendered from
+
+    Re-running a workbook gives the same fingerprint for unchanged
+    enrollees, so a delivery ledger can tell a report already sent from
+    one whose readings have since changed. Only REPORT_FIELDS are hashed,
+    and values are canonicalized first, so the fingerprint does not depend
+    on how the workbook was loaded: missing values (None, NaN, pd.NA,
+    NaT) all hash as null, and numbers as floats whatever their dtype.
+    """
+    canonical = json.dumps(
+        {field: _canonical_value(individual_data.get(field)) for field in REPORT_FIELDS},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _canonical_value(value):
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def make_report_job(individual_data: Dict[str, Any], analysis: Dict[str, Any], output_path: str) -> Dict[str, Any]:
+    """
+    Describe one report to render
+
+    Args:
+        individual_data: Enrollee record
+        analysis: Result of analyze_individual_health for the record
+        output_path: Where the PDF should be written
+
+    Returns:
+        Job dict understood by generate_reports
+    """
+    return {
+        'enrollee_id': str(individual_data.get('ENROLLEE ID')),
+        'report_hash': report_fingerprint(individual_data),
+        'individual_data': individual_data,
+        'analysis': analysis,
+        'output_path': output_path
+    }
+
+
+def report_failure(job: Dict[str, Any], error) -> Dict[str, str]:
+    """Failure row in the same shape as the bulk email failed_emails list"""
+    individual_data = job['individual_data']
+    return {
+        'Name': individual_data.get('NAME', 'Unknown'),
+        'Email': individual_data.get('EMAIL', 'Unknown'),
+        'Error': str(error)
+    }
+
+
+def iter_reports(jobs: Iterable[Dict[str, Any]], max_workers: Optional[int] = None):
+    """
+    Render reports and yield each job as soon as its PDF is finished
+
+    Only a couple of jobs per worker are submitted at a time, so a consumer
+    that stops pulling also stops the rendering.
+
+    Args:
+        jobs: Report jobs from make_report_job
+        max_workers: Worker processes; 1 renders in the calling process
+
+    Yields:
+        (job, error) tuples in completion order, where error is None on success
+    """
+    max_workers = max_workers or DEFAULT_REPORT_WORKERS
+
+    if max_workers <= 1:
+        for job in jobs:
+            try:
+                generate_individual_report(job['individual_data'], job['analysis'], job['output_path'])
+                yield job, None
+            except Exception as e:
+                logger.error(f"Error generating report for {job['enrollee_id']}: {e}")
+                yield job, e
+        return
+
+    jobs = iter(jobs)
+    pending = {}
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=_WORKER_CONTEXT) as pool:
+        try:
+            while True:
+                for job in jobs:
+                    future = pool.submit(generate_individual_report, job['individual_data'],
+                                         job['analysis'], job['output_path'])
+                    pending[future] = job
+                    if len(pending) >= max_workers * 2:
+                        break
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        future.result()
+                        yield job, None
+                    except Exception as e:
+                        logger.error(f"Error generating report for {job['enrollee_id']}: {e}")
+                        yield job, e
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def generate_reports(jobs: Iterable[Dict[str, Any]], max_workers: Optional[int] = None,
+                     progress_callback: Optional[Callable[[int, int, Dict[str, Any]], None]] = None
+                     ) -> Tuple[List[Dict[str, Any]], List[Dict[str, str]]]:
+    """
+    Render a batch of individual reports in parallel
+
+    Args:
+        jobs: Report jobs from make_report_job
+        max_workers: Worker processes; 1 renders in the calling process
+        progress_callback: Called as progress_callback(completed, total, job)
+            after each report finishes. It runs in the calling thread, so it
+            may update Streamlit widgets.
+
+    Returns:
+        (generated, failed_reports): jobs whose PDF was written, in the order
+        they were given, and failure rows shaped like failed_emails
+    """
+    jobs = list(jobs)
+    total = len(jobs)
+    succeeded = set()
+    failed_reports = []
+
+    for completed, (job, error) in enumerate(iter_reports(jobs, max_workers), start=1):
+        if error is None:
+            succeeded.add(id(job))
+        else:
+            failed_reports.append(report_failure(job, error))
+        if progress_callback:
+            progress_callback(completed, total, job)
+
+    generated = [job for job in jobs if id(job) in succeeded]
+    return generated, failed_reports
+
+
+class _PipelineDone:
+    """End-of-stream marker, carrying the producer's error if it failed"""
+
+    def __init__(self, error=None):
+        self.error = error
+
+
+def pipeline_reports(jobs: Iterable[Dict[str, Any]], max_workers: Optional[int] = None,
+                     buffer_size: int = DEFAULT_REPORT_BUFFER,
+                     after_render: Optional[Callable[[Dict[str, Any]], None]] = None):
+    """
+    Render reports in a background thread, ahead of the consumer
+
+    A producer thread renders through the process pool, runs after_render
+    (for example storing the PDF), and puts each finished job on a bounded
+    queue. The caller drains it at its own pace, so rendering overlaps with
+    slow consumers such as rate-limited email sending.
+
+    Args:
+        jobs: Report jobs from make_report_job
+        max_workers: Worker processes; 1 renders in the producer thread
+        buffer_size: Finished jobs held ahead of the consumer
+        after_render: Called with each successfully rendered job in the
+            producer thread; an exception marks the job as failed. It must
+            not touch Streamlit widgets.
+
+    Yields:
+        (job, error) tuples in completion order, where error is None on success
+    """
+    report_queue = queue.Queue(maxsize=max(buffer_size, 1))
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # Give up when the consumer has gone away rather than block forever
+        while not stop.is_set():
+            try:
+                report_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        error = None
+        try:
+            for job, job_error in iter_reports(jobs, max_workers):
+                if job_error is None and after_render:
+                    try:
+                        after_render(job)
+                    except Exception as e:
+                        logger.error(f"Error storing report for {job['enrollee_id']}: {e}")
+                        job_error = e
+                if not put((job, job_error)):
+                    return
+        except Exception as e:
+            logger.error(f"Report pipeline stopped: {e}")
+            error = e
+        put(_PipelineDone(error))
+
+    producer = threading.Thread(target=produce, name='report-pipeline', daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = report_queue.get()
+            if isinstance(item, _PipelineDone):
+                if item.error is not None:
+                    raise item.error
+                return
+            yield item
+    finally:
+        stop.set()
+        producer.join()
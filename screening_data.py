@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Screening Workbook Ingest
+Parses each screening workbook once, keyed by a hash of its content, keeps a
+typed columnar copy on disk that later reads reuse, and indexes the rows by
+ENROLLEE ID for individual lookups
+"""
+
+import os
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Iterable
+import pandas as pd
+from health_metrics import NUMERIC_COLUMNS, normalize_urine_results
+
+logger = logging.getLogger(__name__)
+
+WORKBOOK_CACHE_DIR = os.environ.get('WORKBOOK_CACHE_DIR', os.path.join('.cache', 'workbooks'))
+# Number of parsed workbooks kept in memory per process
+WORKBOOK_MEMORY_SLOTS = int(os.environ.get('WORKBOOK_MEMORY_SLOTS', '8'))
+# Bump whenever prepare_screening_frame changes so older cached copies are ignored
+INGEST_VERSION = 1
+
+URINE_COLUMNS = ['GLUCOSE', 'PROTEIN']
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def read_workbook_bytes(source) -> bytes:
+    """
+    Read the raw bytes of a workbook
+
+    Args:
+        source: File path, raw bytes, or a file-like object such as a
+            Streamlit UploadedFile
+
+    Returns:
+        Workbook content as bytes
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return f.read()
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+
+    source.seek(0)
+    data = source.read()
+    source.seek(0)
+    return data
+
+
+def workbook_hash(data: bytes) -> str:
+    """SHA-256 hex digest identifying a workbook's content"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def prepare_screening_frame(data_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Coerce the numeric reading columns and normalize the urine result columns
+
+    PSA is left as-is because it holds either numbers or POSITIVE/NEGATIVE.
+    """
+    for col in NUMERIC_COLUMNS:
+        if col in data_df.columns:
+            data_df[col] = pd.to_numeric(data_df[col], errors='coerce')
+
+    if all(col in data_df.columns for col in URINE_COLUMNS):
+        for col in URINE_COLUMNS:
+            data_df[col] = normalize_urine_results(data_df[col])
+
+    return data_df
+
+
+def normalize_enrollee_id(enrollee_id) -> str:
+    """
+    Normalize an ENROLLEE ID for lookups
+
+    IDs typed as numbers in Excel come back as floats when the column has
+    blanks, so integral floats are matched by their integer form.
+    """
+    if isinstance(enrollee_id, float) and enrollee_id.is_integer():
+        enrollee_id = int(enrollee_id)
+    return str(enrollee_id).strip()
+
+
+class ScreeningDataset:
+    """
+    A prepared screening workbook indexed by normalized ENROLLEE ID
+
+    The underlying frame is shared between callers and must be treated as
+    read-only; records returned by get() and get_many() are fresh dicts.
+    """
+
+    def __init__(self, data_df: pd.DataFrame, content_hash: str = None):
+        self.data_df = data_df
+        self.content_hash = content_hash
+        self._positions = None
+        self._index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data_df)
+
+    @property
+    def positions(self) -> Dict[str, int]:
+        """Map of normalized ENROLLEE ID to row position, built on first use"""
+        if self._positions is None:
+            with self._index_lock:
+                if self._positions is None:
+                    positions = {}
+                    if 'ENROLLEE ID' in self.data_df.columns:
+                        for position, enrollee_id in enumerate(self.data_df['ENROLLEE ID']):
+                            if pd.notna(enrollee_id):
+                                # First row wins, as the old boolean-mask lookup did
+                                positions.setdefault(normalize_enrollee_id(enrollee_id), position)
+                    self._positions = positions
+        return self._positions
+
+    def __contains__(self, enrollee_id) -> bool:
+        return normalize_enrollee_id(enrollee_id) in self.positions
+
+    def get(self, enrollee_id) -> Optional[Dict[str, Any]]:
+        """
+        Look up one enrollee
+
+        Args:
+            enrollee_id: ENROLLEE ID as typed or as read from the workbook
+
+        Returns:
+            Record dict with numeric columns already coerced, or None if not found
+        """
+        position = self.positions.get(normalize_enrollee_id(enrollee_id))
+        if position is None:
+            return None
+        return self.data_df.iloc[position].to_dict()
+
+    def get_many(self, enrollee_ids: Iterable) -> List[Optional[Dict[str, Any]]]:
+        """
+        Look up several enrollees with a single row selection
+
+        Args:
+            enrollee_ids: ENROLLEE IDs to fetch
+
+        Returns:
+            Records in the same order as enrollee_ids, with None for unknown IDs
+        """
+        positions = [self.positions.get(normalize_enrollee_id(enrollee_id)) for enrollee_id in enrollee_ids]
+        found = [position for position in positions if position is not None]
+        records = iter(self.data_df.iloc[found].to_dict('records'))
+        return [None if position is None else next(records) for position in positions]
+
+
+def load_workbook(source) -> pd.DataFrame:
+    """
+    Load a screening workbook, parsing it only the first time its content is seen
+
+    Numeric reading columns come back already coerced and urine columns
+    already normalized. Each call returns its own copy, so callers may add
+    or overwrite columns freely.
+
+    Args:
+        source: File path, raw bytes, or file-like object holding the workbook
+
+    Returns:
+        Prepared screening DataFrame
+    """
+    return load_dataset(source).data_df.copy()
+
+
+def load_dataset(source) -> ScreeningDataset:
+    """
+    Load a screening workbook as a shared, indexed ScreeningDataset
+
+    Args:
+        source: File path, raw bytes, or file-like object holding the workbook
+
+    Returns:
+        ScreeningDataset for the workbook's content
+    """
+    data = read_workbook_bytes(source)
+    return _load_prepared_dataset(workbook_hash(data), data)
+
+
+def _load_prepared_dataset(content_hash: str, data: bytes) -> ScreeningDataset:
+    """Return the shared dataset for a workbook, from memory, disk or a fresh parse"""
+    with _memory_lock:
+        dataset = _memory_cache.get(content_hash)
+        if dataset is not None:
+            _memory_cache.move_to_end(content_hash)
+            return dataset
+
+    data_df = _read_cached_copy(content_hash)
+    if data_df is None:
+        data_df = prepare_screening_frame(pd.read_excel(io.BytesIO(data)))
+        _write_cached_copy(content_hash, data_df)
+        logger.info(f"Parsed workbook {content_hash[:12]} ({len(data_df)} rows)")
+
+    dataset = ScreeningDataset(data_df, content_hash)
+    with _memory_lock:
+        dataset = _memory_cache.setdefault(content_hash, dataset)
+        while len(_memory_cache) > WORKBOOK_MEMORY_SLOTS:
+            _memory_cache.popitem(last=False)
+
+    return dataset
+
+
+def _cache_path(content_hash: str, extension: str) -> str:
+    return os.path.join(WORKBOOK_CACHE_DIR, f"{content_hash}-v{INGEST_VERSION}.{extension}")
+
+
+def _read_cached_copy(content_hash: str):
+    """Read a previously persisted workbook copy, or None if there is none"""
+    parquet_path = _cache_path(content_hash, 'parquet')
+    pickle_path = _cache_path(content_hash, 'pkl')
+    try:
+        if os.path.exists(parquet_path):
+            return pd.read_parquet(parquet_path)
+        if os.path.exists(pickle_path):
+            return pd.read_pickle(pickle_path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable workbook cache for {content_hash[:12]}: {e}")
+    return None
+
+
+def _write_cached_copy(content_hash: str, data_df: pd.DataFrame):
+    """
+    Persist a prepared workbook as Parquet
+
+    Columns mixing numbers and text (PSA, phone numbers typed both ways)
+    cannot be stored as Arrow, so those workbooks fall back to a pickle,
+    which keeps the exact Python values.
+    """
+    try:
+        os.makedirs(WORKBOOK_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Workbook cache directory unavailable: {e}")
+        return
+
+    parquet_path = _cache_path(content_hash, 'parquet')
+    try:
+        _atomic_write(parquet_path, lambda path: data_df.to_parquet(path, index=False))
+        return
+    except (ImportError, ValueError, TypeError, NotImplementedError) as e:
+        logger.info(f"Workbook {content_hash[:12]} is not Arrow-compatible, caching as pickle: {e}")
+
+    try:
+        _atomic_write(_cache_path(content_hash, 'pkl'), lambda path: data_df.to_pickle(path))
+    except Exception as e:
+        logger.warning(f"Could not cache workbook {content_hash[:12]}: {e}")
+
+
+def _atomic_write(path: str, write):
+    """Write through a temporary file so concurrent readers never see a partial copy"""
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
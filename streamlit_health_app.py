@@ -1,20 +1,34 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import requests
 import os
 from datetime import datetime
 from report_generator import generate_report
 from individual_report_generator import generate_individual_report
 import tempfile
 import time
+import threading
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 from database_config import get_db, close_db
-from pdf_storage import get_pdf_storage
+from pdf_storage import get_pdf_storage, PDFBatchWriter
+from email_delivery import (
+    SMTPSession, AdaptiveRateLimiter, get_http_session, get_zoho_token_cache, is_throttled, send_rate_limited,
+    send_zoho_batch, zoho_async_available
+)
+from health_metrics import (
+    BLOOD_PRESSURE, BLOOD_SUGAR, CHOLESTEROL, BMI, categorize, normalize_urine_results,
+    summarize_categories, analyze_individual_health_frame
+)
+from screening_data import load_workbook, load_dataset, read_workbook_bytes
+from background_jobs import get_job_queue, save_job_file
+from report_scheduler import (
+    DEFAULT_REPORT_WORKERS, clean_report_filename, make_report_job, report_failure, report_fingerprint,
+    generate_reports, pipeline_reports
+)
 
 # Zoho Mail Configuration
 CLIENT_ID = "1000.N7OTEZEMAV4AS2X2FEC0P7P2PYJIZC"
@@ -47,21 +61,8 @@ def initialize_motherduck():
         return None, None
 
 def get_access_token():
-    """Get a fresh access token from Zoho"""
-    url = "https://accounts.zoho.com/oauth/v2/token"
-    data = {
-        "refresh_token": REFRESH_TOKEN,
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "grant_type": "refresh_token"
-    }
-    response = requests.post(url, data=data)
-    resp_json = response.json()
-
-    if "access_token" in resp_json:
-        return resp_json["access_token"]
-    else:
-        raise Exception(f"Failed to get access token: {resp_json}")
+    """Get a Zoho access token, refreshed only when it is about to expire"""
+    return get_zoho_token_cache(CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN).get_token()
 
 def test_zoho_connection():
     """Test Zoho Mail API connection"""
@@ -69,7 +70,7 @@ def test_zoho_connection():
         access_token = get_access_token()
         url = f"https://mail.zoho.com/api/accounts/{ACCOUNT_ID}"
         headers = {"Authorization": f"Zoho-oauthtoken {access_token}"}
-        response = requests.get(url, headers=headers)
+        response = get_http_session().get(url, headers=headers)
         
         if response.status_code == 200:
             return True, "Zoho API connection successful"
@@ -126,7 +127,35 @@ def test_email_with_attachment():
     except Exception as e:
         return False, f"Test email error: {str(e)}"
 
-def send_email_via_zoho(to_email, subject, content, attachment_path=None):
+def send_email_via_zoho(to_email, subject, content, attachment_path=None, rate_limiter=None):
+    """Send email via Zoho Mail API, paced by rate_limiter when one is given"""
+    return send_rate_limited(
+        rate_limiter, lambda: _send_email_via_zoho(to_email, subject, content, attachment_path)
+    )
+
+def zoho_message_data(to_email, subject, content, attachment_path=None):
+    """JSON body for the Zoho messages endpoint - simplified without attachments due to API limitations"""
+    # Prepare email data - only use supported fields
+    data = {
+        "fromAddress": "hello@clearlinehmo.com",
+        "toAddress": to_email,
+        "subject": subject,
+        "content": content,
+        "mailFormat": "html"
+    }
+    
+    # Add note about PDF if provided
+    if attachment_path and os.path.exists(attachment_path):
+        data['content'] += f"\n\n📎 <strong>Your personalized health screening report has been generated and is ready for download.</strong><br/><br/>"
+        data['content'] += f"<strong>How to get your report:</strong><br/>"
+        data['content'] += f"• Contact our medical team at WhatsApp: 08076490056 (Telemedicine consultation)<br/>"
+        data['content'] += f"• Email us at hello@clearlinehmo.com<br/>"
+        data['content'] += f"• Provide your name and we'll send your report immediately<br/><br/>"
+        data['content'] += f"<em>Note: Due to technical limitations, we cannot attach PDF files directly to emails. We'll send your report separately upon request.</em>"
+    
+    return data
+
+def _send_email_via_zoho(to_email, subject, content, attachment_path=None):
     """Send email via Zoho Mail API - simplified without attachments due to API limitations"""
     try:
         access_token = get_access_token()
@@ -137,29 +166,19 @@ def send_email_via_zoho(to_email, subject, content, attachment_path=None):
             "Content-Type": "application/json"
         }
         
-        # Prepare email data - only use supported fields
-        data = {
-            "fromAddress": "hello@clearlinehmo.com",
-            "toAddress": to_email,
-            "subject": subject,
-            "content": content,
-            "mailFormat": "html"
-        }
-        
-        # Add note about PDF if provided
-        if attachment_path and os.path.exists(attachment_path):
-            data['content'] += f"\n\n📎 <strong>Your personalized health screening report has been generated and is ready for download.</strong><br/><br/>"
-            data['content'] += f"<strong>How to get your report:</strong><br/>"
-            data['content'] += f"• Contact our medical team at WhatsApp: 08076490056 (Telemedicine consultation)<br/>"
-            data['content'] += f"• Email us at hello@clearlinehmo.com<br/>"
-            data['content'] += f"• Provide your name and we'll send your report immediately<br/><br/>"
-            data['content'] += f"<em>Note: Due to technical limitations, we cannot attach PDF files directly to emails. We'll send your report separately upon request.</em>"
+        data = zoho_message_data(to_email, subject, content, attachment_path)
         
         # Send the email
         print(f"Debug: Sending email to {to_email}")
         print(f"Debug: JSON data keys: {list(data.keys())}")
         
-        response = requests.post(url, headers=headers, json=data)
+        response = get_http_session().post(url, headers=headers, json=data)
+        
+        # A token revoked before its expiry is refreshed and the send retried once
+        if response.status_code == 401:
+            get_zoho_token_cache(CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN).invalidate(access_token)
+            headers["Authorization"] = f"Zoho-oauthtoken {get_access_token()}"
+            response = get_http_session().post(url, headers=headers, json=data)
         
         if response.status_code == 200:
             if attachment_path and os.path.exists(attachment_path):
@@ -172,10 +191,60 @@ def send_email_via_zoho(to_email, subject, content, attachment_path=None):
     except Exception as e:
         return False, f"Error sending email: {str(e)}"
 
-def send_email_via_smtp(to_email, subject, content, attachment_path=None, smtp_password=None):
-    """Send email via SMTP with PDF attachment"""
+def report_email(name):
+    """Subject and HTML body of the email that accompanies an individual report"""
+    subject = f"Your Personalized Health Screening Report - Clearline HMO"
+    content = f"""<div style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+        <p>Dear <strong>{name}</strong>,</p>
+        
+        <p>Thank you for participating in our health screening program. We are pleased to share your personalized health screening report with you.</p>
+        
+        <p>Your comprehensive report contains:</p>
+        <ul>
+            <li>Detailed analysis of your health metrics</li>
+            <li>Personalized recommendations based on your results</li>
+            <li>Educational content about maintaining good health</li>
+            <li>Contact information for follow-up care</li>
+        </ul>
+        
+        <p><strong>Important Notes:</strong></p>
+        <ul>
+            <li>This report is confidential and should be shared only with your healthcare provider</li>
+            <li>We recommend discussing any concerns with your doctor</li>
+            <li>Keep this report for your medical records</li>
+        </ul>
+        
+        <p>If you have any questions about your results, please contact our medical team:</p>
+        <p>📱 <strong>WhatsApp Telemedicine:</strong> 08076490056 (Chat with a medical doctor)<br/>
+        📧 <strong>Email:</strong> hello@clearlinehmo.com</p>
+        
+        <p>We are committed to supporting your health and wellbeing.</p>
+        
+        <div style="margin-top: 40px;">
+            <p>Best regards,</p>
+            <p style="margin-top: 20px; font-weight: bold; color: #2c5aa0;">Clearline HMO Medical Team</p>
+        </div>
+        
+        <hr style="margin-top: 30px; border: none; border-top: 1px solid #ddd;">
+        <p style="font-size: 12px; color: #666; margin-top: 10px;">This is an automated message. Please do not reply to this email.</p>
+    </div>"""
+    return subject, content
+
+def open_smtp_session(smtp_password):
+    """Persistent SMTP session for sending a batch over one connection"""
+    return SMTPSession(SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, smtp_password)
+
+def send_email_via_smtp(to_email, subject, content, attachment_path=None, smtp_password=None, session=None,
+                        rate_limiter=None):
+    """Send email via SMTP with PDF attachment, paced by rate_limiter when one is given"""
+    return send_rate_limited(
+        rate_limiter, lambda: _send_email_via_smtp(to_email, subject, content, attachment_path, smtp_password, session)
+    )
+
+def _send_email_via_smtp(to_email, subject, content, attachment_path=None, smtp_password=None, session=None):
+    """Send email via SMTP with PDF attachment, over session when one is given"""
     try:
-        if not smtp_password:
+        if session is None and not smtp_password:
             return False, "SMTP password not provided"
             
         # Create message
@@ -204,13 +273,13 @@ def send_email_via_smtp(to_email, subject, content, attachment_path=None, smtp_p
             except Exception as e:
                 return False, f"Error attaching file: {str(e)}"
         
-        # Connect to server and send email
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()  # Enable security
-        server.login(SMTP_USERNAME, smtp_password)
+        # Send over the shared session, or connect just for this email
         text = msg.as_string()
-        server.sendmail(SMTP_USERNAME, to_email, text)
-        server.quit()
+        if session is not None:
+            session.send(SMTP_USERNAME, to_email, text)
+        else:
+            with open_smtp_session(smtp_password) as single_session:
+                single_session.send(SMTP_USERNAME, to_email, text)
         
         if attachment_path and os.path.exists(attachment_path):
             return True, "Email sent successfully with PDF attachment"
@@ -279,113 +348,59 @@ def test_smtp_email_with_attachment(smtp_password):
     except Exception as e:
         return False, f"Test email error: {str(e)}"
 
-def analyze_blood_pressure(data_df):
-    """Analyzes blood pressure data and categorizes it into ranges"""
-    def categorize_bp(row):
-        systolic = row['SYSTOLIC']
-        diastolic = row['DIASTOLIC']
-        
-        if systolic < 100 or diastolic < 60:
-            return 'LOW'
-        elif systolic > 160 or diastolic > 99:
-            return 'HIGH'
-        elif (141 <= systolic <= 160) or (91 <= diastolic <= 99):
-            return 'MODERATE HIGH'
-        else:
-            return 'NORMAL'
-    
-    data_df['BP_CATEGORY'] = data_df.apply(categorize_bp, axis=1)
-    bp_distribution = data_df['BP_CATEGORY'].value_counts()
-    bp_distribution_pct = (bp_distribution / len(data_df) * 100).round(2)
-    
+def _distribution_results(summary):
+    """Distribution dicts of one summarize_categories entry, as the report expects them"""
     return {
-        'distribution': bp_distribution.to_dict(),
-        'distribution_pct': bp_distribution_pct.to_dict()
+        'distribution': summary['distribution'].to_dict(),
+        'distribution_pct': summary['distribution_pct'].to_dict()
     }
 
+def _urine_categories(data_df):
+    """Upper-cased glucose and protein results for rows where both are present"""
+    has_result = data_df['GLUCOSE'].notna() & data_df['PROTEIN'].notna()
+    return data_df['GLUCOSE'].where(has_result).str.upper(), data_df['PROTEIN'].where(has_result).str.upper()
+
+def analyze_blood_pressure(data_df):
+    """Analyzes blood pressure data and categorizes it into ranges"""
+    data_df['BP_CATEGORY'] = categorize(data_df, BLOOD_PRESSURE)
+    summary = summarize_categories(data_df, {'BP_CATEGORY': data_df['BP_CATEGORY']})['BP_CATEGORY']
+    return _distribution_results(summary)
+
 def analyze_blood_sugar(data_df):
     """Analyzes blood sugar data and categorizes it into ranges"""
-    def categorize_glucose(reading):
-        if reading > 125:
-            return 'DIABETIC'
-        elif 100 <= reading <= 125:
-            return 'PRE_DIABETIC'
-        else:
-            return 'NORMAL'
-    
-    data_df['GLUCOSE_CATEGORY'] = data_df['BLOOD GLUCOSE'].apply(categorize_glucose)
-    glucose_distribution = data_df['GLUCOSE_CATEGORY'].value_counts()
-    glucose_distribution_pct = (glucose_distribution / len(data_df) * 100).round(2)
-    
-    return {
-        'distribution': glucose_distribution.to_dict(),
-        'distribution_pct': glucose_distribution_pct.to_dict()
-    }
+    data_df['GLUCOSE_CATEGORY'] = categorize(data_df, BLOOD_SUGAR)
+    summary = summarize_categories(data_df, {'GLUCOSE_CATEGORY': data_df['GLUCOSE_CATEGORY']})['GLUCOSE_CATEGORY']
+    return _distribution_results(summary)
 
 def analyze_cholesterol(data_df):
     """Analyzes cholesterol data and categorizes it into ranges"""
-    def categorize_cholesterol(reading):
-        if reading > 240:
-            return 'HIGH'
-        elif 200 <= reading <= 239:
-            return 'BORDERLINE HIGH'
-        else:
-            return 'NORMAL'
-    
-    data_df['CHOLESTEROL_CATEGORY'] = data_df['CHOLESTEROL'].apply(categorize_cholesterol)
-    chol_distribution = data_df['CHOLESTEROL_CATEGORY'].value_counts()
-    chol_distribution_pct = (chol_distribution / len(data_df) * 100).round(2)
-    
-    return {
-        'distribution': chol_distribution.to_dict(),
-        'distribution_pct': chol_distribution_pct.to_dict()
-    }
+    data_df['CHOLESTEROL_CATEGORY'] = categorize(data_df, CHOLESTEROL)
+    summary = summarize_categories(data_df, {'CHOLESTEROL_CATEGORY': data_df['CHOLESTEROL_CATEGORY']})['CHOLESTEROL_CATEGORY']
+    return _distribution_results(summary)
 
 def analyze_bmi(data_df):
     """Analyzes BMI data and categorizes it into ranges"""
-    def categorize_bmi(bmi):
-        if bmi > 30:
-            return 'OBESITY'
-        elif 25 <= bmi <= 30:
-            return 'OVERWEIGHT'
-        elif 18.5 <= bmi <= 25:
-            return 'NORMAL'
-        else:
-            return 'BELOW NORMAL'
-    
-    data_df['BMI_CATEGORY'] = data_df['BMI'].apply(categorize_bmi)
-    bmi_distribution = data_df['BMI_CATEGORY'].value_counts()
-    bmi_distribution_pct = (bmi_distribution / len(data_df) * 100).round(2)
-    
-    return {
-        'distribution': bmi_distribution.to_dict(),
-        'distribution_pct': bmi_distribution_pct.to_dict()
-    }
+    data_df['BMI_CATEGORY'] = categorize(data_df, BMI)
+    summary = summarize_categories(data_df, {'BMI_CATEGORY': data_df['BMI_CATEGORY']})['BMI_CATEGORY']
+    return _distribution_results(summary)
 
 def analyze_urine(data_df):
     """Analyzes urine data for glucose and protein presence"""
-    data_df['GLUCOSE'] = data_df['GLUCOSE'].str.upper()
-    data_df['PROTEIN'] = data_df['PROTEIN'].str.upper()
-    
-    glucose_distribution = data_df['GLUCOSE'].value_counts()
-    glucose_distribution_pct = (glucose_distribution / len(data_df) * 100).round(2)
-    
-    protein_distribution = data_df['PROTEIN'].value_counts()
-    protein_distribution_pct = (protein_distribution / len(data_df) * 100).round(2)
-    
+    glucose, protein = _urine_categories(data_df)
+    summaries = summarize_categories(data_df, {'GLUCOSE': glucose, 'PROTEIN': protein})
     return {
-        'glucose': {
-            'distribution': glucose_distribution.to_dict(),
-            'distribution_pct': glucose_distribution_pct.to_dict()
-        },
-        'protein': {
-            'distribution': protein_distribution.to_dict(),
-            'distribution_pct': protein_distribution_pct.to_dict()
-        }
+        'glucose': _distribution_results(summaries['GLUCOSE']),
+        'protein': _distribution_results(summaries['PROTEIN'])
     }
 
 def analyze_staff_data(data_df, company_name):
-    """Analyzes staff data from DataFrame"""
+    """
+    Analyzes staff data from DataFrame
+    
+    Every metric is categorized over the full frame and aggregated in a
+    single summarize_categories stage instead of one filtered copy and
+    value_counts per metric.
+    """
     # Convert numeric columns to float, but keep all rows
     numeric_columns = ['AGE', 'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI']
     for col in numeric_columns:
@@ -402,63 +417,54 @@ def analyze_staff_data(data_df, company_name):
     # Normalize urine test columns and determine availability
     has_urine = False
     if 'GLUCOSE' in data_df.columns and 'PROTEIN' in data_df.columns:
-        def _clean_urine_value(val):
-            if isinstance(val, str):
-                stripped = val.strip()
-                if stripped == "":
-                    return pd.NA
-                return stripped.upper()
-            return val
-        data_df['GLUCOSE'] = data_df['GLUCOSE'].apply(_clean_urine_value)
-        data_df['PROTEIN'] = data_df['PROTEIN'].apply(_clean_urine_value)
-        urine_non_empty = data_df.dropna(subset=['GLUCOSE', 'PROTEIN'])
-        has_urine = len(urine_non_empty) > 0
+        data_df['GLUCOSE'] = normalize_urine_results(data_df['GLUCOSE'])
+        data_df['PROTEIN'] = normalize_urine_results(data_df['PROTEIN'])
+        has_urine = bool((data_df['GLUCOSE'].notna() & data_df['PROTEIN'].notna()).any())
+    
+    # Determine availability flags for all metrics
+    has_bp_reading = data_df['SYSTOLIC'].notna() & data_df['DIASTOLIC'].notna()
+    has_bp = bool(has_bp_reading.any())
+    has_glucose = bool(data_df['BLOOD GLUCOSE'].notna().any())
+    has_bmi = bool(data_df['BMI'].notna().any())
+    
+    # Categorize every metric over the full frame, leaving rows without a
+    # reading as missing so the aggregation skips them
+    categories = {'GENDER': data_df['GENDER']}
+    if has_bp:
+        categories['BP_CATEGORY'] = categorize(data_df, BLOOD_PRESSURE).where(has_bp_reading)
+    if has_glucose:
+        categories['GLUCOSE_CATEGORY'] = categorize(data_df, BLOOD_SUGAR).where(data_df['BLOOD GLUCOSE'].notna())
+    if has_cholesterol:
+        categories['CHOLESTEROL_CATEGORY'] = categorize(data_df, CHOLESTEROL).where(data_df['CHOLESTEROL'].notna())
+    if has_bmi:
+        categories['BMI_CATEGORY'] = categorize(data_df, BMI).where(data_df['BMI'].notna())
+    if has_urine:
+        categories['GLUCOSE'], categories['PROTEIN'] = _urine_categories(data_df)
+    
+    # Single aggregation stage for every distribution
+    summaries = summarize_categories(data_df, categories)
     
     # Calculate total number of staff
     total_staff = len(data_df)
     
     # Calculate gender distribution
-    gender_counts = data_df['GENDER'].value_counts()
+    gender_counts = summaries['GENDER']['distribution']
     gender_distribution = pd.DataFrame({
         'GENDER': gender_counts.index,
         'NO OF STAFF': gender_counts.values,
         '%OF TOTAL': (gender_counts.values / total_staff * 100).round(2)
     })
     
-    # Determine availability flags for all metrics
-    has_bp = data_df[['SYSTOLIC', 'DIASTOLIC']].dropna(how='any').shape[0] > 0
-    has_glucose = data_df['BLOOD GLUCOSE'].dropna().shape[0] > 0
-    has_bmi = data_df['BMI'].dropna().shape[0] > 0
-
-    # Blood Pressure Analysis
-    bp_analysis = None
-    if has_bp:
-        bp_data = data_df.dropna(subset=['SYSTOLIC', 'DIASTOLIC'])
-        bp_analysis = analyze_blood_pressure(bp_data)
-    
-    # Blood Sugar Analysis
-    glucose_analysis = None
-    if has_glucose:
-        glucose_data = data_df.dropna(subset=['BLOOD GLUCOSE'])
-        glucose_analysis = analyze_blood_sugar(glucose_data)
-    
-    # Cholesterol Analysis
-    chol_analysis = None
-    if has_cholesterol:
-        chol_data = data_df.dropna(subset=['CHOLESTEROL'])
-        chol_analysis = analyze_cholesterol(chol_data)
-    
-    # BMI Analysis
-    bmi_analysis = None
-    if has_bmi:
-        bmi_data = data_df.dropna(subset=['BMI'])
-        bmi_analysis = analyze_bmi(bmi_data)
-    
-    # Urine Analysis
+    bp_analysis = _distribution_results(summaries['BP_CATEGORY']) if has_bp else None
+    glucose_analysis = _distribution_results(summaries['GLUCOSE_CATEGORY']) if has_glucose else None
+    chol_analysis = _distribution_results(summaries['CHOLESTEROL_CATEGORY']) if has_cholesterol else None
+    bmi_analysis = _distribution_results(summaries['BMI_CATEGORY']) if has_bmi else None
     urine_analysis = None
     if has_urine:
-        urine_data = data_df.dropna(subset=['GLUCOSE', 'PROTEIN'])
-        urine_analysis = analyze_urine(urine_data)
+        urine_analysis = {
+            'glucose': _distribution_results(summaries['GLUCOSE']),
+            'protein': _distribution_results(summaries['PROTEIN'])
+        }
     
     results = {
         'company_name': company_name,
@@ -478,29 +484,13 @@ def analyze_staff_data(data_df, company_name):
     
     return results
 
-def get_individual_data(data_df, enrollee_id):
-    """Gets individual data from DataFrame based on enrollee ID"""
-    individual_row = data_df[data_df['ENROLLEE ID'] == enrollee_id]
+def get_individual_data(dataset, enrollee_id):
+    """Gets individual data from an indexed ScreeningDataset based on enrollee ID"""
+    individual_data = dataset.get(enrollee_id)
     
-    if individual_row.empty:
+    if individual_data is None:
         raise ValueError(f"No individual found with Enrollee ID: {enrollee_id}")
     
-    individual_data = individual_row.iloc[0].to_dict()
-    
-    # Convert numeric columns
-    numeric_columns = ['AGE', 'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI', 'CHOLESTEROL']
-    for col in numeric_columns:
-        if col in individual_data and pd.notna(individual_data[col]):
-            individual_data[col] = pd.to_numeric(individual_data[col], errors='coerce')
-    
-    # Handle PSA separately
-    if 'PSA' in individual_data and pd.notna(individual_data['PSA']):
-        psa_value = individual_data['PSA']
-        if isinstance(psa_value, str):
-            individual_data['PSA'] = psa_value
-        else:
-            individual_data['PSA'] = pd.to_numeric(psa_value, errors='coerce')
-    
     return individual_data
 
 def analyze_individual_health(individual_data):
@@ -616,6 +606,340 @@ def analyze_individual_health(individual_data):
     
     return analysis
 
+def load_valid_emails(source):
+    """Rows of a screening workbook that have a usable EMAIL address"""
+    data_df = load_workbook(source)
+    valid_emails = data_df.dropna(subset=['EMAIL'])
+    return valid_emails[valid_emails['EMAIL'].str.contains('@', na=False)]
+
+def run_company_report_job(params, secrets, context):
+    """Background job: analyze a workbook and generate, store the company report"""
+    db, pdf_storage = initialize_motherduck()
+    if not db:
+        raise RuntimeError("Failed to connect to MotherDuck database")
+    
+    workbook_path = params['workbook_path']
+    company_name = params['company_name']
+    
+    # Store customer data in MotherDuck
+    context.progress(0, 3, "📊 Storing customer data in MotherDuck...")
+    customer_count = db.store_customers_from_excel(workbook_path, company_name)
+    context.notify('success', f"✅ Stored {customer_count} customers in MotherDuck database")
+    
+    # Analyze data and generate report
+    context.progress(1, 3, "Analyzing data and generating report...")
+    results = analyze_staff_data(load_workbook(workbook_path), company_name)
+    output_path = f"reports/{company_name.replace(' ', '_')}_Health_Screening_Report.pdf"
+    report_path = generate_report(results, output_path)
+    
+    # Store PDF in MotherDuck
+    context.progress(2, 3, "💾 Storing report in MotherDuck...")
+    if pdf_storage.store_pdf(report_path, f"COMPANY_{company_name.replace(' ', '_')}", company_name):
+        context.notify('success', "✅ Company report stored in MotherDuck database")
+    else:
+        context.notify('warning', "⚠️ Report generated but failed to store in database")
+    
+    context.progress(3, 3, "✅ Company report generated successfully!")
+    return {'report_path': report_path, 'total_staff': results['total_staff']}
+
+def run_individual_reports_job(params, secrets, context):
+    """Background job: render every individual report of a workbook and store them"""
+    db, pdf_storage = initialize_motherduck()
+    if not db:
+        raise RuntimeError("Failed to connect to MotherDuck database")
+    
+    workbook_path = params['workbook_path']
+    valid_emails = load_valid_emails(workbook_path)
+    
+    # Store customer data in MotherDuck
+    context.progress(0, len(valid_emails), "📊 Storing customer data in MotherDuck...")
+    customer_count = db.store_customers_from_excel(workbook_path, "Bulk Reports")
+    context.notify('success', f"✅ Stored {customer_count} customers in MotherDuck database")
+    
+    # Generate all reports, using ENROLLEE ID as filename
+    def show_progress(completed, total, job):
+        context.progress(completed, total, f"Generated {completed}/{total}: {job['individual_data'].get('NAME')}")
+    
+    jobs = [
+        make_report_job(individual_data, analysis, f"reports/{clean_report_filename(individual_data['ENROLLEE ID'])}.pdf")
+        for individual_data, analysis in analyze_individual_health_frame(valid_emails)
+    ]
+    generated, failed_reports = generate_reports(jobs, params.get('report_workers'), show_progress)
+    for failure in failed_reports:
+        context.notify('error', f"Error generating report for {failure['Name']}: {failure['Error']}")
+    
+    # Store PDFs in MotherDuck a batch per transaction
+    context.progress(len(jobs), len(jobs), "💾 Storing reports in MotherDuck...")
+    stored_count = pdf_storage.store_many(
+        (job['output_path'], job['enrollee_id'], job['individual_data'].get('COMPANY', 'Bulk Reports'))
+        for job in generated
+    )
+    if stored_count < len(generated):
+        context.notify('warning', f"⚠️ {len(generated) - stored_count} reports generated but failed to store in database")
+    
+    report_paths = [job['output_path'] for job in generated]
+    
+    if report_paths:
+        context.notify('success', f"✅ Generated {len(report_paths)} individual reports!")
+        context.notify('info', "All reports have been saved to your local directory and cloud database.")
+    
+    return {'report_paths': report_paths, 'failed_reports': failed_reports}
+
+def run_bulk_email_job(params, secrets, context):
+    """Background job: render, store and email every individual report of a workbook"""
+    db, pdf_storage = initialize_motherduck()
+    if not db:
+        raise RuntimeError("Failed to connect to MotherDuck database")
+    
+    workbook_path = params['workbook_path']
+    email_method = params['email_method']
+    smtp_password = secrets.get('smtp_password')
+    if email_method == "SMTP (With PDF attachments)" and not smtp_password:
+        raise RuntimeError("SMTP password is not available; it is not kept across app restarts, so please submit the job again")
+    
+    valid_emails = load_valid_emails(workbook_path)
+    
+    # Store customer data in MotherDuck
+    context.progress(0, len(valid_emails), "📊 Storing customer data in MotherDuck...")
+    customer_count = db.store_customers_from_excel(workbook_path, "Bulk Email Reports")
+    context.notify('success', f"✅ Stored {customer_count} customers in MotherDuck database")
+    
+    # Reports are rendered to temporary files and stored in MotherDuck
+    # in the background, ahead of the sender below
+    analyzed = list(analyze_individual_health_frame(valid_emails))
+    
+    # Skip enrollees whose unchanged report was already emailed by an earlier run
+    delivered = db.get_delivered(
+        (str(individual_data.get('ENROLLEE ID')), report_fingerprint(individual_data))
+        for individual_data, _ in analyzed
+    )
+    if delivered:
+        context.notify('info', f"⏭️ Skipping {len(delivered)} recipients who already received this report")
+    
+    jobs = []
+    for individual_data, analysis in analyzed:
+        if (str(individual_data.get('ENROLLEE ID')), report_fingerprint(individual_data)) in delivered:
+            continue
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+            jobs.append(make_report_job(individual_data, analysis, tmp_file.name))
+    
+    # A send is only recorded in the ledger once its PDF is stored, so a run killed
+    # before its last batch is written re-sends (and stores) those reports next time
+    ledger_lock = threading.Lock()
+    stored_ids = set()
+    awaiting_storage = {}
+    
+    def record_delivery(job, email, success, error):
+        delivery = (job['enrollee_id'], job['report_hash'], email, email_method, success, error)
+        with ledger_lock:
+            if success and job['enrollee_id'] not in stored_ids:
+                awaiting_storage[job['enrollee_id']] = delivery
+                return
+        db.record_delivery(*delivery)
+    
+    def record_stored(customer_ids):
+        with ledger_lock:
+            stored_ids.update(customer_ids)
+            ready = [awaiting_storage.pop(customer_id) for customer_id in customer_ids
+                     if customer_id in awaiting_storage]
+        for delivery in ready:
+            db.record_delivery(*delivery)
+    
+    # Stored PDFs are buffered and written to MotherDuck a batch at a time
+    pdf_writer = PDFBatchWriter(pdf_storage, on_stored=record_stored)
+    
+    def store_report(job):
+        company_name = job['individual_data'].get('COMPANY', 'Bulk Email Reports')
+        # Stored under a stable name, so each run replaces the enrollee's previous report
+        pdf_writer.add(job['output_path'], job['enrollee_id'], company_name,
+                       file_name=f"{clean_report_filename(job['enrollee_id'])}.pdf")
+    
+    success_count = 0
+    failed_count = 0
+    failed_emails = []
+    
+    total_emails = len(jobs)
+    
+    # Paces every send, backing off on rate limit responses and speeding up on success
+    rate_limiter = AdaptiveRateLimiter(
+        rate=1 / params['delay_seconds'], min_rate=1 / 60, max_rate=1 / params['min_delay_seconds']
+    )
+    
+    # One SMTP login for the whole batch instead of one per email
+    smtp_session = open_smtp_session(smtp_password) if email_method == "SMTP (With PDF attachments)" else None
+    
+    # Zoho notifications are collected and sent concurrently after rendering
+    zoho_batch = [] if email_method != "SMTP (With PDF attachments)" and zoho_async_available() else None
+    
+    # Reports already emailed must still be stored, and the SMTP login closed, if the run fails
+    try:
+        for idx, (job, render_error) in enumerate(pipeline_reports(jobs, params.get('report_workers'), after_render=store_report)):
+            individual_data = job['individual_data']
+            temp_path = job['output_path']
+            
+            if render_error is not None:
+                failed_count += 1
+                failed_emails.append(report_failure(job, render_error))
+                try:
+                    os.unlink(temp_path)
+                except:
+                    pass
+                continue
+            
+            if zoho_batch is not None:
+                context.progress(idx + 1, total_emails, f"Prepared {idx + 1}/{total_emails}: {individual_data['NAME']}")
+                subject, content = report_email(individual_data.get('NAME', 'Valued Employee'))
+                zoho_batch.append({
+                    'Name': individual_data['NAME'],
+                    'Email': individual_data['EMAIL'],
+                    'job': job,
+                    'data': zoho_message_data(individual_data['EMAIL'], subject, content, temp_path)
+                })
+                try:
+                    os.unlink(temp_path)
+                except:
+                    pass
+                continue
+            
+            try:
+                # Update progress
+                context.progress(idx + 1, total_emails, f"Processing {idx + 1}/{total_emails}: {individual_data['NAME']} (sending {rate_limiter.rate * 60:.1f} emails/min)")
+                
+                # Prepare email content
+                subject, content = report_email(individual_data.get('NAME', 'Valued Employee'))
+                
+                # Send email using selected method
+                if email_method == "SMTP (With PDF attachments)":
+                    success, message = send_email_via_smtp(
+                        to_email=individual_data['EMAIL'],
+                        subject=subject,
+                        content=content,
+                        attachment_path=temp_path,
+                        smtp_password=smtp_password,
+                        session=smtp_session,
+                        rate_limiter=rate_limiter
+                    )
+                else:  # Zoho API
+                    success, message = send_email_via_zoho(
+                        to_email=individual_data['EMAIL'],
+                        subject=subject,
+                        content=content,
+                        attachment_path=temp_path,
+                        rate_limiter=rate_limiter
+                    )
+                
+                if success:
+                    success_count += 1
+                    context.notify('success', f"✅ Sent to {individual_data['NAME']} ({individual_data['EMAIL']})")
+                else:
+                    # Check if it's a rate limiting error
+                    if is_throttled(message):
+                        context.notify('warning', f"⚠️ Rate limit hit for {individual_data['NAME']}. Slowing to {rate_limiter.rate * 60:.1f} emails/min and retrying...")
+                        
+                        # Retry once; the limiter waits out the slower interval first
+                        if email_method == "SMTP (With PDF attachments)":
+                            success, message = send_email_via_smtp(
+                                to_email=individual_data['EMAIL'],
+                                subject=subject,
+                                content=content,
+                                attachment_path=temp_path,
+                                smtp_password=smtp_password,
+                                session=smtp_session,
+                                rate_limiter=rate_limiter
+                            )
+                        else:  # Zoho API
+                            success, message = send_email_via_zoho(
+                                to_email=individual_data['EMAIL'],
+                                subject=subject,
+                                content=content,
+                                attachment_path=temp_path,
+                                rate_limiter=rate_limiter
+                            )
+                        
+                        if success:
+                            success_count += 1
+                            context.notify('success', f"✅ Sent to {individual_data['NAME']} ({individual_data['EMAIL']}) - Retry successful")
+                        else:
+                            failed_count += 1
+                            failed_emails.append({
+                                'Name': individual_data['NAME'],
+                                'Email': individual_data['EMAIL'],
+                                'Error': f"Rate limit retry failed: {message}"
+                            })
+                            context.notify('error', f"❌ Failed to send to {individual_data['NAME']} ({individual_data['EMAIL']}) after retry: {message}")
+                    else:
+                        failed_count += 1
+                        failed_emails.append({
+                            'Name': individual_data['NAME'],
+                            'Email': individual_data['EMAIL'],
+                            'Error': message
+                        })
+                        context.notify('error', f"❌ Failed to send to {individual_data['NAME']} ({individual_data['EMAIL']}): {message}")
+                
+                # Record the outcome so a restarted run skips this recipient
+                record_delivery(job, individual_data['EMAIL'], success, None if success else message)
+                
+                # Clean up temporary file
+                try:
+                    os.unlink(temp_path)
+                except:
+                    pass
+                
+            except Exception as e:
+                failed_count += 1
+                failed_emails.append({
+                    'Name': individual_data.get('NAME', 'Unknown'),
+                    'Email': individual_data.get('EMAIL', 'Unknown'),
+                    'Error': str(e)
+                })
+    finally:
+        if smtp_session:
+            smtp_session.close()
+        pdf_writer.flush()
+    
+    if pdf_writer.failed:
+        context.notify('warning', f"⚠️ {len(pdf_writer.failed)} reports failed to store in database; they will be sent again on the next run")
+    
+    if zoho_batch:
+        def show_sent(completed, total, message, success, result):
+            record_delivery(message['job'], message['Email'], success, None if success else result)
+            context.progress(completed, total, f"Sent {completed}/{total} (sending {rate_limiter.rate * 60:.1f} emails/min)")
+            if success:
+                context.notify('success', f"✅ Sent to {message['Name']} ({message['Email']})")
+            else:
+                context.notify('error', f"❌ Failed to send to {message['Name']} ({message['Email']}): {result}")
+        
+        zoho_sent, zoho_failed = send_zoho_batch(
+            zoho_batch,
+            get_zoho_token_cache(CLIENT_ID, CLIENT_SECRET, REFRESH_TOKEN),
+            ACCOUNT_ID,
+            rate_limiter=rate_limiter,
+            progress_callback=show_sent
+        )
+        success_count += zoho_sent
+        failed_count += len(zoho_failed)
+        failed_emails.extend(zoho_failed)
+    
+    context.progress(total_emails, total_emails, "✅ Email sending completed!")
+    return {'success_count': success_count, 'failed_count': failed_count, 'failed_emails': failed_emails}
+
+def get_background_jobs():
+    """Job queue with this app's job types registered and its worker running"""
+    queue = get_job_queue()
+    queue.register('company_report', run_company_report_job)
+    queue.register('individual_reports', run_individual_reports_job)
+    queue.register('bulk_email', run_bulk_email_job)
+    queue.start()
+    return queue
+
+def submit_workbook_job(job_type, uploaded_file, params, description, secrets=None):
+    """Queue a job on a copy of the uploaded workbook, so it outlives the browser session"""
+    suffix = os.path.splitext(uploaded_file.name)[1] or '.xlsx'
+    workbook_path = save_job_file(read_workbook_bytes(uploaded_file), suffix)
+    return get_background_jobs().submit(
+        job_type, dict(params, workbook_path=workbook_path), secrets=secrets, description=description
+    )
+
 def main():
     st.set_page_config(
         page_title="Clearline HMO Health Screening Report Generator",
@@ -628,7 +952,7 @@ def main():
     
     # Sidebar for navigation
     st.sidebar.title("Navigation")
-    page = st.sidebar.selectbox("Choose a page", ["Company Report", "Individual Reports", "Bulk Email Reports"])
+    page = st.sidebar.selectbox("Choose a page", ["Company Report", "Individual Reports", "Bulk Email Reports", "Background Jobs"])
     
     if page == "Company Report":
         st.header("📊 Company Health Screening Report")
@@ -638,13 +962,21 @@ def main():
         
         if uploaded_file is not None:
             try:
-                # Read the Excel file
-                data_df = pd.read_excel(uploaded_file)
+                # Read the Excel file (cached by content, so reruns skip the parse)
+                data_df = load_workbook(uploaded_file)
                 st.success(f"✅ File loaded successfully! Found {len(data_df)} records.")
                 
                 # Company name input
                 company_name = st.text_input("Enter Company Name", value="Your Company")
                 
+                if st.button("🕒 Generate in Background"):
+                    job_id = submit_workbook_job(
+                        'company_report', uploaded_file, {'company_name': company_name},
+                        f"Company report: {company_name}"
+                    )
+                    st.session_state['last_job_id'] = job_id
+                    st.success(f"🕒 Queued company report as job {job_id}. Follow its progress on the Background Jobs page.")
+                
                 if st.button("Generate Company Report", type="primary"):
                     with st.spinner("Analyzing data and generating report..."):
                         try:
@@ -716,79 +1048,85 @@ def main():
         
         if uploaded_file is not None:
             try:
-                # Read the Excel file
-                data_df = pd.read_excel(uploaded_file)
+                # Read the Excel file as an indexed dataset (cached by content, so reruns skip the parse)
+                dataset = load_dataset(uploaded_file)
+                data_df = dataset.data_df
                 st.success(f"✅ File loaded successfully! Found {len(data_df)} records.")
                 
                 # Enrollee ID selection
                 if 'ENROLLEE ID' in data_df.columns:
                     enrollee_ids = data_df['ENROLLEE ID'].tolist()
-                    selected_id = st.selectbox("Select Enrollee ID", enrollee_ids)
+                    selected_ids = st.multiselect("Select Enrollee ID(s)", enrollee_ids)
                     
-                    if st.button("Generate Individual Report", type="primary"):
+                    if st.button("Generate Individual Report", type="primary", disabled=not selected_ids):
                         with st.spinner("Generating individual report..."):
-                            try:
-                                # Initialize MotherDuck
-                                db, pdf_storage = initialize_motherduck()
-                                if not db:
-                                    st.error("❌ Failed to connect to MotherDuck database")
-                                    return
-                                
-                                # Get individual data
-                                individual_data = get_individual_data(data_df, selected_id)
-                                analysis = analyze_individual_health(individual_data)
-                                
-                                # Generate individual report using ENROLLEE ID as filename
-                                enrollee_id = str(selected_id)
-                                clean_enrollee_id = enrollee_id.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                                output_path = f"reports/{clean_enrollee_id}.pdf"
-                                report_path = generate_individual_report(individual_data, analysis, output_path)
-                                
-                                # Store PDF in MotherDuck
-                                st.info("💾 Storing report in MotherDuck...")
-                                company_name = individual_data.get('COMPANY', 'Unknown Company')
-                                success = pdf_storage.store_pdf(report_path, enrollee_id, company_name)
-                                if success:
-                                    st.success("✅ Individual report stored in MotherDuck database")
-                                else:
-                                    st.warning("⚠️ Report generated but failed to store in database")
-                                
-                                st.success("✅ Individual report generated successfully!")
-                                
-                                # Display download button
-                                with open(report_path, "rb") as file:
-                                    st.download_button(
-                                        label="📥 Download Individual Report",
-                                        data=file.read(),
-                                        file_name=output_path,
-                                        mime="application/pdf"
-                                    )
-                                
-                                # Display individual summary
-                                st.subheader("👤 Individual Health Summary")
-                                name = individual_data.get('NAME', 'Unknown')
-                                st.write(f"**Name:** {name}")
-                                st.write(f"**Enrollee ID:** {selected_id}")
-                                
-                                # Show available tests
-                                available_tests = []
-                                if 'bmi' in analysis:
-                                    available_tests.append("BMI")
-                                if 'blood_pressure' in analysis:
-                                    available_tests.append("Blood Pressure")
-                                if 'blood_sugar' in analysis:
-                                    available_tests.append("Blood Sugar")
-                                if 'cholesterol' in analysis:
-                                    available_tests.append("Cholesterol")
-                                if 'urine' in analysis:
-                                    available_tests.append("Urine Analysis")
-                                if 'psa' in analysis:
-                                    available_tests.append("PSA")
-                                
-                                st.write(f"**Tests Available:** {', '.join(available_tests)}")
-                                
-                            except Exception as e:
-                                st.error(f"❌ Error generating individual report: {str(e)}")
+                            # Initialize MotherDuck
+                            db, pdf_storage = initialize_motherduck()
+                            if not db:
+                                st.error("❌ Failed to connect to MotherDuck database")
+                                return
+                            
+                            # Look up every selected enrollee in one indexed batch
+                            individuals_data = dataset.get_many(selected_ids)
+                            
+                            for selected_id, individual_data in zip(selected_ids, individuals_data):
+                                try:
+                                    if individual_data is None:
+                                        raise ValueError(f"No individual found with Enrollee ID: {selected_id}")
+                                    analysis = analyze_individual_health(individual_data)
+                                    
+                                    # Generate individual report using ENROLLEE ID as filename
+                                    enrollee_id = str(selected_id)
+                                    clean_enrollee_id = enrollee_id.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
+                                    output_path = f"reports/{clean_enrollee_id}.pdf"
+                                    report_path = generate_individual_report(individual_data, analysis, output_path)
+                                    
+                                    # Store PDF in MotherDuck
+                                    st.info("💾 Storing report in MotherDuck...")
+                                    company_name = individual_data.get('COMPANY', 'Unknown Company')
+                                    success = pdf_storage.store_pdf(report_path, enrollee_id, company_name)
+                                    if success:
+                                        st.success("✅ Individual report stored in MotherDuck database")
+                                    else:
+                                        st.warning("⚠️ Report generated but failed to store in database")
+                                    
+                                    st.success("✅ Individual report generated successfully!")
+                                    
+                                    # Display download button
+                                    with open(report_path, "rb") as file:
+                                        st.download_button(
+                                            label="📥 Download Individual Report",
+                                            data=file.read(),
+                                            file_name=output_path,
+                                            mime="application/pdf",
+                                            key=f"download_{clean_enrollee_id}"
+                                        )
+                                    
+                                    # Display individual summary
+                                    st.subheader("👤 Individual Health Summary")
+                                    name = individual_data.get('NAME', 'Unknown')
+                                    st.write(f"**Name:** {name}")
+                                    st.write(f"**Enrollee ID:** {selected_id}")
+                                    
+                                    # Show available tests
+                                    available_tests = []
+                                    if 'bmi' in analysis:
+                                        available_tests.append("BMI")
+                                    if 'blood_pressure' in analysis:
+                                        available_tests.append("Blood Pressure")
+                                    if 'blood_sugar' in analysis:
+                                        available_tests.append("Blood Sugar")
+                                    if 'cholesterol' in analysis:
+                                        available_tests.append("Cholesterol")
+                                    if 'urine' in analysis:
+                                        available_tests.append("Urine Analysis")
+                                    if 'psa' in analysis:
+                                        available_tests.append("PSA")
+                                    
+                                    st.write(f"**Tests Available:** {', '.join(available_tests)}")
+                                    
+                                except Exception as e:
+                                    st.error(f"❌ Error generating individual report for {selected_id}: {str(e)}")
                 else:
                     st.error("❌ No 'ENROLLEE ID' column found in the file.")
                     
@@ -803,8 +1141,8 @@ def main():
         
         if uploaded_file is not None:
             try:
-                # Read the Excel file
-                data_df = pd.read_excel(uploaded_file)
+                # Read the Excel file (cached by content, so reruns skip the parse)
+                data_df = load_workbook(uploaded_file)
                 st.success(f"✅ File loaded successfully! Found {len(data_df)} records.")
                 
                 # Check for EMAIL column
@@ -907,10 +1245,21 @@ def main():
                         preview_data = valid_emails[['NAME', 'ENROLLEE ID', 'EMAIL']].head(10)
                         st.dataframe(preview_data)
                         
+                        report_workers = st.number_input(
+                            "Report Workers",
+                            min_value=1,
+                            max_value=max(os.cpu_count() or 1, DEFAULT_REPORT_WORKERS),
+                            value=DEFAULT_REPORT_WORKERS,
+                            help="Processes used to render PDF reports in parallel"
+                        )
+                        
                         # Email sending options based on method
                         if email_method == "Zoho Mail API (No PDF attachments)":
                             st.warning("⚠️ **Zoho Mail API Limitation**: The Zoho Mail API does not support PDF attachments in the current implementation. Emails will be sent with instructions on how to obtain the reports.")
                             
+                            # Zoho notifications are small and sent concurrently, so they start faster
+                            delay_seconds, min_delay_seconds = 1, 0.2
+                            
                             col1, col2 = st.columns(2)
                             with col1:
                                 send_emails = st.button("📧 Send Notification Emails", type="primary")
@@ -929,24 +1278,24 @@ def main():
                                 col1, col2 = st.columns(2)
                                 
                                 with col1:
-                                    batch_size = st.number_input(
-                                        "Batch Size", 
-                                        min_value=1, 
-                                        max_value=50, 
-                                        value=10,
-                                        help="Number of emails to send before taking a longer break"
-                                    )
-                                
-                                with col2:
                                     delay_seconds = st.number_input(
-                                        "Delay Between Emails (seconds)", 
+                                        "Starting Delay Between Emails (seconds)", 
                                         min_value=1, 
                                         max_value=60, 
                                         value=3,
-                                        help="Seconds to wait between each email"
+                                        help="Seconds between emails at the start of the run"
                                     )
                                 
-                                st.info(f"📊 **Sending Strategy**: Will send {batch_size} emails, then wait 30 seconds to prevent rate limiting.")
+                                with col2:
+                                    min_delay_seconds = st.number_input(
+                                        "Minimum Delay Between Emails (seconds)", 
+                                        min_value=0.1, 
+                                        max_value=60.0, 
+                                        value=1.0,
+                                        help="Shortest gap the sender may speed up to"
+                                    )
+                                
+                                st.info(f"📊 **Sending Strategy**: Starts at one email every {delay_seconds} seconds, speeds up towards one every {min_delay_seconds} seconds while the server accepts them, and halves the rate whenever it reports rate limiting.")
                                 
                                 with st.expander("ℹ️ About Rate Limiting (Click to expand)"):
                                     st.markdown("""
@@ -956,21 +1305,20 @@ def main():
                                     - This is normal for bulk email sending
                                     
                                     **How we prevent it:**
-                                    - ⏱️ **Delay between emails**: {delay_seconds} seconds
-                                    - 📦 **Batch processing**: {batch_size} emails per batch
-                                    - ⏸️ **Longer breaks**: 30 seconds between batches
-                                    - 🔄 **Automatic retry**: If rate limited, wait and retry once
+                                    - ⏱️ **Starting delay**: {delay_seconds} seconds between emails
+                                    - 🚀 **Speed-up**: Each accepted email shortens the gap, down to {min_delay_seconds} seconds
+                                    - 🐢 **Backoff**: Each rate limit response halves the sending rate
+                                    - 🔄 **Automatic retry**: If rate limited, retry once at the slower rate
                                     
                                     **Recommended settings:**
-                                    - **Small lists (1-20)**: 3 seconds delay, batch size 10
-                                    - **Medium lists (21-100)**: 5 seconds delay, batch size 5
-                                    - **Large lists (100+)**: 10 seconds delay, batch size 3
+                                    - **Small lists (1-20)**: 3 seconds starting delay
+                                    - **Medium lists (21-100)**: 5 seconds starting delay
+                                    - **Large lists (100+)**: 10 seconds starting delay
                                     
                                     **If you still get rate limited:**
-                                    - Increase the delay between emails
-                                    - Reduce the batch size
+                                    - Increase the minimum delay between emails
                                     - Wait 1-2 hours before trying again
-                                    """.format(delay_seconds=delay_seconds, batch_size=batch_size))
+                                    """.format(delay_seconds=delay_seconds, min_delay_seconds=min_delay_seconds))
                                 
                                 col1, col2 = st.columns(2)
                                 with col1:
@@ -979,264 +1327,123 @@ def main():
                                     download_reports = st.button("💾 Download All Reports", type="secondary")
                         
                         if download_reports:
-                            # Initialize MotherDuck
-                            db, pdf_storage = initialize_motherduck()
-                            if not db:
-                                st.error("❌ Failed to connect to MotherDuck database")
-                                return
-                            
-                            # Store customer data in MotherDuck
-                            st.info("📊 Storing customer data in MotherDuck...")
-                            customer_count = db.store_customers_from_excel(uploaded_file, "Bulk Reports")
-                            st.success(f"✅ Stored {customer_count} customers in MotherDuck database")
-                            
-                            # Generate all reports for download
-                            st.info("Generating all individual reports...")
-                            download_links = []
-                            for idx, (_, row) in enumerate(valid_emails.iterrows()):
-                                try:
-                                    individual_data = row.to_dict()
-                                    analysis = analyze_individual_health(individual_data)
-                                    # Use ENROLLEE ID as filename
-                                    enrollee_id = str(row['ENROLLEE ID'])
-                                    clean_enrollee_id = enrollee_id.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                                    output_path = f"reports/{clean_enrollee_id}.pdf"
-                                    generate_individual_report(individual_data, analysis, output_path)
-                                    
-                                    # Store PDF in MotherDuck
-                                    company_name = individual_data.get('COMPANY', 'Bulk Reports')
-                                    pdf_storage.store_pdf(output_path, enrollee_id, company_name)
-                                    
-                                    download_links.append(output_path)
-                                except Exception as e:
-                                    st.error(f"Error generating report for {row['NAME']}: {str(e)}")
-                            
-                            if download_links:
-                                st.success(f"✅ Generated {len(download_links)} individual reports!")
-                                st.success("✅ All reports stored in MotherDuck database!")
-                                st.info("All reports have been saved to your local directory and cloud database.")
+                            job_id = submit_workbook_job(
+                                'individual_reports', uploaded_file, {'report_workers': report_workers},
+                                f"All individual reports ({uploaded_file.name})"
+                            )
+                            st.session_state['last_job_id'] = job_id
+                            st.success(f"🕒 Queued report generation as job {job_id}. Follow its progress on the Background Jobs page.")
                         
                         if send_emails:
-                            # Initialize MotherDuck
-                            db, pdf_storage = initialize_motherduck()
-                            if not db:
-                                st.error("❌ Failed to connect to MotherDuck database")
-                                return
-                            
-                            # Store customer data in MotherDuck
-                            st.info("📊 Storing customer data in MotherDuck...")
-                            customer_count = db.store_customers_from_excel(uploaded_file, "Bulk Email Reports")
-                            st.success(f"✅ Stored {customer_count} customers in MotherDuck database")
-                            
-                            progress_bar = st.progress(0)
-                            status_text = st.empty()
-                            
-                            success_count = 0
-                            failed_count = 0
-                            failed_emails = []
-                            
-                            total_emails = len(valid_emails)
-                            
-                            for idx, (_, row) in enumerate(valid_emails.iterrows()):
-                                try:
-                                    # Update progress
-                                    progress = (idx + 1) / total_emails
-                                    progress_bar.progress(progress)
-                                    status_text.text(f"Processing {idx + 1}/{total_emails}: {row['NAME']}")
-                                    
-                                    # Add delay between emails to prevent rate limiting
-                                    if idx > 0:  # Skip delay for first email
-                                        status_text.text(f"Waiting {delay_seconds} seconds to prevent rate limiting...")
-                                        time.sleep(delay_seconds)
-                                    
-                                    # Check if we need to take a longer break after batch
-                                    if idx > 0 and idx % batch_size == 0:
-                                        st.warning(f"⏸️ Completed batch of {batch_size} emails. Taking a 30-second break to prevent rate limiting...")
-                                        time.sleep(30)
-                                    
-                                    # Get individual data
-                                    individual_data = row.to_dict()
-                                    
-                                    # Convert numeric columns
-                                    numeric_columns = ['AGE', 'SYSTOLIC', 'DIASTOLIC', 'BLOOD GLUCOSE', 'BMI', 'CHOLESTEROL']
-                                    for col in numeric_columns:
-                                        if col in individual_data and pd.notna(individual_data[col]):
-                                            individual_data[col] = pd.to_numeric(individual_data[col], errors='coerce')
-                                    
-                                    # Handle PSA
-                                    if 'PSA' in individual_data and pd.notna(individual_data['PSA']):
-                                        psa_value = individual_data['PSA']
-                                        if isinstance(psa_value, str):
-                                            individual_data['PSA'] = psa_value
-                                        else:
-                                            individual_data['PSA'] = pd.to_numeric(psa_value, errors='coerce')
-                                    
-                                    # Analyze health
-                                    analysis = analyze_individual_health(individual_data)
-                                    
-                                    # Generate report using ENROLLEE ID as filename
-                                    enrollee_id = str(row['ENROLLEE ID'])
-                                    # Clean the ID for filename but keep it readable
-                                    clean_enrollee_id = enrollee_id.replace('/', '_').replace('\\', '_').replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                                    output_path = f"reports/{clean_enrollee_id}.pdf"
-                                    
-                                    # Create temporary file
-                                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-                                        temp_path = tmp_file.name
-                                    
-                                    # Generate report to temporary file
-                                    generate_individual_report(individual_data, analysis, temp_path)
-                                    
-                                    # Store PDF in MotherDuck
-                                    company_name = individual_data.get('COMPANY', 'Bulk Email Reports')
-                                    pdf_storage.store_pdf(temp_path, enrollee_id, company_name)
-                                    
-                                    # Prepare email content
-                                    name = individual_data.get('NAME', 'Valued Employee')
-                                    subject = f"Your Personalized Health Screening Report - Clearline HMO"
-                                    content = f"""<div style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                                        <p>Dear <strong>{name}</strong>,</p>
-                                        
-                                        <p>Thank you for participating in our health screening program. We are pleased to share your personalized health screening report with you.</p>
-                                        
-                                        <p>Your comprehensive report contains:</p>
-                                        <ul>
-                                            <li>Detailed analysis of your health metrics</li>
-                                            <li>Personalized recommendations based on your results</li>
-                                            <li>Educational content about maintaining good health</li>
-                                            <li>Contact information for follow-up care</li>
-                                        </ul>
-                                        
-                                        <p><strong>Important Notes:</strong></p>
-                                        <ul>
-                                            <li>This report is confidential and should be shared only with your healthcare provider</li>
-                                            <li>We recommend discussing any concerns with your doctor</li>
-                                            <li>Keep this report for your medical records</li>
-                                        </ul>
-                                        
-                                        <p>If you have any questions about your results, please contact our medical team:</p>
-                                        <p>📱 <strong>WhatsApp Telemedicine:</strong> 08076490056 (Chat with a medical doctor)<br/>
-                                        📧 <strong>Email:</strong> hello@clearlinehmo.com</p>
-                                        
-                                        <p>We are committed to supporting your health and wellbeing.</p>
-                                        
-                                        <div style="margin-top: 40px;">
-                                            <p>Best regards,</p>
-                                            <p style="margin-top: 20px; font-weight: bold; color: #2c5aa0;">Clearline HMO Medical Team</p>
-                                        </div>
-                                        
-                                        <hr style="margin-top: 30px; border: none; border-top: 1px solid #ddd;">
-                                        <p style="font-size: 12px; color: #666; margin-top: 10px;">This is an automated message. Please do not reply to this email.</p>
-                                    </div>"""
-                                    
-                                    # Send email using selected method
-                                    if email_method == "SMTP (With PDF attachments)":
-                                        success, message = send_email_via_smtp(
-                                            to_email=row['EMAIL'],
-                                            subject=subject,
-                                            content=content,
-                                            attachment_path=temp_path,
-                                            smtp_password=smtp_password
-                                        )
-                                    else:  # Zoho API
-                                        success, message = send_email_via_zoho(
-                                            to_email=row['EMAIL'],
-                                            subject=subject,
-                                            content=content,
-                                            attachment_path=temp_path
-                                        )
-                                    
-                                    if success:
-                                        success_count += 1
-                                        st.success(f"✅ Sent to {row['NAME']} ({row['EMAIL']})")
-                                    else:
-                                        # Check if it's a rate limiting error
-                                        if "Unusual sending activity" in message or "550" in message:
-                                            st.warning(f"⚠️ Rate limit hit for {row['NAME']}. Waiting 30 seconds before continuing...")
-                                            time.sleep(30)  # Wait 30 seconds for rate limit to reset
-                                            
-                                            # Retry once after waiting
-                                            if email_method == "SMTP (With PDF attachments)":
-                                                success, message = send_email_via_smtp(
-                                                    to_email=row['EMAIL'],
-                                                    subject=subject,
-                                                    content=content,
-                                                    attachment_path=temp_path,
-                                                    smtp_password=smtp_password
-                                                )
-                                            else:  # Zoho API
-                                                success, message = send_email_via_zoho(
-                                                    to_email=row['EMAIL'],
-                                                    subject=subject,
-                                                    content=content,
-                                                    attachment_path=temp_path
-                                                )
-                                            
-                                            if success:
-                                                success_count += 1
-                                                st.success(f"✅ Sent to {row['NAME']} ({row['EMAIL']}) - Retry successful")
-                                            else:
-                                                failed_count += 1
-                                                failed_emails.append({
-                                                    'Name': row['NAME'],
-                                                    'Email': row['EMAIL'],
-                                                    'Error': f"Rate limit retry failed: {message}"
-                                                })
-                                                st.error(f"❌ Failed to send to {row['NAME']} ({row['EMAIL']}) after retry: {message}")
-                                        else:
-                                            failed_count += 1
-                                            failed_emails.append({
-                                                'Name': row['NAME'],
-                                                'Email': row['EMAIL'],
-                                                'Error': message
-                                            })
-                                            st.error(f"❌ Failed to send to {row['NAME']} ({row['EMAIL']}): {message}")
-                                    
-                                    # Clean up temporary file
-                                    try:
-                                        os.unlink(temp_path)
-                                    except:
-                                        pass
-                                    
-                                    # Small delay to avoid rate limiting
-                                    time.sleep(0.5)
-                                    
-                                except Exception as e:
-                                    failed_count += 1
-                                    failed_emails.append({
-                                        'Name': row.get('NAME', 'Unknown'),
-                                        'Email': row.get('EMAIL', 'Unknown'),
-                                        'Error': str(e)
-                                    })
-                            
-                            # Final results
-                            progress_bar.progress(1.0)
-                            status_text.text("✅ Email sending completed!")
-                            
-                            # Display results
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.success(f"✅ Successfully sent: {success_count} emails")
-                            with col2:
-                                st.error(f"❌ Failed to send: {failed_count} emails")
-                            
-                            # Show failed emails if any
-                            if failed_emails:
-                                st.subheader("❌ Failed Emails")
-                                failed_df = pd.DataFrame(failed_emails)
-                                st.dataframe(failed_df)
-                                
-                                # Download failed emails as CSV
-                                csv = failed_df.to_csv(index=False)
-                                st.download_button(
-                                    label="📥 Download Failed Emails List",
-                                    data=csv,
-                                    file_name="failed_emails.csv",
-                                    mime="text/csv"
-                                )
+                            secrets = {'smtp_password': smtp_password} if email_method == "SMTP (With PDF attachments)" else None
+                            job_id = submit_workbook_job(
+                                'bulk_email', uploaded_file,
+                                {
+                                    'email_method': email_method,
+                                    'delay_seconds': delay_seconds,
+                                    'min_delay_seconds': min_delay_seconds,
+                                    'report_workers': report_workers
+                                },
+                                f"Bulk emails ({uploaded_file.name})",
+                                secrets=secrets
+                            )
+                            st.session_state['last_job_id'] = job_id
+                            st.success(f"🕒 Queued {len(valid_emails)} emails as job {job_id}. Follow its progress on the Background Jobs page; you can close this tab.")
                     
             except Exception as e:
                 st.error(f"❌ Error reading file: {str(e)}")
+    
+    elif page == "Background Jobs":
+        st.header("🕒 Background Jobs")
+        
+        job_queue = get_background_jobs()
+        jobs = job_queue.list_jobs()
+        
+        if not jobs:
+            st.info("No background jobs yet. Start one from the Company Report or Bulk Email Reports page.")
+            return
+        
+        jobs_df = pd.DataFrame([{
+            'Job': job['id'],
+            'Description': job['description'],
+            'Status': job['status'],
+            'Progress': f"{job['progress_done']}/{job['progress_total']}",
+            'Created': job['created_at'],
+            'Finished': job['finished_at']
+        } for job in jobs])
+        st.dataframe(jobs_df)
+        
+        job_ids = [job['id'] for job in jobs]
+        last_job_id = st.session_state.get('last_job_id')
+        selected_id = st.selectbox(
+            "Select a job",
+            job_ids,
+            index=job_ids.index(last_job_id) if last_job_id in job_ids else 0,
+            format_func=lambda job_id: next(f"{job['id']} - {job['description']} ({job['status']})" for job in jobs if job['id'] == job_id)
+        )
+        job = job_queue.get_job(selected_id)
+        result = job['result'] or {}
+        
+        st.subheader(f"📋 {job['description']}")
+        if job['progress_total']:
+            st.progress(min(job['progress_done'] / job['progress_total'], 1.0))
+        st.text(job['message'] or job['status'].capitalize())
+        
+        if job['status'] == 'failed':
+            st.error(f"❌ Job failed: {job['error']}")
+        
+        if job['status'] == 'completed':
+            if job['job_type'] == 'company_report':
+                st.metric("Total Staff", result.get('total_staff'))
+                report_path = result.get('report_path')
+                if report_path and os.path.exists(report_path):
+                    with open(report_path, "rb") as file:
+                        st.download_button(
+                            label="📥 Download Company Report",
+                            data=file.read(),
+                            file_name=os.path.basename(report_path),
+                            mime="application/pdf"
+                        )
+            
+            elif job['job_type'] == 'individual_reports':
+                st.success(f"✅ Generated {len(result.get('report_paths', []))} individual reports!")
+                if result.get('failed_reports'):
+                    st.subheader("❌ Failed Reports")
+                    st.dataframe(pd.DataFrame(result['failed_reports']))
+            
+            elif job['job_type'] == 'bulk_email':
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.success(f"✅ Successfully sent: {result.get('success_count', 0)} emails")
+                with col2:
+                    st.error(f"❌ Failed to send: {result.get('failed_count', 0)} emails")
+                
+                # Show failed emails if any
+                if result.get('failed_emails'):
+                    st.subheader("❌ Failed Emails")
+                    failed_df = pd.DataFrame(result['failed_emails'])
+                    st.dataframe(failed_df)
+                    
+                    # Download failed emails as CSV
+                    csv = failed_df.to_csv(index=False)
+                    st.download_button(
+                        label="📥 Download Failed Emails List",
+                        data=csv,
+                        file_name="failed_emails.csv",
+                        mime="text/csv"
+                    )
+        
+        with st.expander("📜 Job Log"):
+            events = job_queue.get_events(selected_id)
+            if events:
+                st.dataframe(pd.DataFrame(events)[['created_at', 'level', 'message']])
+            else:
+                st.write("No messages yet.")
+        
+        st.button("🔄 Refresh")
+        if job['status'] in ('queued', 'running') and st.checkbox("Auto-refresh while the job runs", value=True):
+            time.sleep(2)
+            st.rerun()
 
 if __name__ == "__main__":
     main()